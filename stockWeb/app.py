@@ -1,23 +1,37 @@
 # app.py
-from flask import Flask, request, jsonify, render_template
-from util_data import suggest_tickers, fetch_price_history, compute_indicators
-from model_predict import train_predict_model
+from flask import Flask, Response, request, jsonify, render_template, stream_with_context
+from util_data import suggest_tickers, fetch_price_history
+from predict_service import get_indicators, predict_symbol, predict_batch, cached_prediction
+from startup import lazy_module, start_preload, startup_report
+from sentiment import get_analyzer, score_list, label_for, fetch_news
+from metrics import init_app as init_metrics, stage
+from cache_store import get_cache
+import http_cache
+import upstream
+import snapshot
+import history_export
+import json
 from dotenv import load_dotenv
-from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
 import traceback
 import os
-import requests
-import pandas as pd
-import numpy as np
 import io
 
+# heavy modules are imported on first use (see startup.py)
+pd = lazy_module("pandas")
+np = lazy_module("numpy")
+
 # load .env
 load_dotenv()
 ALPHAVANTAGE_KEY = os.getenv("ALPHAVANTAGE_KEY")
 NEWSAPI_KEY = os.getenv("NEWSAPI_KEY")  # set in your .env if you want news
+BATCH_MAX_SYMBOLS = int(os.getenv("STOCKSENSE_BATCH_MAX_SYMBOLS", 200))
 
 app = Flask(__name__, static_folder="static", template_folder="templates")
-analyzer = SentimentIntensityAnalyzer()
+init_metrics(app)
+
+start_preload()
+# map the end-of-day snapshot now so forked workers share the mapping
+snapshot.get_snapshot()
 
 def trace_to_string():
     buf = io.StringIO()
@@ -26,6 +40,13 @@ def trace_to_string():
     lines = txt.strip().splitlines()
     return "\n".join(lines[-12:])
 
+def upstream_error(e):
+    resp = jsonify({"error": "upstream_unavailable", "message": str(e)})
+    resp.status_code = 503
+    if e.retry_after:
+        resp.headers["Retry-After"] = str(int(e.retry_after))
+    return resp
+
 @app.route("/")
 def home():
     return render_template("index.html")
@@ -40,6 +61,10 @@ def compare_page():
     return render_template("compare.html")
 
 
+@app.route("/api/startup")
+def api_startup():
+    return jsonify(startup_report())
+
 @app.route("/api/search")
 def api_search():
     q = request.args.get("q", "")
@@ -56,87 +81,160 @@ def api_history(symbol):
     period = request.args.get("period", "1mo")
     interval = request.args.get("interval", "1d")
     try:
-        df = fetch_price_history(symbol, period=period, interval=interval)
-        ind = compute_indicators(df)
-        if 'date' not in ind.columns:
-            ind = ind.reset_index().rename(columns={ind.columns[0]:'date'})
-        try:
-            ind['date'] = pd.to_datetime(ind['date']).dt.strftime('%Y-%m-%dT%H:%M:%S')
-        except Exception:
-            ind['date'] = ind['date'].astype(str)
-        ind = ind.replace({np.nan: None})
-        records = ind.to_dict(orient="records")
-        def normalize(obj):
-            if isinstance(obj, dict):
-                return {k: normalize(v) for k, v in obj.items()}
-            if isinstance(obj, (np.integer,)):
-                return int(obj)
-            if isinstance(obj, (np.floating,)):
-                return float(obj)
-            if isinstance(obj, np.bool_):
-                return bool(obj)
-            return obj
-        records = [normalize(r) for r in records]
-        return jsonify({"symbol": symbol, "history": records})
+        # answer revalidations before computing indicators or serializing
+        validator = http_cache.history_etag("history", symbol, period, interval)
+        if validator is not None:
+            cached = http_cache.not_modified(*validator)
+            if cached is not None:
+                return cached
+        ind = get_indicators(symbol, period=period, interval=interval)
+        stale = bool(ind.attrs.get("stale"))
+        with stage("serialize"):
+            if 'date' not in ind.columns:
+                ind = ind.reset_index().rename(columns={ind.columns[0]:'date'})
+            try:
+                ind['date'] = pd.to_datetime(ind['date']).dt.strftime('%Y-%m-%dT%H:%M:%S')
+            except Exception:
+                ind['date'] = ind['date'].astype(str)
+            ind = ind.replace({np.nan: None})
+            records = ind.to_dict(orient="records")
+            def normalize(obj):
+                if isinstance(obj, dict):
+                    return {k: normalize(v) for k, v in obj.items()}
+                if isinstance(obj, (np.integer,)):
+                    return int(obj)
+                if isinstance(obj, (np.floating,)):
+                    return float(obj)
+                if isinstance(obj, np.bool_):
+                    return bool(obj)
+                return obj
+            records = [normalize(r) for r in records]
+            payload = {"symbol": symbol, "history": records}
+            if stale:
+                # provider unavailable: last known data, don't let clients keep it
+                payload["stale"] = True
+            if stale or validator is None:
+                return http_cache.no_store(jsonify(payload))
+            return http_cache.with_cache_headers(jsonify(payload), *validator)
+    except upstream.UpstreamUnavailable as e:
+        return upstream_error(e)
     except Exception as e:
         traceback.print_exc()
         return jsonify({"error":"Failed to fetch/process history","message":str(e),"trace":trace_to_string()}), 400
 
+@app.route("/api/export/<symbol>")
+def api_export(symbol):
+    """
+    The history as a download, streamed in chunks (see history_export.py):
+    ?period=5y&interval=1d&format=csv|ndjson|arrow&indicators=1
+    """
+    period = request.args.get("period", "1y")
+    interval = request.args.get("interval", "1d")
+    fmt = request.args.get("format", "csv").lower()
+    indicators = request.args.get("indicators", "0").lower() in ("1", "true", "yes")
+    try:
+        history_export.check_format(fmt)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        body, stale = history_export.open_export(symbol, period=period, interval=interval, fmt=fmt,
+                                                 indicators=indicators)
+    except upstream.UpstreamUnavailable as e:
+        return upstream_error(e)
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({"error":"Failed to fetch history","message":str(e),"trace":trace_to_string()}), 400
+    mimetype, ext = history_export.FORMATS[fmt]
+    resp = Response(stream_with_context(body), mimetype=mimetype)
+    resp.headers["Content-Disposition"] = "attachment; filename=%s_%s_%s.%s" % (
+        symbol.upper(), period, interval, ext)
+    if stale:
+        # provider unavailable: last known data, don't let clients keep it
+        resp.headers["Cache-Control"] = "no-store"
+        resp.headers["X-StockSense-Stale"] = "1"
+    return resp
+
+@app.route("/api/predict/batch", methods=["GET", "POST"])
+def api_predict_batch():
+    """
+    Predictions for many symbols as NDJSON, one line per symbol in the order
+    they finish. POST {"symbols": [...], "period", "interval"} or
+    GET ?symbols=AAPL,MSFT&period=2y&interval=1d
+    """
+    data = request.get_json(silent=True) or {}
+    symbols = data.get("symbols") or request.args.get("symbols", "").split(",")
+    period = data.get("period") or request.args.get("period", "2y")
+    interval = data.get("interval") or request.args.get("interval", "1d")
+    symbols = list(dict.fromkeys(s.strip().upper() for s in symbols if s and s.strip()))
+    if not symbols:
+        return jsonify({"error": "no symbols given"}), 400
+    if len(symbols) > BATCH_MAX_SYMBOLS:
+        return jsonify({"error": "too many symbols", "max": BATCH_MAX_SYMBOLS}), 400
+    def lines():
+        for out in predict_batch(symbols, period=period, interval=interval):
+            yield json.dumps(out) + "\n"
+    return Response(stream_with_context(lines()), mimetype="application/x-ndjson")
+
 @app.route("/api/predict/<symbol>", methods=["GET"])
 def api_predict(symbol):
     period = request.args.get("period", "2y")
     interval = request.args.get("interval", "1d")
     try:
-        df = fetch_price_history(symbol, period=period, interval=interval)
-        df_ind = compute_indicators(df)
-        if 'date' not in df_ind.columns:
-            df_ind = df_ind.reset_index().rename(columns={df_ind.columns[0]:'date'})
-        result, model, features = train_predict_model(df_ind, n_lags=10)
-        if isinstance(result, dict) and "error" in result:
-            return jsonify({"error":"model_error","detail": result.get("error")}), 400
-        last_close = None
-        try:
-            last_close = float(df_ind['Close'].iloc[-1])
-        except Exception:
-            last_close = None
-        predicted = float(result['prediction'])
-        pct_change = None
-        if last_close:
-            pct_change = (predicted - last_close) / last_close * 100.0
-        out = {
-            "symbol": symbol,
-            "last_close": last_close,
-            "predicted_close": predicted,
-            "predicted_pct_change": pct_change,
-            "confidence": result.get('confidence'),
-            "r2": result.get('r2')
-        }
-        return jsonify(out)
+        # a prediction cached since the snapshot was built is fresher
+        out = cached_prediction(symbol, period, interval)
+        snap = snapshot.get_snapshot() if out is None else None
+        if snap is not None:
+            out = snap.prediction(symbol, period, interval)
+        if out is None:
+            out = predict_symbol(symbol, period=period, interval=interval)
+        if "error" in out:
+            return jsonify({"error":"model_error","detail": out.get("error")}), 400
+        with stage("serialize"):
+            return jsonify(out)
+    except upstream.UpstreamUnavailable as e:
+        return upstream_error(e)
     except Exception as e:
         traceback.print_exc()
         return jsonify({"error":"Failed to predict","message":str(e),"trace":trace_to_string()}), 400
 
+@app.route("/api/snapshot")
+def api_snapshot():
+    """
+    The end-of-day snapshot (see snapshot.py): every symbol, or
+    ?symbols=AAPL,MSFT. 404 if no snapshot has been built.
+    """
+    snap = snapshot.get_snapshot()
+    if snap is None:
+        return jsonify({"error": "no snapshot", "hint": "python snapshot.py build"}), 404
+    symbols = [s.strip().upper() for s in request.args.get("symbols", "").split(",") if s.strip()]
+    etag = http_cache.make_etag("snapshot", snap.built_at, ",".join(symbols))
+    cached = http_cache.not_modified(etag, http_cache.max_age_for(snap.interval))
+    if cached is not None:
+        return cached
+    with stage("serialize"):
+        entries = [snap.get(s) for s in (symbols or snap.symbols) if s in snap]
+        payload = {"built_at": snap.built_at, "period": snap.period, "interval": snap.interval,
+                   "symbols": entries}
+        return http_cache.with_cache_headers(jsonify(payload), etag, http_cache.max_age_for(snap.interval))
+
+@app.route("/api/snapshot/<symbol>")
+def api_snapshot_symbol(symbol):
+    snap = snapshot.get_snapshot()
+    if snap is None or symbol not in snap:
+        return jsonify({"error": "not in snapshot", "symbol": symbol}), 404
+    etag = http_cache.make_etag("snapshot", snap.built_at, symbol.upper())
+    cached = http_cache.not_modified(etag, http_cache.max_age_for(snap.interval))
+    if cached is not None:
+        return cached
+    out = dict(snap.get(symbol), built_at=snap.built_at)
+    return http_cache.with_cache_headers(jsonify(out), etag, http_cache.max_age_for(snap.interval))
+
 @app.route("/api/sentiment", methods=["POST"])
 def api_sentiment():
     data = request.get_json() or {}
     headlines = data.get("headlines", [])
     tweets = data.get("tweets", [])
     announcements = data.get("announcements", [])
-    def score_list(items):
-        scores = []
-        for t in items:
-            v = analyzer.polarity_scores(str(t))
-            scores.append(v)
-        if not scores:
-            return {"count":0,"avg_compound":0,"pos":0,"neg":0,"neu":0}
-        compounds = [s['compound'] for s in scores]
-        return {
-            "count": len(scores),
-            "avg_compound": float(sum(compounds)/len(compounds)),
-            "pos": float(sum(s['pos'] for s in scores)/len(scores)),
-            "neg": float(sum(s['neg'] for s in scores)/len(scores)),
-            "neu": float(sum(s['neu'] for s in scores)/len(scores))
-        }
     try:
         hscore = score_list(headlines)
         tscore = score_list(tweets)
@@ -147,10 +245,7 @@ def api_sentiment():
         else:
             overall_comp = (hscore["avg_compound"]*hscore["count"] + tscore["avg_compound"]*tscore["count"] + ascore["avg_compound"]*ascore["count"]) / total_count
             overall = {"compound": overall_comp}
-        comp = overall["compound"]
-        label = "neutral"
-        if comp >= 0.05: label = "positive"
-        elif comp <= -0.05: label = "negative"
+        label = label_for(overall["compound"])
         return jsonify({
             "headline": hscore,
             "tweets": tscore,
@@ -170,6 +265,15 @@ def api_compare():
     if not left or not right:
         return jsonify({"error":"provide left and right tickers"}), 400
     try:
+        validator = http_cache.history_etag("l", left, period, "1d")
+        if validator is not None:
+            other = http_cache.history_etag("r", right, period, "1d")
+            validator = None if other is None else (http_cache.make_etag("compare", validator[0], other[0]),
+                                                    min(validator[1], other[1]))
+        if validator is not None:
+            cached = http_cache.not_modified(*validator)
+            if cached is not None:
+                return cached
         dleft = fetch_price_history(left, period=period)
         dright = fetch_price_history(right, period=period)
         def summarize(df):
@@ -177,10 +281,18 @@ def api_compare():
             end = df['Close'].iloc[-1]
             pct = (end - start)/start*100.0
             return {"start": float(start), "end": float(end), "pct_change": float(pct)}
-        return jsonify({
+        payload = {
             "left": {"symbol": left, "summary": summarize(dleft)},
             "right": {"symbol": right, "summary": summarize(dright)}
-        })
+        }
+        if dleft.attrs.get("stale") or dright.attrs.get("stale"):
+            payload["stale"] = True
+            return http_cache.no_store(jsonify(payload))
+        if validator is None:
+            return http_cache.no_store(jsonify(payload))
+        return http_cache.with_cache_headers(jsonify(payload), *validator)
+    except upstream.UpstreamUnavailable as e:
+        return upstream_error(e)
     except Exception as e:
         traceback.print_exc()
         return jsonify({"error": str(e), "trace": trace_to_string()}), 400
@@ -190,42 +302,27 @@ def api_extras(symbol):
     """
     Returns { news: [...], _errors?: {...} }
     Uses NewsAPI.org (NEWSAPI_KEY required in .env).
+    Successful results are cached for NEWS_MAX_AGE seconds and carry an ETag
+    derived from their content.
     """
     q_param = request.args.get("q", "")
     company_q = q_param.strip() or symbol
-    results = {"news": []}
-    errors = {}
-
-    if NEWSAPI_KEY:
-        try:
-            params = {
-                "q": company_q,
-                "pageSize": 12,
-                "sortBy": "publishedAt",
-                "language": "en",
-                "apiKey": NEWSAPI_KEY
-            }
-            resp = requests.get("https://newsapi.org/v2/everything", params=params, timeout=12)
-            data = resp.json()
-            if resp.status_code == 200 and data.get("articles"):
-                for a in data.get("articles", [])[:12]:
-                    results["news"].append({
-                        "title": a.get("title"),
-                        "source": a.get("source", {}).get("name"),
-                        "url": a.get("url"),
-                        "publishedAt": a.get("publishedAt"),
-                        "description": a.get("description")
-                    })
-            else:
-                errors["newsapi"] = data.get("message") or data.get("status") or f"HTTP {resp.status_code}"
-        except Exception as e:
-            errors["newsapi"] = str(e)
-    else:
-        errors["newsapi"] = "NEWSAPI_KEY not set in .env"
-
-    if errors:
-        results["_errors"] = errors
-    return jsonify(results)
+    news_key = "news:" + company_q.lower()
+    results = get_cache().get(news_key)
+    if results is not None:
+        etag = http_cache.make_etag("extras", json.dumps(results, sort_keys=True))
+        cached = http_cache.not_modified(etag, http_cache.NEWS_MAX_AGE)
+        if cached is not None:
+            return cached
+        return http_cache.with_cache_headers(jsonify(results), etag, http_cache.NEWS_MAX_AGE)
+    articles, error = fetch_news(company_q, NEWSAPI_KEY)
+    results = {"news": articles}
+    if error:
+        results["_errors"] = {"newsapi": error}
+        return jsonify(results)
+    get_cache().set(news_key, results, ttl=http_cache.NEWS_MAX_AGE)
+    etag = http_cache.make_etag("extras", json.dumps(results, sort_keys=True))
+    return http_cache.with_cache_headers(jsonify(results), etag, http_cache.NEWS_MAX_AGE)
 
 if __name__ == "__main__":
     app.run(debug=True, host="127.0.0.1", port=5000)
@@ -0,0 +1,95 @@
+# benchmarks/fixtures.py
+"""
+Market data fixtures for the benchmarks.
+
+The small fixtures are checked in under benchmarks/data. The large ones
+(a year of hourly bars, five years of minute bars) would be tens of MB, so
+they are generated from a fixed seed on first use and written next to them;
+the same seed always gives the same bytes.
+"""
+import os
+import sys
+import csv
+import random
+
+import pandas as pd
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(HERE, "data")
+sys.path.insert(0, os.path.dirname(HERE))
+
+# fixture name -> (period, interval) in yfinance terms
+OHLCV_SIZES = {
+    "1mo_1d": ("1mo", "1d"),
+    "1y_1d": ("1y", "1d"),
+    "5y_1d": ("5y", "1d"),
+    "1y_1h": ("1y", "1h"),
+    "5y_1m": ("5y", "1m"),
+}
+
+CHECKED_IN = ("1mo_1d", "1y_1d", "5y_1d")
+
+_cache = {}
+
+
+def ohlcv_path(name):
+    return os.path.join(DATA_DIR, "ohlcv_%s.csv" % name)
+
+
+def generate_ohlcv(name):
+    from providers import synthetic_price_history
+    period, interval = OHLCV_SIZES[name]
+    df = synthetic_price_history("BENCH", period=period, interval=interval)
+    return df[["Open", "High", "Low", "Close", "Adj Close", "Volume", "Dividends", "Stock Splits"]]
+
+
+def load_ohlcv(name):
+    """
+    Load (generating if needed) a fixture as a yfinance-shaped DataFrame.
+    """
+    if name in _cache:
+        return _cache[name].copy()
+    path = ohlcv_path(name)
+    if not os.path.exists(path):
+        os.makedirs(DATA_DIR, exist_ok=True)
+        generate_ohlcv(name).to_csv(path, float_format="%.6f")
+    df = pd.read_csv(path, index_col=0, parse_dates=True)
+    df.index.name = "Date"
+    _cache[name] = df
+    return df.copy()
+
+
+def ticker_list(n=50000, seed=7):
+    """
+    Deterministic list of (symbol, name) pairs for suggest_tickers.
+    """
+    rnd = random.Random(seed)
+    letters = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+    words = ["Global", "Holdings", "Energy", "Capital", "Systems", "Pharma", "Bank",
+             "Digital", "Motors", "Foods", "Networks", "Resources", "Group", "Labs",
+             "Industries", "Partners", "Software", "Retail", "Health", "Media"]
+    seen = set()
+    out = []
+    while len(out) < n:
+        sym = "".join(rnd.choice(letters) for _ in range(rnd.randint(2, 5)))
+        if sym in seen:
+            continue
+        seen.add(sym)
+        name = " ".join(rnd.choice(words) for _ in range(rnd.randint(1, 3)))
+        out.append((sym, "%s %s Inc" % (sym.title(), name)))
+    return out
+
+
+def write_ticker_csv(path, n=50000):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["symbol", "name"])
+        writer.writerows(ticker_list(n))
+
+
+if __name__ == "__main__":
+    # regenerate the checked-in fixtures
+    os.makedirs(DATA_DIR, exist_ok=True)
+    for name in CHECKED_IN:
+        generate_ohlcv(name).to_csv(ohlcv_path(name), float_format="%.6f")
+        print("wrote", ohlcv_path(name))
@@ -0,0 +1,94 @@
+# benchmarks/model_artifacts.py
+"""
+Pickled sklearn forest vs compact_model artifact.
+
+    python benchmarks/model_artifacts.py
+    python benchmarks/model_artifacts.py --depths 16 12 8 --repeats 50
+
+For each daily fixture the default model (200 trees) is fitted once, then
+compared as a pickle and as compact artifacts (exact, and pruned to each
+--depths value): artifact size, load time, single-row and 1000-row predict
+latency, and the largest prediction difference from sklearn over the
+training rows. The cost of importing the inference code in a fresh
+interpreter is printed at the end.
+"""
+import os
+import sys
+import time
+import pickle
+import argparse
+import statistics
+import warnings
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+warnings.filterwarnings("ignore")
+
+import numpy as np
+
+import fixtures
+import util_data
+import model_predict
+import compact_model
+from startup import import_cost
+
+
+def median_ms(fn, repeats):
+    fn()
+    times = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return statistics.median(times) * 1000.0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Model artifact size/load/latency benchmark")
+    parser.add_argument("--fixtures", nargs="*", default=["1y_1d", "5y_1d"])
+    parser.add_argument("--depths", nargs="*", type=int, default=[12, 8])
+    parser.add_argument("--repeats", type=int, default=30)
+    args = parser.parse_args(argv)
+
+    print("%-22s %10s %10s %10s %10s %11s" % ("artifact", "size KiB", "load ms", "1 row ms",
+                                              "1000 rows", "max |diff|"))
+    for name in args.fixtures:
+        ind = util_data.compute_indicators(fixtures.load_ohlcv(name))
+        X, y, _ = model_predict.prepare_features(ind, n_lags=10)
+        X = X.to_numpy()
+        _, rf, _ = model_predict.train_predict_model(ind, n_lags=10)
+        reference = rf.predict(X)
+        rows = X[np.arange(1000) % len(X)]
+        row = X[-1:]
+
+        blob = pickle.dumps(rf, protocol=pickle.HIGHEST_PROTOCOL)
+        print("%-22s %10.0f %10.2f %10.3f %10.2f %11s" % (
+            "sklearn[%s]" % name, len(blob) / 1024.0,
+            median_ms(lambda: pickle.loads(blob), max(3, args.repeats // 5)),
+            median_ms(lambda: rf.predict(row), args.repeats),
+            median_ms(lambda: rf.predict(rows), max(3, args.repeats // 5)), "-"))
+
+        for depth in [None] + args.depths:
+            buf = compact_model.compile_forest(rf, max_depth=depth).to_bytes()
+            forest = compact_model.CompactForest.from_bytes(buf)
+            diff = np.abs(forest.predict(X) - reference).max()
+            label = "compact[%s]" % name if depth is None else "compact d%d[%s]" % (depth, name)
+            print("%-22s %10.0f %10.2f %10.3f %10.2f %11.2e" % (
+                label, len(buf) / 1024.0,
+                median_ms(lambda: compact_model.CompactForest.from_bytes(buf), args.repeats),
+                median_ms(lambda: forest.predict_one(row[0]), args.repeats),
+                median_ms(lambda: forest.predict(rows), max(3, args.repeats // 5)), diff))
+
+    print()
+    print("import cost in a fresh interpreter (ms, package self time):")
+    for target in ("compact_model", "sklearn.ensemble"):
+        rows = import_cost(target)
+        total = sum(us for _, us, _ in rows) / 1000.0
+        print("  import %-18s %8.1f ms  (%s)" % (target, total,
+                                                ", ".join(p for p, _, _ in rows[:4])))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,175 @@
+# benchmarks/run.py
+"""
+Offline benchmark suite for the data/model hot path and the API routes.
+
+    python benchmarks/run.py                    # everything
+    python benchmarks/run.py --quick            # skip the minute-bar fixture
+    python benchmarks/run.py -k indicators      # only matching benchmarks
+    python benchmarks/run.py --save base.json   # record results
+    python benchmarks/run.py --compare base.json --threshold 20
+
+The provider chain is replaced with one serving the fixtures in benchmarks/data, and
+the history cache is disabled, so every run does the full work without network
+access. Each benchmark reports the median and minimum wall time over its
+repeats, and the peak Python memory allocated during one extra traced run.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tracemalloc
+import statistics
+import warnings
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+os.environ["STOCKSENSE_CACHE"] = "none"
+warnings.filterwarnings("ignore")
+
+import fixtures
+import util_data
+import providers
+import model_predict
+import compact_frame
+from app import app
+
+# symbol -> fixture served by the stub, e.g. "BENCH_1Y_1D" -> "1y_1d"
+FIXTURE_SYMBOLS = {("BENCH_" + name).upper(): name for name in fixtures.OHLCV_SIZES}
+
+
+class FixtureProvider(providers.Provider):
+    name = "fixtures"
+
+    def history(self, symbol, period, interval):
+        name = FIXTURE_SYMBOLS.get(symbol.upper())
+        if name is None:
+            raise providers.NoData("No data for symbol: " + symbol)
+        return fixtures.load_ohlcv(name)
+
+
+def install_stubs(n_tickers):
+    providers.set_chain([FixtureProvider()])
+    util_data._TICKER_DB = fixtures.ticker_list(n_tickers)
+
+
+def measure(fn, repeats):
+    fn()  # warm-up (lazy imports, fixture load)
+    times = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "median_ms": statistics.median(times) * 1000.0,
+        "min_ms": min(times) * 1000.0,
+        "peak_kb": peak / 1024.0,
+        "repeats": repeats,
+    }
+
+
+def build_benchmarks(sizes):
+    """
+    Return [(name, callable, repeats)].
+    """
+    benches = []
+    client = app.test_client()
+
+    def get_ok(path):
+        resp = client.get(path)
+        if resp.status_code != 200:
+            raise RuntimeError("%s -> %s %s" % (path, resp.status_code, resp.data[:200]))
+        return resp
+
+    for size in sizes:
+        big = size.endswith("_1m")
+        raw = fixtures.load_ohlcv(size)
+        ind = util_data.compute_indicators(raw)
+        benches.append(("compute_indicators[%s]" % size,
+                        lambda raw=raw: util_data.compute_indicators(raw), 3 if big else 15))
+        benches.append(("compute_indicators_compact[%s]" % size,
+                        lambda raw=raw: compact_frame.compute_indicators_compact(
+                            compact_frame.CompactHistory.from_frame(raw)), 3 if big else 15))
+        benches.append(("prepare_features[%s]" % size,
+                        lambda ind=ind: model_predict.prepare_features(ind, n_lags=10), 3 if big else 15))
+        period, interval = fixtures.OHLCV_SIZES[size]
+        benches.append(("GET /api/history[%s]" % size,
+                        lambda p="/api/history/BENCH_%s?period=%s&interval=%s" % (size, period, interval): get_ok(p),
+                        2 if big else 10))
+
+    # forest fits are only meaningful (and affordable) on daily bars
+    for size in [s for s in sizes if s in ("1y_1d", "5y_1d")]:
+        ind = util_data.compute_indicators(fixtures.load_ohlcv(size))
+        benches.append(("train_predict_model[%s]" % size,
+                        lambda ind=ind: model_predict.train_predict_model(ind, n_lags=10), 3))
+    if "1y_1d" in sizes:
+        benches.append(("GET /api/predict[1y_1d]",
+                        lambda: get_ok("/api/predict/BENCH_1Y_1D?period=1y&interval=1d"), 3))
+        benches.append(("GET /api/compare[1y_1d]",
+                        lambda: get_ok("/api/compare?left=BENCH_1Y_1D&right=BENCH_1Y_1D&period=1y"), 10))
+
+    for q in ("a", "glob", "hold energy"):
+        benches.append(("suggest_tickers[%r]" % q,
+                        lambda q=q: util_data.suggest_tickers(q, max_suggestions=8), 5))
+    benches.append(("GET /api/search", lambda: get_ok("/api/search?q=cap&max=8"), 5))
+    return benches
+
+
+def compare(results, baseline, threshold):
+    """
+    Print regressions against a saved baseline; returns the number found.
+    """
+    regressions = 0
+    for name, r in results.items():
+        old = baseline.get(name)
+        if not old:
+            continue
+        change = (r["median_ms"] - old["median_ms"]) / old["median_ms"] * 100.0 if old["median_ms"] else 0.0
+        mem = (r["peak_kb"] - old["peak_kb"]) / old["peak_kb"] * 100.0 if old["peak_kb"] else 0.0
+        if change > threshold or mem > threshold:
+            regressions += 1
+            print("REGRESSION %-40s time %+6.1f%%  memory %+6.1f%%" % (name, change, mem))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="StockSense benchmarks")
+    parser.add_argument("-k", dest="pattern", default="", help="only run benchmarks containing this text")
+    parser.add_argument("--quick", action="store_true", help="skip the 5y of 1m bars fixture")
+    parser.add_argument("--tickers", type=int, default=50000, help="size of the synthetic ticker list")
+    parser.add_argument("--save", help="write results as JSON")
+    parser.add_argument("--compare", help="baseline JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=20.0, help="regression threshold in percent")
+    args = parser.parse_args(argv)
+
+    install_stubs(args.tickers)
+    sizes = [s for s in fixtures.OHLCV_SIZES if not (args.quick and s == "5y_1m")]
+
+    results = {}
+    print("%-44s %11s %11s %11s" % ("benchmark", "median ms", "min ms", "peak KiB"))
+    for name, fn, repeats in build_benchmarks(sizes):
+        if args.pattern and args.pattern not in name:
+            continue
+        r = measure(fn, repeats)
+        results[name] = r
+        print("%-44s %11.2f %11.2f %11.1f" % (name, r["median_ms"], r["min_ms"], r["peak_kb"]))
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
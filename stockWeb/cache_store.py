@@ -0,0 +1,214 @@
+# cache_store.py
+import os
+import time
+import pickle
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+# Backend is chosen with STOCKSENSE_CACHE:
+#   "memory"            per-process dict (default, fine for `python app.py`)
+#   "none"              no caching (benchmarks, debugging)
+#   "lru"               per-process LRU with a default TTL
+#   "file:/some/dir"    pickles on local disk, shared by every worker on the host
+#   "redis://host:port" shared Redis instance (needs the `redis` package)
+CACHE_URL = os.getenv("STOCKSENSE_CACHE", "memory")
+
+# seconds a price history stays fresh, per bar interval
+HISTORY_TTL = {
+    "1m": 30, "2m": 60, "5m": 120, "15m": 300, "30m": 600,
+    "60m": 900, "90m": 900, "1h": 900,
+    "1d": 3600, "5d": 3600, "1wk": 6 * 3600, "1mo": 12 * 3600, "3mo": 12 * 3600,
+}
+
+
+class MemoryCache:
+    """
+    Simple in-process cache with per-key expiry.
+    """
+    def __init__(self, max_items=512):
+        self.max_items = max_items
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires and expires < time.time():
+                del self._data[key]
+                return None
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            if len(self._data) >= self.max_items and key not in self._data:
+                # drop the entry closest to expiry
+                oldest = min(self._data, key=lambda k: self._data[k][0] or float("inf"))
+                del self._data[oldest]
+            self._data[key] = (time.time() + ttl if ttl else 0, value)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+
+class LRUCache:
+    """
+    In-process cache that evicts the least recently used entry when full.
+    `ttl` is the default expiry for set() calls that don't pass one.
+    """
+    def __init__(self, max_items=10000, ttl=None):
+        self.max_items = max_items
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires and expires < time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = ttl or self.ttl
+        with self._lock:
+            self._data[key] = (time.time() + ttl if ttl else 0, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_items:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+
+class NullCache:
+    """
+    Backend that stores nothing.
+    """
+    def get(self, key):
+        return None
+
+    def set(self, key, value, ttl=None):
+        pass
+
+    def delete(self, key):
+        pass
+
+
+class FileCache:
+    """
+    Cache stored as one pickle per key in a directory. All worker processes on
+    the host read the same files, so a history fetched by one worker is reused
+    by the others instead of every worker keeping its own copy.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, digest + ".pkl")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                expires, value = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        if expires and expires < time.time():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        return value
+
+    def set(self, key, value, ttl=None):
+        expires = time.time() + ttl if ttl else 0
+        # write to a temp file then rename so readers never see a partial pickle
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump((expires, value), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, self._path(key))
+        except Exception:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+
+class RedisCache:
+    """
+    Cache kept in Redis, shared across workers and hosts.
+    """
+    def __init__(self, url):
+        import redis
+        self._client = redis.Redis.from_url(url)
+
+    @property
+    def client(self):
+        return self._client
+
+    def get(self, key):
+        raw = self._client.get(key)
+        if raw is None:
+            return None
+        return pickle.loads(raw)
+
+    def set(self, key, value, ttl=None):
+        raw = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if ttl:
+            self._client.setex(key, int(ttl), raw)
+        else:
+            self._client.set(key, raw)
+
+    def delete(self, key):
+        self._client.delete(key)
+
+
+def make_cache(url):
+    if not url or url == "memory":
+        return MemoryCache()
+    if url == "none":
+        return NullCache()
+    if url == "lru":
+        return LRUCache()
+    if url.startswith("file:"):
+        return FileCache(url[len("file:"):] or os.path.join(tempfile.gettempdir(), "stocksense-cache"))
+    if url.startswith("redis://") or url.startswith("rediss://"):
+        return RedisCache(url)
+    raise ValueError("Unknown STOCKSENSE_CACHE backend: " + url)
+
+_CACHE = None
+_CACHE_LOCK = threading.Lock()
+
+def get_cache():
+    """
+    Return the process-wide cache backend configured by STOCKSENSE_CACHE.
+    """
+    global _CACHE
+    if _CACHE is None:
+        with _CACHE_LOCK:
+            if _CACHE is None:
+                _CACHE = make_cache(CACHE_URL)
+    return _CACHE
@@ -0,0 +1,226 @@
+# compact_frame.py
+"""
+Compact in-memory representation of a price history.
+
+A yfinance frame is all float64 and carries Adj Close, Dividends and Stock
+Splits, and compute_indicators() adds eleven more float64 columns through
+several intermediate copies. CompactHistory keeps only what the app uses:
+
+    ts       int64   epoch seconds (UTC), timezone kept separately
+    prices   float32 (4, n) block: Open, High, Low, Close
+    volume   uint64
+    ind      float32 (len(INDICATORS), n) block, filled once by
+             compute_indicators_compact() and kept with the history
+
+About 26 bytes per bar before indicators and 66 with them, against about 200
+for the float64 frames. Conversion back to pandas happens only in
+indicators_frame() / ohlcv_frame(), at the API boundary.
+
+The indicator formulas reproduce the `ta` classes used by
+util_data.compute_indicators (same windows, warm-up and NaN filling).
+"""
+from startup import lazy_module
+
+np = lazy_module("numpy")
+pd = lazy_module("pandas")
+signal = lazy_module("scipy.signal")
+
+PRICE_COLUMNS = ["Open", "High", "Low", "Close"]
+INDICATORS = ["sma7", "sma30", "ema20", "rsi", "macd", "macd_signal", "bb_high", "bb_low", "volatility"]
+
+
+class CompactHistory:
+    """
+    Columnar float32 OHLCV history with an optional indicator block.
+    """
+    __slots__ = ("ts", "tz", "prices", "volume", "ind", "stale", "fetched_at")
+
+    def __init__(self, ts, prices, volume, tz=None, stale=False, fetched_at=0.0):
+        self.ts = ts
+        self.tz = tz
+        self.prices = prices
+        self.volume = volume
+        self.ind = None
+        # True when built from the last known copy because the provider was down
+        self.stale = stale
+        # when the provider returned it (time.time()), see util_data.latest_bar
+        self.fetched_at = fetched_at
+
+    def __len__(self):
+        return len(self.ts)
+
+    @property
+    def close(self):
+        return self.prices[3]
+
+    @property
+    def nbytes(self):
+        total = self.ts.nbytes + self.prices.nbytes + self.volume.nbytes
+        if self.ind is not None:
+            total += self.ind.nbytes
+        return total
+
+    @classmethod
+    def from_frame(cls, df):
+        """
+        Build from a yfinance-style frame with a DatetimeIndex; extra columns are dropped.
+        """
+        if 'Close' not in df.columns:
+            raise ValueError("DataFrame must contain 'Close' column")
+        index = pd.DatetimeIndex(df.index)
+        tz = str(index.tz) if index.tz is not None else None
+        if tz is not None:
+            index = index.tz_convert("UTC").tz_localize(None)
+        ts = (index.asi8 // 1_000_000_000).astype(np.int64)
+        n = len(df)
+        prices = np.empty((4, n), dtype=np.float32)
+        for i, col in enumerate(PRICE_COLUMNS):
+            src = col if col in df.columns else 'Close'
+            prices[i] = df[src].to_numpy(dtype=np.float32, na_value=np.nan)
+        if 'Volume' in df.columns:
+            volume = df['Volume'].fillna(0).to_numpy().astype(np.uint64)
+        else:
+            volume = np.zeros(n, dtype=np.uint64)
+        return cls(ts, prices, volume, tz=tz, stale=bool(df.attrs.get("stale")),
+                   fetched_at=df.attrs.get("fetched_at", 0.0))
+
+    def dates(self):
+        idx = pd.to_datetime(self.ts, unit="s")
+        if self.tz is not None:
+            idx = idx.tz_localize("UTC").tz_convert(self.tz)
+        return idx
+
+    def ohlcv_frame(self):
+        """
+        Open/High/Low/Close/Volume DataFrame with a Date index.
+        """
+        data = {col: self.prices[i] for i, col in enumerate(PRICE_COLUMNS)}
+        data['Volume'] = self.volume
+        df = pd.DataFrame(data, index=pd.Index(self.dates(), name="Date"))
+        df.attrs["stale"] = self.stale
+        return df
+
+
+def _ffill(x):
+    mask = np.isnan(x)
+    if not mask.any():
+        return x
+    idx = np.where(~mask, np.arange(len(x)), 0)
+    np.maximum.accumulate(idx, out=idx)
+    # leading NaNs map to index 0 and stay NaN
+    return x[idx]
+
+
+def _rolling_mean(x, window, min_periods, out):
+    valid = ~np.isnan(x)
+    csum = np.concatenate([[0.0], np.cumsum(np.where(valid, x, 0.0))])
+    ccnt = np.concatenate([[0], np.cumsum(valid)])
+    lo = np.maximum(np.arange(1, len(x) + 1) - window, 0)
+    hi = np.arange(1, len(x) + 1)
+    cnt = ccnt[hi] - ccnt[lo]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = (csum[hi] - csum[lo]) / cnt
+    mean[cnt < max(min_periods, 1)] = np.nan
+    out[:] = mean
+    return out
+
+
+def _rolling_std(x, window, ddof, out):
+    # full windows only (min_periods == window); centre first to limit cancellation
+    n = len(x)
+    out[:] = np.nan
+    if n < window:
+        return out
+    c = x - np.nanmean(x)
+    s1 = np.concatenate([[0.0], np.cumsum(c)])
+    s2 = np.concatenate([[0.0], np.cumsum(c * c)])
+    w1 = s1[window:] - s1[:-window]
+    w2 = s2[window:] - s2[:-window]
+    var = (w2 - w1 * w1 / window) / (window - ddof)
+    out[window - 1:] = np.sqrt(np.maximum(var, 0.0))
+    return out
+
+
+def _ewm(x, alpha, min_periods):
+    """
+    pandas ewm(alpha=..., adjust=False).mean() for a series whose NaNs are all leading.
+    """
+    out = np.full(len(x), np.nan)
+    valid = np.flatnonzero(~np.isnan(x))
+    if not len(valid):
+        return out
+    start = valid[0]
+    seg = x[start:]
+    zi = [(1.0 - alpha) * seg[0]]
+    out[start:], _ = signal.lfilter([alpha], [1.0, alpha - 1.0], seg, zi=zi)
+    warm = start + max(min_periods, 1) - 1
+    out[:warm] = np.nan
+    return out
+
+
+def compute_indicators_compact(hist):
+    """
+    Fill hist.ind (allocated once) with the same indicators as compute_indicators.
+    Returns the indicator block.
+    """
+    n = len(hist)
+    if hist.ind is None:
+        hist.ind = np.empty((len(INDICATORS), n), dtype=np.float32)
+    ind = hist.ind
+    row = {name: i for i, name in enumerate(INDICATORS)}
+    close = _ffill(hist.close.astype(np.float64))
+    tmp = np.empty(n)
+
+    # SMA, fillna=True: partial windows allowed, empty windows -> 0
+    for name, window in (("sma7", 7), ("sma30", 30)):
+        _rolling_mean(close, window, 0, tmp)
+        ind[row[name]] = np.nan_to_num(tmp, nan=0.0)
+
+    # EMA(20), fillna=True
+    ind[row["ema20"]] = np.nan_to_num(_ewm(close, 2.0 / 21.0, 0), nan=0.0)
+
+    # RSI(14), fillna=True -> NaN filled with 50
+    diff = np.diff(close, prepend=np.nan)
+    up = np.where(diff > 0, diff, 0.0)
+    down = np.where(diff < 0, -diff, 0.0)
+    emaup = _ewm(up, 1.0 / 14.0, 0)
+    emadn = _ewm(down, 1.0 / 14.0, 0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        rsi = np.where(emadn == 0, 100.0, 100.0 - 100.0 / (1.0 + emaup / emadn))
+    ind[row["rsi"]] = np.nan_to_num(rsi, nan=50.0)
+
+    # MACD(12, 26, 9), no filling
+    macd = _ewm(close, 2.0 / 13.0, 12) - _ewm(close, 2.0 / 27.0, 26)
+    ind[row["macd"]] = macd
+    ind[row["macd_signal"]] = _ewm(macd, 2.0 / 10.0, 9)
+
+    # Bollinger(20, 2), no filling
+    mavg = _rolling_mean(close, 20, 20, np.empty(n))
+    mstd = _rolling_std(close, 20, 0, tmp)
+    ind[row["bb_high"]] = mavg + 2 * mstd
+    ind[row["bb_low"]] = mavg - 2 * mstd
+
+    # annualised 20-bar volatility of returns
+    with np.errstate(invalid="ignore", divide="ignore"):
+        returns = np.diff(close, prepend=np.nan) / np.concatenate([[np.nan], close[:-1]])
+    returns = np.nan_to_num(returns, nan=0.0)
+    vol = _rolling_std(returns, 20, 1, tmp)
+    ind[row["volatility"]] = np.nan_to_num(vol, nan=0.0) * np.sqrt(252)
+    return ind
+
+
+def indicators_frame(hist):
+    """
+    DataFrame with the same columns as util_data.compute_indicators output.
+    """
+    if hist.ind is None:
+        compute_indicators_compact(hist)
+    data = {"date": hist.dates()}
+    for i, col in enumerate(PRICE_COLUMNS):
+        data[col] = hist.prices[i]
+    data["Volume"] = hist.volume
+    for i, name in enumerate(INDICATORS):
+        data[name] = hist.ind[i]
+    df = pd.DataFrame(data)
+    df.attrs["stale"] = hist.stale
+    return df
@@ -0,0 +1,196 @@
+# compact_model.py
+"""
+Compact random forest artifacts and a numpy-only predictor.
+
+A fitted 200-tree RandomForestRegressor pickles to tens of MB (sklearn keeps
+64 bytes per node plus per-node sample statistics). compile_forest() packs the
+trees into three flat arrays shared by all trees, 10 bytes per node:
+
+    feature    int16    split feature, -1 for a leaf
+    threshold  float32  split threshold, or the leaf value for a leaf
+    right      int32    index of the right child; the left child is node + 1
+
+Nodes are renumbered in preorder so the left child never needs storing.
+Thresholds are rounded down to the nearest float32, which keeps every split
+exactly as sklearn makes it (sklearn compares float32 inputs against them).
+Leaf values become float32, so predictions agree with sklearn to ~1e-7
+relative. max_depth prunes deeper subtrees into leaves holding their mean
+(smaller and faster, no longer exact).
+
+CompactForest.to_bytes() writes a small JSON header followed by the raw
+arrays; from_bytes() maps them back with np.frombuffer without copying and
+without importing sklearn. benchmarks/model_artifacts.py compares size, load
+time and latency against the pickled sklearn model.
+"""
+import json
+import struct
+
+import numpy as np
+
+MAGIC = b"SSRF"
+FORMAT_VERSION = 1
+_ARRAYS = (("feature", np.int16), ("threshold", np.float32), ("right", np.int32), ("roots", np.int32))
+
+
+def _floor32(values):
+    """
+    Largest float32 <= each float64 value.
+    """
+    f32 = values.astype(np.float32)
+    over = f32.astype(np.float64) > values
+    f32[over] = np.nextafter(f32[over], np.float32(-np.inf))
+    return f32
+
+
+def _pack_tree(tree, max_depth, feature, threshold, right):
+    """
+    Append one sklearn tree_ (preorder, optionally pruned) to the lists;
+    returns its root index.
+    """
+    left_in, right_in = tree.children_left, tree.children_right
+    feat_in = tree.feature
+    thr_in = _floor32(tree.threshold)
+    value_in = tree.value.reshape(tree.node_count, -1)[:, 0].astype(np.float32)
+    root = len(feature)
+    # (node, depth, index of the parent slot waiting for its right child)
+    stack = [(0, 0, -1)]
+    while stack:
+        node, depth, parent = stack.pop()
+        idx = len(feature)
+        if parent >= 0:
+            right[parent] = idx
+        if left_in[node] == -1 or (max_depth is not None and depth >= max_depth):
+            feature.append(-1)
+            threshold.append(value_in[node])
+            right.append(-1)
+            continue
+        feature.append(feat_in[node])
+        threshold.append(thr_in[node])
+        right.append(-1)
+        # left subtree is emitted first, right subtree fills in right[idx]
+        stack.append((right_in[node], depth + 1, idx))
+        stack.append((left_in[node], depth + 1, -1))
+    return root
+
+
+class CompactForest:
+    """
+    Numpy-only regressor over packed trees; predict() averages the trees like
+    RandomForestRegressor.predict.
+    """
+    def __init__(self, feature, threshold, right, roots, n_features, depth, meta=None):
+        self.feature = feature
+        self.threshold = threshold
+        self.right = right
+        self.roots = roots
+        self.n_features = n_features
+        self.depth = depth
+        self.meta = meta or {}
+
+    @property
+    def n_trees(self):
+        return len(self.roots)
+
+    @property
+    def nbytes(self):
+        return self.feature.nbytes + self.threshold.nbytes + self.right.nbytes + self.roots.nbytes
+
+    def predict(self, X):
+        """
+        Predictions for the rows of X (n x n_features).
+        """
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X[None, :]
+        rows = np.arange(len(X))
+        # one node per (tree, row), all advanced together, depth steps at most
+        node = np.repeat(self.roots[:, None], len(X), axis=1)
+        for _ in range(self.depth):
+            feat = self.feature[node]
+            inner = feat >= 0
+            if not inner.any():
+                break
+            go_left = X[rows, np.where(inner, feat, 0)] <= self.threshold[node]
+            node = np.where(inner, np.where(go_left, node + 1, self.right[node]), node)
+        return self.threshold[node].astype(np.float64).mean(axis=0)
+
+    def predict_one(self, row):
+        return float(self.predict(row)[0])
+
+    def to_bytes(self):
+        arrays = [getattr(self, name) for name, _ in _ARRAYS]
+        layout, offset = [], 0
+        for (name, dtype), arr in zip(_ARRAYS, arrays):
+            layout.append([name, len(arr), offset])
+            offset += arr.nbytes
+            offset += -offset % 8
+        header = json.dumps({"version": FORMAT_VERSION, "n_features": self.n_features,
+                             "depth": self.depth, "arrays": layout, "meta": self.meta}).encode("utf-8")
+        header += b" " * (-(len(header) + 8) % 8)
+        parts = [MAGIC, struct.pack("<I", len(header)), header]
+        body = bytearray(offset)
+        for (name, dtype, ), arr, (_, count, off) in zip(_ARRAYS, arrays, layout):
+            body[off:off + arr.nbytes] = np.ascontiguousarray(arr, dtype=dtype).tobytes()
+        parts.append(bytes(body))
+        return b"".join(parts)
+
+    @classmethod
+    def from_bytes(cls, buf):
+        """
+        Load an artifact; the arrays are views into `buf` (bytes, mmap, ...).
+        """
+        if bytes(buf[:4]) != MAGIC:
+            raise ValueError("not a compact forest artifact")
+        (hlen,) = struct.unpack("<I", bytes(buf[4:8]))
+        header = json.loads(bytes(buf[8:8 + hlen]))
+        if header["version"] != FORMAT_VERSION:
+            raise ValueError("unsupported compact forest version %s" % header["version"])
+        base = 8 + hlen
+        arrays = {}
+        for (name, dtype), (_, count, off) in zip(_ARRAYS, header["arrays"]):
+            arrays[name] = np.frombuffer(buf, dtype=dtype, count=count, offset=base + off)
+        return cls(arrays["feature"], arrays["threshold"], arrays["right"], arrays["roots"],
+                   header["n_features"], header["depth"], header.get("meta"))
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            f.write(self.to_bytes())
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            return cls.from_bytes(f.read())
+
+
+def _preordered(tree):
+    inner = tree.children_left != -1
+    return bool(np.all(tree.children_left[inner] == np.flatnonzero(inner) + 1))
+
+
+def compile_forest(model, max_depth=None, meta=None):
+    """
+    CompactForest from a fitted RandomForestRegressor (single output), with
+    trees cut at max_depth if given.
+    """
+    trees = [est.tree_ for est in model.estimators_]
+    full_depth = max(t.max_depth for t in trees)
+    depth = full_depth if max_depth is None else min(full_depth, max_depth)
+    if depth == full_depth and all(_preordered(t) for t in trees):
+        # sklearn's depth-first builder already numbers nodes in preorder
+        feats, thrs, rights, roots, base = [], [], [], [], 0
+        for t in trees:
+            leaf = t.children_left == -1
+            feats.append(np.where(leaf, -1, t.feature))
+            thrs.append(np.where(leaf, t.value.reshape(t.node_count, -1)[:, 0], 0).astype(np.float32))
+            thrs[-1][~leaf] = _floor32(t.threshold[~leaf])
+            rights.append(np.where(leaf, -1, t.children_right + base))
+            roots.append(base)
+            base += t.node_count
+        feature, threshold, right = np.concatenate(feats), np.concatenate(thrs), np.concatenate(rights)
+    else:
+        feature, threshold, right, roots = [], [], [], []
+        for t in trees:
+            roots.append(_pack_tree(t, max_depth, feature, threshold, right))
+    return CompactForest(np.asarray(feature, dtype=np.int16), np.asarray(threshold, dtype=np.float32),
+                         np.asarray(right, dtype=np.int32), np.asarray(roots, dtype=np.int32),
+                         int(model.n_features_in_), int(depth), meta)
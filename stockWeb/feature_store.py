@@ -0,0 +1,364 @@
+# feature_store.py
+"""
+Persistent store of the model's design matrix, so predictions and retrains
+don't rebuild lag/indicator features from raw prices every time.
+
+Enabled by STOCKSENSE_FEATURE_STORE=/some/dir. For each symbol, interval and
+lag count the store keeps, under DIR/<FEATURE_VERSION>/<interval>/<SYMBOL>-L<n>/:
+
+    dates.i8     bar timestamps (UTC, int64 ns), sorted
+    close.f8     Close, forward filled
+    X.f8         feature rows (float64, rows x columns)
+    meta.json    row count, columns and the generation of the files above
+
+The arrays are raw files read with np.memmap, so slicing a date range out of
+them copies nothing. An entry starts at the first bar of the longest history
+it has seen; any period's window is cut out of it by date. When a history
+arrives with bars past the last stored one, only the new rows are computed
+and appended; readers go by the row count in meta.json, which is replaced
+atomically after the data is written. The last bar of a history is never
+stored, since an intraday (or today's daily) bar changes until it closes; its
+row is computed for each request. If the history no longer agrees with what
+is stored (a split adjustment, a gap) or starts before the entry, the entry
+is rebuilt into a new generation of files.
+
+A window that starts after the entry's first bar gets its first n_lags +
+INDICATOR_WARMUP rows recomputed from the request's own history, because the
+lags and indicators warm up from its first bar: the rest of the window then
+matches prepare_features() to float precision. Rows appended from a shorter
+history carry its indicator values, which differ from a longer history's by
+less than its warm-up leaves (relative ~1e-8 for a year of daily bars).
+
+FEATURE_VERSION is derived from the feature definitions below. Changing them
+(or the indicator parameters in util_data.compute_indicators, which requires
+bumping FEATURE_SCHEMA) moves the store to a new directory; directories of
+other versions are removed on first use.
+"""
+import os
+import json
+import zlib
+import shutil
+import logging
+import tempfile
+import threading
+
+from startup import lazy_module
+from metrics import timed
+
+pd = lazy_module("pandas")
+np = lazy_module("numpy")
+
+try:
+    import fcntl
+except ImportError:  # not on Windows; the per-process lock still applies
+    fcntl = None
+
+log = logging.getLogger(__name__)
+
+STORE_DIR = os.getenv("STOCKSENSE_FEATURE_STORE", "")
+
+# bump when the meaning of a feature changes without its name changing
+FEATURE_SCHEMA = 1
+# indicator columns used as features next to the lags
+INDICATOR_FEATURES = ['sma7','sma30','ema20','rsi','macd','volatility']
+FEATURE_VERSION = "v%d-%08x" % (FEATURE_SCHEMA,
+                                zlib.crc32(json.dumps(INDICATOR_FEATURES).encode("utf-8")))
+
+# a stored close this far from the provider's means the history was revised
+REVISION_TOLERANCE = 1e-6
+# bars after which the exponential indicators (EMA, RSI, MACD) no longer
+# depend on where the history started: (13/14)**500 ~ 1e-16, as in history_export
+INDICATOR_WARMUP = 500
+
+
+def lag_columns(n_lags):
+    return [f'close_lag_{i}' for i in range(1, n_lags+1)]
+
+
+def _to_ns(dates):
+    idx = pd.DatetimeIndex(pd.to_datetime(dates))
+    if idx.tz is not None:
+        idx = idx.tz_convert("UTC").tz_localize(None)
+    return idx.asi8
+
+
+def feature_rows(close, ind, n_lags, prev_close=None, prev_row=None):
+    """
+    Feature rows for consecutive bars, the same as prepare_features() builds:
+    lags of the forward-filled Close, then indicators forward filled and NaN
+    set to 0. `prev_close` (filled closes before the first bar) and `prev_row`
+    (the feature row before it) continue an existing matrix.
+    Returns (filled close, X).
+    """
+    close = pd.Series(np.asarray(close, dtype=np.float64))
+    seed = np.nan if prev_close is None or not len(prev_close) else prev_close[-1]
+    filled = pd.concat([pd.Series([seed]), close], ignore_index=True).ffill().fillna(0).to_numpy()[1:]
+
+    history = np.zeros(n_lags) if prev_close is None else np.asarray(prev_close[-n_lags:], dtype=np.float64)
+    history = np.concatenate([np.zeros(n_lags - len(history)), history, filled])
+    # lag k of bar t is history[n_lags + t - k]
+    windows = np.lib.stride_tricks.sliding_window_view(history[:-1], n_lags)[:, ::-1]
+
+    ind = pd.DataFrame(np.asarray(ind, dtype=np.float64))
+    if prev_row is not None:
+        ind = pd.concat([pd.DataFrame([prev_row[n_lags:]]), ind], ignore_index=True).ffill().iloc[1:]
+    ind = ind.ffill().fillna(0).to_numpy()
+    return filled, np.hstack([windows, ind])
+
+
+class Entry:
+    """
+    Memory-mapped view of one stored matrix.
+    """
+    def __init__(self, path, meta):
+        self.path = path
+        self.meta = meta
+        self.rows = meta["rows"]
+        self.columns = meta["columns"]
+        gen = meta["gen"]
+        k = len(self.columns)
+        if self.rows:
+            self.dates = np.memmap(os.path.join(path, "dates.%d.i8" % gen), dtype=np.int64, mode="r",
+                                   shape=(self.rows,))
+            self.close = np.memmap(os.path.join(path, "close.%d.f8" % gen), dtype=np.float64, mode="r",
+                                   shape=(self.rows,))
+            self.X = np.memmap(os.path.join(path, "X.%d.f8" % gen), dtype=np.float64, mode="r",
+                               shape=(self.rows, k))
+        else:
+            self.dates = np.empty(0, dtype=np.int64)
+            self.close = np.empty(0)
+            self.X = np.empty((0, k))
+
+
+class FeatureStore:
+    def __init__(self, directory):
+        self.root = directory
+        self.directory = os.path.join(directory, FEATURE_VERSION)
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def prune(self):
+        """
+        Remove the directories of other feature versions.
+        """
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if name != FEATURE_VERSION and os.path.isdir(path):
+                log.info("feature store: removing old version %s", name)
+                shutil.rmtree(path, ignore_errors=True)
+
+    def _path(self, symbol, interval, n_lags):
+        return os.path.join(self.directory, interval, "%s-L%d" % (symbol.upper(), n_lags))
+
+    def _lock(self, path):
+        with self._locks_lock:
+            return self._locks.setdefault(path, threading.Lock())
+
+    def read(self, symbol, interval="1d", n_lags=10):
+        """
+        The stored Entry, or None.
+        """
+        path = self._path(symbol, interval, n_lags)
+        try:
+            with open(os.path.join(path, "meta.json")) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return Entry(path, meta)
+
+    def _write_meta(self, path, meta):
+        fd, tmp = tempfile.mkstemp(dir=path, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp, os.path.join(path, "meta.json"))
+
+    def _append(self, path, meta, dates, close, X):
+        gen = meta["gen"]
+        width = len(meta["columns"])
+        for name, arr, row_bytes in (("dates.%d.i8", dates, 8), ("close.%d.f8", close, 8),
+                                     ("X.%d.f8", X, 8 * width)):
+            with open(os.path.join(path, name % gen), "ab") as f:
+                # drop anything an interrupted append left past the recorded rows
+                f.truncate(meta["rows"] * row_bytes)
+                f.write(np.ascontiguousarray(arr).tobytes())
+        meta = dict(meta, rows=meta["rows"] + len(dates))
+        self._write_meta(path, meta)
+        return meta
+
+    def _rebuild(self, path, meta, columns, dates, close, X):
+        old = meta["gen"] if meta else None
+        gen = 0 if old is None else old + 1
+        fresh = {"version": FEATURE_VERSION, "columns": columns, "rows": 0, "gen": gen}
+        for name in ("dates.%d.i8", "close.%d.f8", "X.%d.f8"):
+            try:
+                os.remove(os.path.join(path, name % gen))
+            except OSError:
+                pass
+        fresh = self._append(path, fresh, dates, close, X)
+        if old is not None:
+            # readers that still map the old generation keep their pages
+            for name in ("dates.%d.i8", "close.%d.f8", "X.%d.f8"):
+                try:
+                    os.remove(os.path.join(path, name % old))
+                except OSError:
+                    pass
+        return fresh
+
+    @timed("feature_store_update")
+    def update(self, symbol, df, interval="1d", n_lags=10):
+        """
+        Bring the stored matrix up to date with an indicator frame (a 'date'
+        column, 'Close' and the indicator columns, as compute_indicators
+        returns) and return its Entry, or None if there is nothing to store.
+        Only bars after the last stored one are computed; a history that
+        disagrees with the store rebuilds it.
+        """
+        return self._update(symbol, _arrays(df, n_lags), interval, n_lags)
+
+    def _update(self, symbol, arrays, interval, n_lags):
+        dates_ns, close, ind, columns = arrays
+        path = self._path(symbol, interval, n_lags)
+        # the last bar may still be forming: computed per request, never stored
+        complete = len(dates_ns) - 1
+        entry = self.read(symbol, interval, n_lags)
+        if complete <= 0:
+            return entry
+        if entry is not None and self._agrees(entry, columns, dates_ns, close):
+            if dates_ns[complete - 1] <= entry.dates[-1]:
+                return entry
+        os.makedirs(path, exist_ok=True)
+        with self._lock(path), _FileLock(path):
+            # another thread or worker may have got here first
+            entry = self.read(symbol, interval, n_lags)
+            meta = entry.meta if entry is not None else None
+            if entry is not None and self._agrees(entry, columns, dates_ns, close):
+                pos = int(np.searchsorted(dates_ns, entry.dates[-1], side="right"))
+                if pos >= complete:
+                    return entry
+                filled, X = feature_rows(close[pos:complete], ind[pos:complete], n_lags,
+                                         prev_close=entry.close[-n_lags:],
+                                         prev_row=np.asarray(entry.X[-1]))
+                meta = self._append(path, meta, dates_ns[pos:complete], filled, X)
+                return Entry(path, meta)
+            if entry is not None:
+                log.info("feature store: rebuilding %s %s", symbol, interval)
+            filled, X = feature_rows(close[:complete], ind[:complete], n_lags)
+            meta = self._rebuild(path, meta, columns, dates_ns[:complete], filled, X)
+            return Entry(path, meta)
+
+    def _agrees(self, entry, columns, dates_ns, close):
+        """
+        True if the stored matrix can be extended with (or sliced for) this
+        history: same columns, the entry starts no later than the history,
+        the bars they both cover are the same bars and the last of them has
+        the same close.
+        """
+        if entry.columns != columns or not entry.rows or dates_ns[0] < entry.dates[0]:
+            return False
+        i0 = int(np.searchsorted(entry.dates, dates_ns[0]))
+        shared = int(np.searchsorted(dates_ns, entry.dates[-1], side="right"))
+        if not shared or i0 + shared > entry.rows:
+            return False
+        if not np.array_equal(entry.dates[i0:i0 + shared], dates_ns[:shared]):
+            return False
+        fresh = close[shared - 1]
+        if fresh != fresh:  # NaN: compare the forward-filled value
+            fresh = pd.Series(close[:shared]).ffill().fillna(0).iloc[-1]
+        stored = entry.close[i0 + shared - 1]
+        return abs(fresh - stored) <= REVISION_TOLERANCE * max(1.0, abs(stored))
+
+    def design_matrix(self, symbol, df, interval="1d", n_lags=10):
+        """
+        (X, y, columns) for the bars of `df`, the rows prepare_features()
+        builds from it, taken from the store (updated first) where it can.
+        When df starts at the entry's first bar and ends within it, X and y
+        are read-only memory-mapped slices; otherwise the recomputed head
+        (see the module docstring) and the unstored last bar make it a copy.
+        """
+        arrays = _arrays(df, n_lags)
+        dates_ns, close, ind, columns = arrays
+        entry = self._update(symbol, arrays, interval, n_lags)
+        n = len(dates_ns)
+        i0 = covered = 0
+        if entry is not None and self._agrees(entry, columns, dates_ns, close):
+            i0 = int(np.searchsorted(entry.dates, dates_ns[0]))
+            covered = int(np.searchsorted(dates_ns, entry.dates[-1], side="right"))
+        head = 0 if not covered or i0 == 0 else min(n, n_lags + INDICATOR_WARMUP)
+        if covered <= head:
+            filled, X = feature_rows(close, ind, n_lags)
+            return X[:-1], filled[1:], columns
+        if not head and covered == n:
+            return entry.X[i0:i0 + n - 1], entry.close[i0 + 1:i0 + n], columns
+        parts_c, parts_X = [], []
+        if head:
+            filled, X = feature_rows(close[:head], ind[:head], n_lags)
+            parts_c.append(filled)
+            parts_X.append(X)
+        parts_c.append(entry.close[i0 + head:i0 + covered])
+        parts_X.append(entry.X[i0 + head:i0 + covered])
+        if covered < n:
+            prev_close = np.concatenate(parts_c)[-n_lags:]
+            filled, X = feature_rows(close[covered:], ind[covered:], n_lags,
+                                     prev_close=prev_close, prev_row=np.asarray(parts_X[-1][-1]))
+            parts_c.append(filled)
+            parts_X.append(X)
+        filled, X = np.concatenate(parts_c), np.vstack(parts_X)
+        return X[:-1], filled[1:], columns
+
+
+def _arrays(df, n_lags):
+    """
+    (bar timestamps in ns, Close, indicator block, feature columns) of an
+    indicator frame, sorted by date.
+    """
+    dates_ns = _to_ns(df['date'] if 'date' in df.columns else df.index)
+    ind_cols = [c for c in INDICATOR_FEATURES if c in df.columns]
+    close = df['Close'].to_numpy(dtype=np.float64)
+    ind = df[ind_cols].to_numpy(dtype=np.float64)
+    if len(dates_ns) > 1 and not (dates_ns[1:] > dates_ns[:-1]).all():
+        order = np.argsort(dates_ns, kind="stable")
+        dates_ns, close, ind = dates_ns[order], close[order], ind[order]
+    return dates_ns, close, ind, lag_columns(n_lags) + ind_cols
+
+
+class _FileLock:
+    """
+    Exclusive flock on a lock file in `path`, so two worker processes don't
+    write the same entry at once.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._f = None
+
+    def __enter__(self):
+        if fcntl is not None:
+            self._f = open(os.path.join(self.path, "lock"), "a")
+            fcntl.flock(self._f, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if self._f is not None:
+            fcntl.flock(self._f, fcntl.LOCK_UN)
+            self._f.close()
+            self._f = None
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """
+    The process-wide FeatureStore, or None when STOCKSENSE_FEATURE_STORE is unset.
+    """
+    global _store
+    if not STORE_DIR:
+        return None
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                store = FeatureStore(STORE_DIR)
+                store.prune()
+                _store = store
+    return _store
@@ -0,0 +1,41 @@
+# gunicorn.conf.py
+# Serving profile for wsgi.py. Every value can be overridden from the environment.
+import os
+import multiprocessing
+
+bind = os.getenv("STOCKSENSE_BIND", "0.0.0.0:8000")
+workers = int(os.getenv("STOCKSENSE_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+# the app splits the provider rate limit between workers when it can't share it (upstream.py)
+os.environ["STOCKSENSE_WORKERS"] = str(workers)
+threads = int(os.getenv("STOCKSENSE_THREADS", 2))
+worker_class = "gthread"
+
+# import the app (and its heavy dependencies) once in the master, then fork
+preload_app = True
+
+# recycle workers after a number of requests (with jitter so they don't all
+# restart together) to bound memory growth from model fits
+max_requests = int(os.getenv("STOCKSENSE_MAX_REQUESTS", 1000))
+max_requests_jitter = int(os.getenv("STOCKSENSE_MAX_REQUESTS_JITTER", 100))
+
+# /api/predict fits several forests, so give it room before the worker is killed
+timeout = int(os.getenv("STOCKSENSE_TIMEOUT", 120))
+graceful_timeout = int(os.getenv("STOCKSENSE_GRACEFUL_TIMEOUT", 30))
+keepalive = 5
+
+accesslog = "-"
+errorlog = "-"
+loglevel = os.getenv("STOCKSENSE_LOG_LEVEL", "info")
+
+# the per-process memory cache would give each worker its own copy of every
+# history; default to the shared on-disk cache unless one is configured
+os.environ.setdefault("STOCKSENSE_CACHE", "file:/tmp/stocksense-cache")
+
+# each worker writes its metrics here and /metrics adds them up (metrics.py);
+# start every server with an empty directory so old workers' counts don't linger
+os.environ.setdefault("STOCKSENSE_METRICS_DIR", "/tmp/stocksense-metrics")
+
+
+def on_starting(server):
+    import shutil
+    shutil.rmtree(os.environ["STOCKSENSE_METRICS_DIR"], ignore_errors=True)
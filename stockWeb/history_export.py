@@ -0,0 +1,159 @@
+# history_export.py
+"""
+Chunked export of a price history as CSV, NDJSON or Arrow IPC, for
+/api/export/<symbol>.
+
+/api/history builds every record as a dict and the whole JSON string before
+sending anything, which for years of intraday bars means several copies of
+the history in memory. open_export() instead walks the stored history
+EXPORT_CHUNK rows at a time and yields each slice already serialized, so
+what the export adds to the server's memory is one chunk, whatever the range.
+
+Indicator columns (indicators=True) are computed per chunk with
+compute_indicators() over the chunk plus the INDICATOR_WARMUP bars before it,
+which are then dropped. The windowed indicators (SMA, Bollinger, volatility)
+need at most 30 bars of warm-up; the exponential ones (EMA, RSI, MACD) depend
+on the whole past, but their weight on bars older than the warm-up is below
+(13/14)**500 ~ 1e-16, so the result matches /api/history to float precision.
+In compact mode the indicators are already stored with the history and are
+sliced instead.
+
+Arrow IPC (a stream of record batches, one per chunk) needs pyarrow.
+"""
+import os
+import io
+import json
+import importlib.util
+
+from startup import lazy_module
+import util_data
+
+pd = lazy_module("pandas")
+np = lazy_module("numpy")
+pa = lazy_module("pyarrow")
+pa_ipc = lazy_module("pyarrow.ipc")
+
+EXPORT_CHUNK = int(os.getenv("STOCKSENSE_EXPORT_CHUNK", 5000))
+INDICATOR_WARMUP = 500
+DATE_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+# format -> (mimetype, file extension)
+FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrow"),
+}
+PRICE_COLUMNS = ["Open", "High", "Low", "Close", "Volume"]
+
+
+def check_format(fmt):
+    """
+    Raise ValueError if `fmt` can't be exported here.
+    """
+    if fmt not in FORMATS:
+        raise ValueError("unknown format %r (use %s)" % (fmt, ", ".join(FORMATS)))
+    if fmt == "arrow" and importlib.util.find_spec("pyarrow") is None:
+        raise ValueError("format 'arrow' needs pyarrow installed")
+
+
+class _Source:
+    """
+    The stored history of one symbol, sliced into frames of `date` plus the
+    price (and indicator) columns.
+    """
+    def __init__(self, symbol, period, interval, indicators):
+        self.indicators = indicators
+        if util_data.COMPACT:
+            self.hist = util_data.fetch_compact_history(symbol, period=period, interval=interval)
+            self.df = None
+            self.stale = self.hist.stale
+        else:
+            # the cached frame itself: only sliced, never modified
+            self.hist = None
+            self.df = util_data._cached_history(symbol, period, interval)
+            self.stale = bool(self.df.attrs.get("stale"))
+
+    def __len__(self):
+        return len(self.hist) if self.hist is not None else len(self.df)
+
+    def chunk(self, start, stop):
+        if self.hist is not None:
+            return self._compact_chunk(start, stop)
+        if not self.indicators:
+            out = self.df.iloc[start:stop]
+            out = out[[c for c in PRICE_COLUMNS if c in out.columns]].reset_index()
+            return out.rename(columns={out.columns[0]: 'date'})
+        warm = max(0, start - INDICATOR_WARMUP)
+        ind = util_data.compute_indicators(self.df.iloc[warm:stop])
+        return ind.iloc[start - warm:].reset_index(drop=True)
+
+    def _compact_chunk(self, start, stop):
+        from compact_frame import PRICE_COLUMNS as COMPACT_PRICES, INDICATORS
+        hist = self.hist
+        idx = pd.to_datetime(hist.ts[start:stop], unit="s")
+        if hist.tz is not None:
+            idx = idx.tz_localize("UTC").tz_convert(hist.tz)
+        data = {"date": idx}
+        for i, col in enumerate(COMPACT_PRICES):
+            data[col] = hist.prices[i, start:stop]
+        data["Volume"] = hist.volume[start:stop]
+        if self.indicators:
+            for i, name in enumerate(INDICATORS):
+                data[name] = hist.ind[i, start:stop]
+        return pd.DataFrame(data)
+
+
+def _dates_as_text(df):
+    df = df.copy()
+    try:
+        df['date'] = pd.to_datetime(df['date']).dt.strftime(DATE_FORMAT)
+    except Exception:
+        df['date'] = df['date'].astype(str)
+    return df
+
+
+def _csv(frames):
+    first = True
+    for df in frames:
+        yield _dates_as_text(df).to_csv(index=False, header=first, lineterminator="\n")
+        first = False
+
+
+def _ndjson(frames):
+    # json.dumps rather than to_json, which rounds to 15 digits
+    for df in frames:
+        records = _dates_as_text(df).replace({np.nan: None}).to_dict(orient="records")
+        yield "".join(json.dumps(r) + "\n" for r in records)
+
+
+def _arrow(frames):
+    buf = io.BytesIO()
+    writer = None
+    for df in frames:
+        if writer is None:
+            schema = pa.Schema.from_pandas(df, preserve_index=False)
+            writer = pa_ipc.new_stream(buf, schema)
+        writer.write_batch(pa.RecordBatch.from_pandas(df, schema=schema, preserve_index=False))
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+    if writer is not None:
+        writer.close()
+        yield buf.getvalue()
+
+
+_WRITERS = {"csv": _csv, "ndjson": _ndjson, "arrow": _arrow}
+
+
+def open_export(symbol, period="1y", interval="1d", fmt="csv", indicators=False, chunk=EXPORT_CHUNK):
+    """
+    Fetch the history (raising what fetch_price_history raises) and return
+    (generator of bytes/str chunks, stale flag). Nothing is serialized until
+    the generator is consumed.
+    """
+    check_format(fmt)
+    source = _Source(symbol, period, interval, indicators)
+    chunk = max(1, int(chunk))
+    frames = (source.chunk(start, min(start + chunk, len(source)))
+              for start in range(0, len(source), chunk))
+    return _WRITERS[fmt](frames), source.stale
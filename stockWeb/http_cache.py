@@ -0,0 +1,76 @@
+# http_cache.py
+"""
+ETag / conditional GET helpers for the market data routes.
+
+Routes build an ETag from what determines their body (symbol, period,
+interval and the latest bar) before doing any heavy work, and return
+not_modified() straight away when the client already has that version.
+Responses built from history may be reused for at most as long as the
+server's own cached copy stays fresh; stale last-good copies are sent with
+no_store() and no ETag.
+"""
+import hashlib
+
+from flask import request, Response
+
+import util_data
+from cache_store import get_cache, NullCache
+
+# bump when the JSON layout of a route changes so old ETags stop matching
+ETAG_VERSION = "1"
+
+# seconds a browser/proxy may reuse a response without revalidating, per bar interval
+MAX_AGE = {
+    "1m": 15, "2m": 30, "5m": 60, "15m": 120, "30m": 300,
+    "60m": 300, "90m": 300, "1h": 300,
+    "1d": 300, "5d": 900, "1wk": 3600, "1mo": 3600, "3mo": 3600,
+}
+NEWS_MAX_AGE = 300
+
+
+def make_etag(*parts):
+    raw = "|".join(str(p) for p in (ETAG_VERSION, util_data.COMPACT) + parts)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def history_etag(kind, symbol, period, interval):
+    """
+    (etag, max_age) for a response derived from one symbol's history, or
+    None if it must not be cached: the history is a stale last-good copy, or
+    the cache backend keeps nothing (the probe would then download the
+    history a second time). The latest bar's close is part of the ETag
+    because an intraday bar changes while it is forming, and max_age is cut
+    to the time the server's cached copy has left.
+    """
+    if isinstance(get_cache(), NullCache):
+        return None
+    ts, close, stale, fresh_for = util_data.latest_bar(symbol, period=period, interval=interval)
+    if stale:
+        return None
+    return (make_etag(kind, symbol, period, interval, ts, "%.6g" % close),
+            min(max_age_for(interval), int(fresh_for)))
+
+
+def max_age_for(interval):
+    return MAX_AGE.get(interval, 300)
+
+
+def not_modified(etag, max_age):
+    """
+    A 304 response if the request's If-None-Match matches `etag`, else None.
+    """
+    if request.if_none_match and request.if_none_match.contains_weak(etag):
+        resp = Response(status=304)
+        return with_cache_headers(resp, etag, max_age)
+    return None
+
+
+def with_cache_headers(response, etag, max_age):
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "public, max-age=%d" % max_age
+    return response
+
+
+def no_store(response):
+    response.headers["Cache-Control"] = "no-store"
+    return response
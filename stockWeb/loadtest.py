@@ -0,0 +1,156 @@
+# loadtest.py
+"""
+Small load generator for the /api/* routes.
+
+Start a server on generated prices, then point this script at it:
+
+    STOCKSENSE_FAKE_DATA=1 gunicorn -c gunicorn.conf.py wsgi:app
+    python loadtest.py --url http://127.0.0.1:8000 --concurrency 16 --requests 400
+
+To replay real prices offline instead, export them once and serve them from
+the file provider (see providers.py):
+
+    python providers.py export /tmp/prices --period 5y
+    STOCKSENSE_PROVIDERS=file:/tmp/prices gunicorn -c gunicorn.conf.py wsgi:app
+
+With --in-process no server is needed: the requests go through Flask's test
+client in this process, with fake data switched on automatically.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+import urllib.request
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor
+
+SYMBOLS = ["AAPL", "MSFT", "GOOGL", "AMZN", "META", "TSLA", "NFLX", "NVDA", "IBM"]
+
+# (route name, relative weight)
+MIX = [
+    ("search", 30),
+    ("history", 35),
+    ("compare", 15),
+    ("sentiment", 15),
+    ("predict", 5),
+]
+
+def build_request(name, rnd):
+    """
+    Return (method, path, json_body) for one request of the given route.
+    """
+    sym = rnd.choice(SYMBOLS)
+    if name == "search":
+        return "GET", "/api/search?q=%s&max=8" % sym[:rnd.randint(1, 3)].lower(), None
+    if name == "history":
+        period, interval = rnd.choice([("1mo", "1d"), ("6mo", "1d"), ("1y", "1d"), ("5d", "1h")])
+        return "GET", "/api/history/%s?period=%s&interval=%s" % (sym, period, interval), None
+    if name == "compare":
+        other = rnd.choice([s for s in SYMBOLS if s != sym])
+        return "GET", "/api/compare?left=%s&right=%s&period=1y" % (sym, other), None
+    if name == "sentiment":
+        body = {"headlines": ["%s beats expectations" % sym, "%s faces lawsuit" % sym],
+                "tweets": ["bullish on %s" % sym]}
+        return "POST", "/api/sentiment", body
+    if name == "predict":
+        return "GET", "/api/predict/%s?period=2y&interval=1d" % sym, None
+    raise ValueError(name)
+
+def http_sender(base_url, timeout):
+    def send(method, path, body):
+        data = None
+        headers = {}
+        if body is not None:
+            data = json.dumps(body).encode("utf-8")
+            headers["Content-Type"] = "application/json"
+        req = urllib.request.Request(base_url.rstrip("/") + path, data=data, headers=headers, method=method)
+        try:
+            with urllib.request.urlopen(req, timeout=timeout) as resp:
+                resp.read()
+                return resp.status
+        except urllib.error.HTTPError as e:
+            return e.code
+    return send
+
+def inprocess_sender():
+    os.environ.setdefault("STOCKSENSE_FAKE_DATA", "1")
+    from app import app
+    local = threading.local()
+    def send(method, path, body):
+        if not hasattr(local, "client"):
+            local.client = app.test_client()
+        if method == "POST":
+            resp = local.client.post(path, json=body)
+        else:
+            resp = local.client.get(path)
+        return resp.status_code
+    return send
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = min(len(values) - 1, int(round(pct / 100.0 * (len(values) - 1))))
+    return values[k]
+
+def run(send, total, concurrency, seed=0):
+    names = [n for n, _ in MIX]
+    weights = [w for _, w in MIX]
+    rnd = random.Random(seed)
+    plan = [build_request(rnd.choices(names, weights)[0], rnd) for _ in range(total)]
+    kinds = [p[1].split("/")[2].split("?")[0] for p in plan]
+    results = [None] * total
+
+    def worker(i):
+        method, path, body = plan[i]
+        t0 = time.perf_counter()
+        try:
+            status = send(method, path, body)
+        except Exception:
+            status = 0
+        results[i] = (status, time.perf_counter() - t0)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, range(total)))
+    elapsed = time.perf_counter() - started
+
+    report = {}
+    for kind, (status, secs) in zip(kinds, results):
+        r = report.setdefault(kind, {"count": 0, "errors": 0, "lat": []})
+        r["count"] += 1
+        if status != 200:
+            r["errors"] += 1
+        r["lat"].append(secs * 1000.0)
+    return report, elapsed
+
+def print_report(report, elapsed, total):
+    print("%-10s %7s %7s %9s %9s %9s" % ("route", "count", "errors", "p50 ms", "p95 ms", "p99 ms"))
+    for kind in sorted(report):
+        r = report[kind]
+        print("%-10s %7d %7d %9.1f %9.1f %9.1f" % (
+            kind, r["count"], r["errors"],
+            percentile(r["lat"], 50), percentile(r["lat"], 95), percentile(r["lat"], 99)))
+    print("%d requests in %.2fs (%.1f req/s)" % (total, elapsed, total / elapsed if elapsed else 0))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the StockSense API")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--in-process", action="store_true", help="use Flask's test client instead of HTTP")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    send = inprocess_sender() if args.in_process else http_sender(args.url, args.timeout)
+    report, elapsed = run(send, args.requests, args.concurrency, seed=args.seed)
+    print_report(report, elapsed, args.requests)
+    errors = sum(r["errors"] for r in report.values())
+    return 1 if errors else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
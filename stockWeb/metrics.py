@@ -0,0 +1,375 @@
+# metrics.py
+"""
+Request timing instrumentation.
+
+- `with stage("name"):` / `@timed("name")` time a piece of the hot path. The
+  durations of the current request are returned in a Server-Timing header and
+  every stage feeds a latency histogram.
+- init_app(app) wires the Flask hooks and adds a Prometheus text endpoint at
+  /metrics. A streamed response is timed until the server closes it; its
+  Server-Timing header, sent before the body, only covers the setup and says
+  so ("setup" instead of "total").
+- Under gunicorn each worker has its own metrics. With STOCKSENSE_METRICS_DIR
+  set, every worker writes its series to a file there (at most every
+  STOCKSENSE_METRICS_FLUSH seconds, and on exit) and /metrics adds up the
+  files of all workers, including ones that have been recycled; clear the
+  directory when the server starts (gunicorn.conf.py does).
+- Set STOCKSENSE_PROFILE_SLOW_MS to sample the stacks of requests while they
+  run; requests slower than that many milliseconds have their samples written
+  as collapsed stacks (flamegraph.pl / speedscope format) to
+  STOCKSENSE_PROFILE_DIR.
+"""
+import os
+import sys
+import json
+import time
+import atexit
+import tempfile
+import threading
+import functools
+from contextlib import contextmanager
+
+PROFILE_SLOW_MS = float(os.getenv("STOCKSENSE_PROFILE_SLOW_MS", "0") or 0)
+PROFILE_INTERVAL_MS = float(os.getenv("STOCKSENSE_PROFILE_INTERVAL_MS", "5"))
+PROFILE_DIR = os.getenv("STOCKSENSE_PROFILE_DIR", "profiles")
+METRICS_DIR = os.getenv("STOCKSENSE_METRICS_DIR", "")
+METRICS_FLUSH = float(os.getenv("STOCKSENSE_METRICS_FLUSH", 5))
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_local = threading.local()
+
+
+class Histogram:
+    """
+    Cumulative-bucket histogram keyed by a tuple of label values.
+    """
+    def __init__(self, name, help_text, label_names, buckets=BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+            counts = series[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def dump(self):
+        with self._lock:
+            return [[list(labels), list(counts), total, count]
+                    for labels, (counts, total, count) in self._series.items()]
+
+    def merge(self, dumps):
+        """
+        Sum the dump() output of several processes into one series dict.
+        """
+        merged = {}
+        for dump in dumps:
+            for labels, counts, total, count in dump:
+                series = merged.setdefault(tuple(labels), [[0] * len(self.buckets), 0.0, 0])
+                series[0] = [a + b for a, b in zip(series[0], counts)]
+                series[1] += total
+                series[2] += count
+        return merged
+
+    def render(self, series=None):
+        lines = ["# HELP %s %s" % (self.name, self.help_text), "# TYPE %s histogram" % self.name]
+        with self._lock:
+            items = sorted((self._series if series is None else series).items())
+            for labels, (counts, total, count) in items:
+                base = ",".join('%s="%s"' % (k, _escape(v)) for k, v in zip(self.label_names, labels))
+                sep = "," if base else ""
+                for bound, c in zip(self.buckets, counts):
+                    lines.append('%s_bucket{%s%sle="%s"} %d' % (self.name, base, sep, bound, c))
+                lines.append('%s_bucket{%s%sle="+Inf"} %d' % (self.name, base, sep, count))
+                lines.append("%s_sum{%s} %f" % (self.name, base, total))
+                lines.append("%s_count{%s} %d" % (self.name, base, count))
+        return "\n".join(lines)
+
+
+class Counter:
+    def __init__(self, name, help_text, label_names):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dump(self):
+        with self._lock:
+            return [[list(labels), value] for labels, value in self._values.items()]
+
+    def merge(self, dumps):
+        merged = {}
+        for dump in dumps:
+            for labels, value in dump:
+                merged[tuple(labels)] = merged.get(tuple(labels), 0) + value
+        return merged
+
+    def render(self, values=None):
+        lines = ["# HELP %s %s" % (self.name, self.help_text), "# TYPE %s counter" % self.name]
+        with self._lock:
+            for labels, value in sorted((self._values if values is None else values).items()):
+                base = ",".join('%s="%s"' % (k, _escape(v)) for k, v in zip(self.label_names, labels))
+                lines.append("%s{%s} %s" % (self.name, base, value))
+        return "\n".join(lines)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+REQUEST_SECONDS = Histogram("stocksense_request_duration_seconds",
+                            "Request latency by route", ("route", "method", "status"))
+STAGE_SECONDS = Histogram("stocksense_stage_duration_seconds",
+                          "Latency of instrumented stages", ("stage",))
+SLOW_PROFILES = Counter("stocksense_slow_request_profiles_total",
+                        "Slow requests whose stack samples were written", ("route",))
+
+REGISTRY = [REQUEST_SECONDS, STAGE_SECONDS, SLOW_PROFILES]
+
+
+def register(metric):
+    """
+    Add a Histogram or Counter defined elsewhere to the /metrics output.
+    """
+    REGISTRY.append(metric)
+    return metric
+
+
+@contextmanager
+def stage(name):
+    """
+    Time the enclosed block as stage `name` of the current request.
+    """
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - t0
+        STAGE_SECONDS.observe((name,), elapsed)
+        stages = getattr(_local, "stages", None)
+        if stages is not None:
+            stages.append((name, elapsed))
+
+
+def timed(name):
+    """
+    Decorator form of stage().
+    """
+    def deco(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+
+def server_timing(stages, total, total_name="total"):
+    """
+    Build a Server-Timing header value; repeated stages are summed.
+    """
+    order = []
+    sums = {}
+    for name, secs in stages:
+        if name not in sums:
+            order.append(name)
+            sums[name] = [0.0, 0]
+        sums[name][0] += secs
+        sums[name][1] += 1
+    parts = []
+    for name in order:
+        secs, n = sums[name]
+        part = "%s;dur=%.1f" % (name, secs * 1000.0)
+        if n > 1:
+            part += ';desc="x%d"' % n
+        parts.append(part)
+    parts.append("%s;dur=%.1f" % (total_name, total * 1000.0))
+    return ", ".join(parts)
+
+
+class StackSampler:
+    """
+    One background thread that periodically samples the stacks of the threads
+    currently serving a request and counts collapsed stacks per thread.
+    """
+    def __init__(self, interval):
+        self.interval = interval
+        self._active = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def begin(self, thread_id):
+        with self._lock:
+            self._active[thread_id] = {}
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="stocksense-sampler", daemon=True)
+                self._thread.start()
+
+    def end(self, thread_id):
+        with self._lock:
+            return self._active.pop(thread_id, {})
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                for tid, counts in self._active.items():
+                    frame = frames.get(tid)
+                    if frame is None:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append("%s (%s:%d)" % (code.co_name, os.path.basename(code.co_filename), frame.f_lineno or 0))
+                        frame = frame.f_back
+                    key = ";".join(reversed(stack))
+                    counts[key] = counts.get(key, 0) + 1
+
+
+_sampler = StackSampler(PROFILE_INTERVAL_MS / 1000.0) if PROFILE_SLOW_MS > 0 else None
+
+
+def dump_profile(route, elapsed, samples):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    safe = "".join(c if c.isalnum() else "_" for c in route).strip("_") or "root"
+    path = os.path.join(PROFILE_DIR, "%s-%d-%dms.folded" % (safe, int(time.time() * 1000), elapsed * 1000))
+    with open(path, "w") as f:
+        for stack, n in sorted(samples.items(), key=lambda kv: -kv[1]):
+            f.write("%s %d\n" % (stack, n))
+    return path
+
+
+_flush_path = None
+_flushed = 0.0
+_flush_lock = threading.Lock()
+
+
+def flush_metrics():
+    """
+    Write this process's series to its file in METRICS_DIR.
+    """
+    global _flush_path, _flushed
+    if not METRICS_DIR:
+        return
+    with _flush_lock:
+        if _flush_path is None or not _flush_path.startswith(os.path.join(METRICS_DIR, "%d-" % os.getpid())):
+            # pid plus start time: a later process reusing the pid gets its own file
+            _flush_path = os.path.join(METRICS_DIR, "%d-%d.json" % (os.getpid(), time.time() * 1000))
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=METRICS_DIR, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump({m.name: m.dump() for m in REGISTRY}, f)
+        os.replace(tmp, _flush_path)
+        _flushed = time.monotonic()
+
+
+def _maybe_flush(force=False):
+    if METRICS_DIR and (force or time.monotonic() - _flushed >= METRICS_FLUSH):
+        try:
+            flush_metrics()
+        except OSError:
+            pass
+
+
+def _read_dumps():
+    dumps = []
+    for name in os.listdir(METRICS_DIR):
+        if not name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(METRICS_DIR, name)) as f:
+                dumps.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return dumps
+
+
+def render_metrics():
+    if not METRICS_DIR:
+        return "\n".join(m.render() for m in REGISTRY) + "\n"
+    flush_metrics()
+    dumps = _read_dumps()
+    return "\n".join(m.render(m.merge(d.get(m.name, []) for d in dumps)) for m in REGISTRY) + "\n"
+
+
+if METRICS_DIR:
+    # a recycled worker keeps what it counted since its last flush
+    atexit.register(_maybe_flush, force=True)
+
+
+def init_app(app):
+    """
+    Register timing hooks and the /metrics endpoint on a Flask app.
+    """
+    from flask import request, Response
+
+    @app.before_request
+    def _start_timer():
+        _local.stages = []
+        _local.started = time.perf_counter()
+        if _sampler is not None:
+            _sampler.begin(threading.get_ident())
+
+    def _record(route, labels, started, thread_id):
+        elapsed = time.perf_counter() - started
+        REQUEST_SECONDS.observe(labels, elapsed)
+        if _sampler is not None:
+            samples = _sampler.end(thread_id)
+            if elapsed * 1000.0 >= PROFILE_SLOW_MS and samples:
+                dump_profile(route, elapsed, samples)
+                SLOW_PROFILES.inc((route,))
+        _maybe_flush()
+
+    @app.after_request
+    def _finish_timer(response):
+        started = getattr(_local, "started", None)
+        if started is None:
+            return response
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        labels = (route, request.method, str(response.status_code))
+        thread_id = threading.get_ident()
+        stages, _local.stages, _local.started = _local.stages, None, None
+        if response.is_streamed:
+            # the body hasn't been produced yet: time the request when the
+            # server closes the response
+            response.headers["Server-Timing"] = server_timing(stages, time.perf_counter() - started,
+                                                              total_name="setup")
+            _local.streaming = True
+            response.call_on_close(lambda: _record(route, labels, started, thread_id))
+            return response
+        response.headers["Server-Timing"] = server_timing(stages, time.perf_counter() - started)
+        _record(route, labels, started, thread_id)
+        return response
+
+    @app.teardown_request
+    def _drop_samples(exc):
+        # after_request is skipped if the response could not be built; a
+        # streamed response ends its samples when it is closed
+        if getattr(_local, "streaming", False):
+            _local.streaming = False
+            return
+        if _sampler is not None:
+            _sampler.end(threading.get_ident())
+
+    @app.route("/metrics")
+    def metrics():
+        return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
+
+    return app
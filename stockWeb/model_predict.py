@@ -1,12 +1,17 @@
 # model_predict.py
-import pandas as pd
-import numpy as np
-from sklearn.ensemble import RandomForestRegressor
-from sklearn.model_selection import TimeSeriesSplit
-from sklearn.metrics import r2_score, mean_squared_error
-import joblib
-from datetime import timedelta
-
+from startup import lazy_module
+from metrics import timed, stage
+import feature_store
+from feature_store import INDICATOR_FEATURES
+
+# heavy modules are imported on first use (see startup.py)
+pd = lazy_module("pandas")
+np = lazy_module("numpy")
+sk_ensemble = lazy_module("sklearn.ensemble")
+sk_model_selection = lazy_module("sklearn.model_selection")
+sk_metrics = lazy_module("sklearn.metrics")
+
+@timed("prepare_features")
 def prepare_features(df, n_lags=10):
     """
     Build lag features from df: expects df with 'Close' and computed indicators.
@@ -41,7 +46,7 @@ def prepare_features(df, n_lags=10):
     df2 = df2.dropna(subset=['target']).reset_index(drop=True)
 
     # feature columns: only include what exists
-    possible_features = [f'close_lag_{i}' for i in range(1, n_lags+1)] + ['sma7','sma30','ema20','rsi','macd','volatility']
+    possible_features = [f'close_lag_{i}' for i in range(1, n_lags+1)] + INDICATOR_FEATURES
     feature_cols = [c for c in possible_features if c in df2.columns]
 
     if len(feature_cols) == 0:
@@ -51,40 +56,84 @@ def prepare_features(df, n_lags=10):
     y = df2['target']
     return X, y, df2
 
-def train_predict_model(df, n_lags=10):
+@timed("batch_features")
+def batch_features(frames, n_lags=10):
     """
-    Train a RandomForest on historical features and return:
-      - dict with prediction, confidence and r2
-      - trained model object (in memory)
-      - list of feature column names
+    prepare_features() for many symbols at once. The frames (each with a
+    'date' column, as passed to train_predict_model) are stacked into one long
+    frame and the lags, fills and targets computed with grouped operations
+    instead of a pass per symbol.
+    Returns {symbol: (X, y)} as float64 arrays, plus the feature column names.
     """
-    X, y, df2 = prepare_features(df, n_lags=n_lags)
-
-    # require a minimum number of rows for training
-    if len(X) < 50:
-        return {"error":"not enough historical data"}, None, None
+    if not frames:
+        return {}, []
+    present = set.intersection(*(set(df.columns) for df in frames.values()))
+    if 'Close' not in present:
+        raise ValueError("DataFrame must contain 'Close' column for modeling")
+    ind_cols = [c for c in INDICATOR_FEATURES if c in present]
+    lag_cols = [f'close_lag_{i}' for i in range(1, n_lags+1)]
+    parts = []
+    for df in frames.values():
+        part = df[['date', 'Close'] + ind_cols].copy()
+        part['date'] = pd.to_datetime(part['date'])
+        parts.append(part.sort_values('date').reset_index(drop=True))
+    long = pd.concat(parts, keys=list(frames), names=['symbol', 'row'])
+    groups = long.groupby(level='symbol', sort=False)
+
+    close = groups['Close']
+    feats = pd.concat([close.shift(lag).rename(col) for lag, col in enumerate(lag_cols, 1)]
+                      + [long[ind_cols]], axis=1)
+    feats = feats.groupby(level='symbol', sort=False).ffill().fillna(0)
+    target = close.ffill().fillna(0).groupby(level='symbol', sort=False).shift(-1)
+
+    X_all = feats.to_numpy(dtype=np.float64)
+    y_all = target.to_numpy(dtype=np.float64)
+    out = {}
+    for symbol, idx in groups.indices.items():
+        # the last row of each symbol has no next close
+        idx = idx[:-1]
+        out[symbol] = (X_all[idx], y_all[idx])
+    return out, lag_cols + ind_cols
+
+def make_forest(params=None, cv=False):
+    """
+    The RandomForestRegressor to fit. Without tuned params (see
+    model_registry.py) CV folds use 100 trees and the final model 200.
+    """
+    if params:
+        return sk_ensemble.RandomForestRegressor(random_state=42, **params)
+    return sk_ensemble.RandomForestRegressor(n_estimators=100 if cv else 200, random_state=42)
 
-    tscv = TimeSeriesSplit(n_splits=3)
+def fit_predict(X, y, params=None):
+    """
+    Cross-validate and fit the forest on a prepared design matrix and predict
+    the next close from its last row. Returns (result dict, fitted model).
+    """
+    X = np.asarray(X)
+    y = np.asarray(y)
+    tscv = sk_model_selection.TimeSeriesSplit(n_splits=3)
     rmses = []
     r2s = []
     models = []
 
     for train_idx, test_idx in tscv.split(X):
-        Xtr, Xte = X.iloc[train_idx], X.iloc[test_idx]
-        ytr, yte = y.iloc[train_idx], y.iloc[test_idx]
-        m = RandomForestRegressor(n_estimators=100, random_state=42)
-        m.fit(Xtr, ytr)
-        ypred = m.predict(Xte)
-        r2s.append(r2_score(yte, ypred))
-        rmses.append(mean_squared_error(yte, ypred, squared=False))
+        Xtr, Xte = X[train_idx], X[test_idx]
+        ytr, yte = y[train_idx], y[test_idx]
+        with stage("cv_fold"):
+            m = make_forest(params, cv=True)
+            m.fit(Xtr, ytr)
+            ypred = m.predict(Xte)
+        r2s.append(sk_metrics.r2_score(yte, ypred))
+        rmses.append(sk_metrics.mean_squared_error(yte, ypred, squared=False))
         models.append(m)
 
     # final model trained on all data
-    final_model = RandomForestRegressor(n_estimators=200, random_state=42)
-    final_model.fit(X, y)
+    with stage("final_fit"):
+        final_model = make_forest(params)
+        final_model.fit(X, y)
 
     # predict next day using last available features
-    last_row = X.iloc[[-1]]
+    last_row = X[-1:]
     pred = final_model.predict(last_row)[0]
 
     # confidence derived from mean R^2 (clamped)
@@ -93,4 +142,49 @@ def train_predict_model(df, n_lags=10):
     conf = (mean_r2 + 0.5) / 1.5
     conf_score = float(max(0, min(1, conf)) * 100)
 
-    return {"prediction": float(pred), "confidence": conf_score, "r2": float(mean_r2)}, final_model, X.columns.tolist()
+    return {"prediction": float(pred), "confidence": conf_score, "r2": float(mean_r2)}, final_model
+
+def predict_arrays(X, y, params=None, compact=False, max_depth=None):
+    """
+    Process pool entry point for batch predictions. Returns (result, artifact):
+    the fit_predict() result (or the usual error dict) and, if `compact`, the
+    model as compact_model bytes (trees cut at max_depth); the sklearn model
+    itself stays in the worker.
+    """
+    if len(X) < 50:
+        return {"error":"not enough historical data"}, None
+    result, model = fit_predict(X, y, params)
+    if not compact:
+        return result, None
+    from compact_model import compile_forest
+    return result, compile_forest(model, max_depth=max_depth).to_bytes()
+
+def design_matrix(df, n_lags=10, symbol=None, interval="1d"):
+    """
+    (X, y, feature column names) for df: memory-mapped slices from the
+    feature store when it is enabled and the symbol is known, otherwise built
+    by prepare_features().
+    """
+    store = feature_store.get_store()
+    if store is not None and symbol is not None:
+        return store.design_matrix(symbol, df, interval=interval, n_lags=n_lags)
+    X, y, df2 = prepare_features(df, n_lags=n_lags)
+    return X, y, X.columns.tolist()
+
+def train_predict_model(df, n_lags=10, symbol=None, interval="1d", params=None):
+    """
+    Train a RandomForest on historical features and return:
+      - dict with prediction, confidence and r2
+      - trained model object (in memory)
+      - list of feature column names
+    Pass symbol/interval to read the features from the feature store, and
+    params (forest settings from model_registry) to override the defaults.
+    """
+    X, y, cols = design_matrix(df, n_lags=n_lags, symbol=symbol, interval=interval)
+
+    # require a minimum number of rows for training
+    if len(X) < 50:
+        return {"error":"not enough historical data"}, None, None
+
+    result, final_model = fit_predict(X, y, params)
+    return result, final_model, cols
@@ -0,0 +1,61 @@
+# model_registry.py
+"""
+Per-symbol model configuration chosen by tuning.py.
+
+Entries live in the cache_store backend given by STOCKSENSE_MODEL_REGISTRY
+(default: file:model_registry next to this file; use redis://... to share one
+registry between hosts) under "modelcfg:<SYMBOL>:<interval>", without expiry:
+
+    {"params": {"n_estimators", "max_depth", "min_samples_leaf"},
+     "n_lags": 10, "rmse": ..., "tuned_at": ..., "feature_version": ...}
+
+An entry recorded for another feature version is ignored, so changing the
+feature definitions (feature_store.FEATURE_VERSION) falls back to the default
+model until the symbol is tuned again.
+"""
+import os
+import time
+import threading
+
+from cache_store import make_cache
+from feature_store import FEATURE_VERSION
+
+REGISTRY_URL = os.getenv("STOCKSENSE_MODEL_REGISTRY",
+                         "file:" + os.path.join(os.path.dirname(os.path.abspath(__file__)), "model_registry"))
+
+_registry = None
+_lock = threading.Lock()
+
+
+def _get():
+    global _registry
+    if _registry is None:
+        with _lock:
+            if _registry is None:
+                _registry = make_cache(REGISTRY_URL)
+    return _registry
+
+
+def _key(symbol, interval):
+    return "modelcfg:%s:%s" % (symbol.upper(), interval)
+
+
+def get_config(symbol, interval="1d"):
+    """
+    The tuned configuration for a symbol, or None to use the defaults.
+    """
+    entry = _get().get(_key(symbol, interval))
+    if entry is None or entry.get("feature_version") != FEATURE_VERSION:
+        return None
+    return entry
+
+
+def set_config(symbol, interval, params, n_lags, **info):
+    entry = dict(info, params=dict(params), n_lags=int(n_lags),
+                 tuned_at=time.time(), feature_version=FEATURE_VERSION)
+    _get().set(_key(symbol, interval), entry)
+    return entry
+
+
+def delete_config(symbol, interval="1d"):
+    _get().delete(_key(symbol, interval))
@@ -0,0 +1,309 @@
+# predict_service.py
+"""
+Cached indicator frames and predictions, shared by the API routes and the
+watchlist pre-warm in python_proj/app2.py. Everything goes through the
+cache_store backend, so with a shared backend (file:/... or redis://...) a
+pre-warm done by one process is visible to the others.
+
+predict_batch() serves /api/predict/batch: one shared history fetch, one
+feature build for every symbol and the forest fits spread over a process
+pool (STOCKSENSE_BATCH_WORKERS processes, 0 fits in the calling thread). If
+the pool breaks (a worker killed, or workers failing to start) the symbols it
+didn't fit are fitted in the calling thread and the pool is replaced.
+
+With STOCKSENSE_MODEL_TTL=<seconds> the fitted forest is also kept, as a
+compact_model artifact, under "model:<SYMBOL>:<period>:<interval>". Until it
+expires, a prediction whose cached result has expired (a new bar) is made by
+running the latest feature row through that artifact instead of refitting.
+STOCKSENSE_MODEL_MAX_DEPTH prunes the stored trees (smaller, approximate).
+"""
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+from util_data import fetch_price_history, compute_indicators, fetch_compact_history
+import util_data
+import model_predict
+import model_registry
+import feature_store
+from model_predict import train_predict_model
+from cache_store import get_cache, HISTORY_TTL
+from providers import NoData
+from startup import lazy_module
+import upstream
+
+np = lazy_module("numpy")
+
+BATCH_WORKERS = int(os.getenv("STOCKSENSE_BATCH_WORKERS", os.cpu_count() or 2))
+N_LAGS = 10
+MODEL_TTL = int(os.getenv("STOCKSENSE_MODEL_TTL", 0))
+MODEL_MAX_DEPTH = int(os.getenv("STOCKSENSE_MODEL_MAX_DEPTH", 0)) or None
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def _key(kind, symbol, period, interval):
+    return "%s:%s:%s:%s" % (kind, symbol.upper(), period, interval)
+
+
+def get_indicators(symbol, period="1mo", interval="1d"):
+    """
+    compute_indicators() output for a symbol, cached for the interval's TTL.
+    """
+    if util_data.COMPACT:
+        from compact_frame import indicators_frame
+        # the indicators live in the cached float32 block already
+        return indicators_frame(fetch_compact_history(symbol, period=period, interval=interval))
+    cache = get_cache()
+    key = _key("indicators", symbol, period, interval)
+    ind = cache.get(key)
+    if ind is None:
+        ind = compute_indicators(fetch_price_history(symbol, period=period, interval=interval))
+        if not ind.attrs.get("stale"):
+            cache.set(key, ind, ttl=HISTORY_TTL.get(interval, 3600))
+    return ind.copy()
+
+
+def indicators_ready(symbol, period="1mo", interval="1d"):
+    """
+    True if get_indicators() would be served from the cache.
+    """
+    kind = "compact" if util_data.COMPACT else "indicators"
+    return get_cache().get(_key(kind, symbol, period, interval)) is not None
+
+
+def cached_prediction(symbol, period="2y", interval="1d"):
+    """
+    The stored prediction for a symbol, or None if none has been computed yet.
+    """
+    return get_cache().get(_key("prediction", symbol, period, interval))
+
+
+def predict_symbol(symbol, period="2y", interval="1d"):
+    """
+    Next-close prediction for a symbol, cached for the interval's TTL.
+    Returns the /api/predict payload, or {"error": ...} if the model could not be fit.
+    """
+    out = cached_prediction(symbol, period, interval)
+    if out is not None:
+        return dict(out)
+    df_ind = _model_frame(get_indicators(symbol, period=period, interval=interval))
+    n_lags, params = model_config(symbol, interval)
+    result = _predict_with_stored_model(symbol, period, interval, df_ind, n_lags, params)
+    if result is None:
+        result, model, features = train_predict_model(df_ind, n_lags=n_lags, symbol=symbol,
+                                                      interval=interval, params=params)
+        if MODEL_TTL and model is not None and not df_ind.attrs.get("stale"):
+            from compact_model import compile_forest
+            _remember_model(symbol, period, interval, compile_forest(model, max_depth=MODEL_MAX_DEPTH).to_bytes(),
+                            result, n_lags, params)
+    return _store(symbol, period, interval, result, df_ind)
+
+
+def _remember_model(symbol, period, interval, artifact, result, n_lags, params):
+    get_cache().set(_key("model", symbol, period, interval),
+                    {"artifact": artifact, "n_lags": n_lags, "params": params,
+                     "confidence": result["confidence"], "r2": result["r2"]},
+                    ttl=MODEL_TTL)
+
+
+def _predict_with_stored_model(symbol, period, interval, df_ind, n_lags, params):
+    """
+    The model result from the stored compact model, or None if there is no
+    usable one (disabled, expired, or fitted with another configuration).
+    """
+    if not MODEL_TTL:
+        return None
+    stored = get_cache().get(_key("model", symbol, period, interval))
+    if stored is None or stored["n_lags"] != n_lags or stored["params"] != params:
+        return None
+    from compact_model import CompactForest
+    forest = CompactForest.from_bytes(stored["artifact"])
+    X, y, cols = model_predict.design_matrix(df_ind, n_lags=n_lags, symbol=symbol, interval=interval)
+    if len(X) < 50 or len(cols) != forest.n_features:
+        return None
+    return {"prediction": forest.predict_one(np.asarray(X)[-1]),
+            "confidence": stored["confidence"], "r2": stored["r2"]}
+
+
+def model_config(symbol, interval="1d"):
+    """
+    (n_lags, forest params) for a symbol: tuned ones from the model registry
+    (see tuning.py), else the defaults (params None).
+    """
+    cfg = model_registry.get_config(symbol, interval)
+    if cfg is None:
+        return N_LAGS, None
+    return cfg["n_lags"], cfg["params"]
+
+
+def _model_frame(df_ind):
+    if 'date' not in df_ind.columns:
+        df_ind = df_ind.reset_index().rename(columns={df_ind.columns[0]:'date'})
+    return df_ind
+
+
+def _store(symbol, period, interval, result, df_ind):
+    """
+    Turn a model result into the /api/predict payload and cache it unless it
+    was built from stale data.
+    """
+    if isinstance(result, dict) and "error" in result:
+        return {"error": result.get("error")}
+    last_close = None
+    try:
+        last_close = float(df_ind['Close'].iloc[-1])
+    except Exception:
+        last_close = None
+    predicted = float(result['prediction'])
+    pct_change = None
+    if last_close:
+        pct_change = (predicted - last_close) / last_close * 100.0
+    out = {
+        "symbol": symbol,
+        "last_close": last_close,
+        "predicted_close": predicted,
+        "predicted_pct_change": pct_change,
+        "confidence": result.get('confidence'),
+        "r2": result.get('r2')
+    }
+    if df_ind.attrs.get("stale"):
+        # built from the last known history; flag it and don't keep it
+        out["stale"] = True
+        return out
+    get_cache().set(_key("prediction", symbol, period, interval), out, ttl=HISTORY_TTL.get(interval, 3600))
+    return dict(out)
+
+
+def _get_pool():
+    # spawned, not forked: the request threads of a gunicorn worker must not be
+    # copied into the pool processes
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                _pool = ProcessPoolExecutor(max_workers=BATCH_WORKERS,
+                                            mp_context=multiprocessing.get_context("spawn"))
+                _pool_pid = os.getpid()
+    return _pool
+
+
+def _discard_pool(pool):
+    """
+    Forget a pool that broke (a worker died or could not be started), so the
+    next _get_pool() call starts a fresh one.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def predict_batch(symbols, period="2y", interval="1d"):
+    """
+    Generator of predict_symbol() payloads for many symbols, yielded as each
+    one is ready: cached predictions first, then the rest as their fits
+    finish. Failed symbols yield {"symbol", "error"[, "retry_after"]}.
+    """
+    pending = []
+    for symbol in symbols:
+        out = cached_prediction(symbol, period, interval)
+        if out is not None:
+            yield dict(out)
+        else:
+            pending.append(symbol)
+    if not pending:
+        return
+
+    failed = util_data.prefetch_histories(pending, period, interval)
+    frames = {}
+    for symbol in pending:
+        if isinstance(failed.get(symbol), NoData):
+            yield {"symbol": symbol, "error": "No data for symbol: " + symbol}
+            continue
+        try:
+            frames[symbol] = _model_frame(get_indicators(symbol, period=period, interval=interval))
+        except upstream.UpstreamUnavailable as e:
+            yield {"symbol": symbol, "error": str(e), "retry_after": e.retry_after}
+        except ValueError as e:
+            yield {"symbol": symbol, "error": str(e)}
+
+    configs = {symbol: model_config(symbol, interval) for symbol in frames}
+    for symbol in list(frames):
+        result = _predict_with_stored_model(symbol, period, interval, frames[symbol], *configs[symbol])
+        if result is not None:
+            yield _batch_payload(symbol, period, interval, result, frames.pop(symbol))
+    # symbols on the default model share one feature build; tuned ones (their
+    # own n_lags) and everything when the feature store is on go one by one
+    shared = {s: df for s, df in frames.items()
+              if configs[s][1] is None and feature_store.get_store() is None}
+    matrices, _ = model_predict.batch_features(shared, n_lags=N_LAGS)
+    for symbol, df_ind in frames.items():
+        if symbol not in shared:
+            X, y, _ = model_predict.design_matrix(df_ind, n_lags=configs[symbol][0],
+                                                  symbol=symbol, interval=interval)
+            matrices[symbol] = (X, y)
+    compact = bool(MODEL_TTL)
+
+    def fit_here(symbol):
+        X, y = matrices[symbol]
+        try:
+            result, artifact = model_predict.predict_arrays(X, y, configs[symbol][1], compact,
+                                                            MODEL_MAX_DEPTH)
+        except Exception as e:
+            return {"symbol": symbol, "error": str(e)}
+        return _batch_payload(symbol, period, interval, result, frames[symbol],
+                              artifact, configs[symbol])
+
+    if BATCH_WORKERS <= 0:
+        for symbol in matrices:
+            yield fit_here(symbol)
+        return
+    pool = _get_pool()
+    futures, inline = {}, []
+    for symbol, (X, y) in matrices.items():
+        if inline:
+            inline.append(symbol)
+            continue
+        try:
+            futures[pool.submit(model_predict.predict_arrays, X, y, configs[symbol][1], compact,
+                                MODEL_MAX_DEPTH)] = symbol
+        except RuntimeError:
+            # BrokenProcessPool, or already shut down after another request saw it break
+            _discard_pool(pool)
+            inline.append(symbol)
+    try:
+        for fut in as_completed(futures):
+            symbol = futures[fut]
+            try:
+                result, artifact = fut.result()
+            except BrokenProcessPool:
+                _discard_pool(pool)
+                inline.append(symbol)
+                continue
+            except Exception as e:
+                yield {"symbol": symbol, "error": str(e)}
+                continue
+            yield _batch_payload(symbol, period, interval, result, frames[symbol],
+                                 artifact, configs[symbol])
+        # the pool broke: fit what it didn't in this thread, the next batch gets a new pool
+        for symbol in inline:
+            yield fit_here(symbol)
+    finally:
+        # client went away: don't fit symbols nobody will read
+        for fut in futures:
+            fut.cancel()
+
+
+def _batch_payload(symbol, period, interval, result, df_ind, artifact=None, config=None):
+    if artifact is not None and "error" not in result and not df_ind.attrs.get("stale"):
+        _remember_model(symbol, period, interval, artifact, result, *config)
+    out = _store(symbol, period, interval, result, df_ind)
+    if "error" in out:
+        out["symbol"] = symbol
+    return out
@@ -0,0 +1,531 @@
+# providers.py
+"""
+Market data providers behind a common interface.
+
+A provider returns a yfinance-shaped OHLCV frame (Date index; Open, High, Low,
+Close, Adj Close, Volume) for (symbol, period, interval), or raises NoData.
+STOCKSENSE_PROVIDERS lists the chain to try, in order, as a comma separated
+list of:
+
+    yfinance            Yahoo via yfinance
+    alphavantage        Alpha Vantage REST API (needs ALPHAVANTAGE_KEY)
+    file:/some/dir      CSV/Parquet files, see FileProvider
+    synthetic           deterministic random walk (also STOCKSENSE_FAKE_DATA=1)
+
+e.g. STOCKSENSE_PROVIDERS="file:/srv/prices,yfinance,alphavantage". The default
+is yfinance (synthetic when STOCKSENSE_FAKE_DATA is set). A provider that has
+no data for the symbol, or is unavailable, hands over to the next one. Remote
+providers each go through their own rate limiter, retries and circuit breaker
+(upstream.py), so a failing provider is skipped quickly while its breaker is
+open.
+
+With STOCKSENSE_PROVIDER_ORDER=fastest the chain is re-ordered on every call
+by the observed latency of each provider (moving average of successful calls;
+providers not measured yet go first), instead of keeping the configured order.
+
+    python providers.py export DIR [SYMBOL ...] [--period 5y] [--interval 1d]
+
+downloads histories through the chain into DIR (default: every symbol in
+tickers.csv) so the app can later run offline with STOCKSENSE_PROVIDERS=file:DIR.
+"""
+import os
+import time
+import zlib
+import random
+import logging
+import threading
+
+from cache_store import LRUCache
+from startup import lazy_module
+from metrics import Histogram, register
+import upstream
+
+yf = lazy_module("yfinance")
+pd = lazy_module("pandas")
+np = lazy_module("numpy")
+requests = lazy_module("requests")
+
+log = logging.getLogger(__name__)
+
+FAKE_DATA = os.getenv("STOCKSENSE_FAKE_DATA", "") not in ("", "0", "false")
+PROVIDERS = os.getenv("STOCKSENSE_PROVIDERS", "synthetic" if FAKE_DATA else "yfinance")
+PROVIDER_ORDER = os.getenv("STOCKSENSE_PROVIDER_ORDER", "config")
+# fault injection for the synthetic provider, to exercise upstream.py locally
+FAKE_LATENCY_MS = float(os.getenv("STOCKSENSE_FAKE_LATENCY_MS", 0))
+FAKE_ERROR_RATE = float(os.getenv("STOCKSENSE_FAKE_ERROR_RATE", 0))
+FAKE_THROTTLE_RATE = float(os.getenv("STOCKSENSE_FAKE_THROTTLE_RATE", 0))
+# Alpha Vantage's free tier allows 5 requests a minute
+ALPHAVANTAGE_RATE = float(os.getenv("STOCKSENSE_ALPHAVANTAGE_RATE", 5 / 60.0))
+ALPHAVANTAGE_BURST = int(os.getenv("STOCKSENSE_ALPHAVANTAGE_BURST", 5))
+# parsed files kept in memory by FileProvider
+FILE_CACHE_ITEMS = int(os.getenv("STOCKSENSE_FILE_CACHE_ITEMS", 256))
+
+PROVIDER_SECONDS = register(Histogram("stocksense_provider_seconds",
+                                      "Provider call duration by outcome", ("provider", "outcome")))
+
+COLUMNS = ["Open", "High", "Low", "Close", "Adj Close", "Volume"]
+
+
+class NoData(ValueError):
+    """
+    The provider has no data for this symbol/interval; try the next one.
+    """
+
+
+_PERIOD_DAYS = {"1d": 1, "5d": 5, "1mo": 21, "3mo": 63, "6mo": 126, "1y": 252,
+                "2y": 504, "5y": 1260, "10y": 2520, "ytd": 200, "max": 5000}
+_BARS_PER_DAY = {"1m": 390, "2m": 195, "5m": 78, "15m": 26, "30m": 13,
+                 "60m": 7, "90m": 5, "1h": 7, "1d": 1}
+_BAR_FREQ = {"1m": "min", "2m": "2min", "5m": "5min", "15m": "15min", "30m": "30min",
+             "60m": "h", "90m": "90min", "1h": "h", "1d": "B"}
+# calendar span of each period, for trimming full histories
+_PERIOD_OFFSET = {"1d": {"days": 1}, "5d": {"days": 5}, "1mo": {"months": 1},
+                  "3mo": {"months": 3}, "6mo": {"months": 6}, "1y": {"years": 1},
+                  "2y": {"years": 2}, "5y": {"years": 5}, "10y": {"years": 10}}
+
+
+def synthetic_price_history(symbol, period="1y", interval="1d"):
+    """
+    Deterministic random-walk OHLCV frame shaped like yfinance output.
+    The same symbol always produces the same prices.
+    """
+    days = _PERIOD_DAYS.get(period, 252)
+    n = max(2, days * _BARS_PER_DAY.get(interval, 1))
+    rng = np.random.default_rng(zlib.crc32(symbol.upper().encode("utf-8")))
+    start = 20 + rng.random() * 300
+    close = start * np.exp(np.cumsum(rng.normal(0, 0.015 / np.sqrt(_BARS_PER_DAY.get(interval, 1)), n)))
+    open_ = np.concatenate([[start], close[:-1]])
+    spread = np.abs(rng.normal(0, 0.005, n)) * close
+    high = np.maximum(open_, close) + spread
+    low = np.minimum(open_, close) - spread
+    volume = rng.integers(100_000, 5_000_000, n)
+    end = pd.Timestamp("2024-12-31 16:00")
+    index = pd.date_range(end=end, periods=n, freq=_BAR_FREQ.get(interval, "B"), name="Date")
+    return pd.DataFrame({
+        "Open": open_, "High": high, "Low": low, "Close": close,
+        "Adj Close": close, "Volume": volume,
+        "Dividends": 0.0, "Stock Splits": 0.0,
+    }, index=index)
+
+
+def trim_period(df, period):
+    """
+    Rows of a (sorted) full history that fall inside `period`, counted back
+    from the last bar.
+    """
+    if df.empty or period == "max":
+        return df
+    last = df.index[-1]
+    if period == "ytd":
+        start = last.normalize().replace(month=1, day=1)
+    elif period in _PERIOD_OFFSET:
+        start = last - pd.DateOffset(**_PERIOD_OFFSET[period])
+    else:
+        return df
+    return df[df.index > start]
+
+
+def normalize_frame(df):
+    """
+    Standard column names, a sorted DatetimeIndex without duplicates and an
+    "Adj Close" column, whatever the source looked like.
+    """
+    names = {c.lower().replace("_", " "): c for c in COLUMNS}
+    df = df.rename(columns={c: names[str(c).lower().replace("_", " ")] for c in df.columns
+                            if str(c).lower().replace("_", " ") in names})
+    if "Adj Close" not in df.columns and "Close" in df.columns:
+        df["Adj Close"] = df["Close"]
+    df.index = pd.to_datetime(df.index)
+    if not df.index.is_monotonic_increasing:
+        df = df.sort_index()
+    if df.index.has_duplicates:
+        df = df[~df.index.duplicated(keep="last")]
+    return df
+
+
+class Provider:
+    """
+    Base class. Subclasses implement history(); `remote` providers are called
+    through their upstream.Guard.
+    """
+    name = "provider"
+    remote = False
+    rate = upstream.RATE
+    burst = upstream.BURST
+
+    def __init__(self):
+        self.guard = upstream.Guard(self.name, rate=self.rate, burst=self.burst) if self.remote else None
+        self.latency = None  # moving average of successful calls, seconds
+
+    def history(self, symbol, period, interval):
+        raise NotImplementedError
+
+    def history_many(self, symbols, period, interval):
+        """
+        {symbol: frame} from one request for several symbols, or None if the
+        source has no bulk call.
+        """
+        return None
+
+    def fetch(self, symbol, period, interval):
+        fn = lambda: self.history(symbol, period, interval)
+        t0 = time.perf_counter()
+        try:
+            df = self.guard.call(fn, permanent=(ValueError,)) if self.guard else fn()
+        except NoData:
+            PROVIDER_SECONDS.observe((self.name, "nodata"), time.perf_counter() - t0)
+            raise
+        except Exception:
+            PROVIDER_SECONDS.observe((self.name, "error"), time.perf_counter() - t0)
+            raise
+        elapsed = time.perf_counter() - t0
+        PROVIDER_SECONDS.observe((self.name, "ok"), elapsed)
+        self.latency = elapsed if self.latency is None else 0.8 * self.latency + 0.2 * elapsed
+        return df
+
+    def fetch_many(self, symbols, period, interval):
+        """
+        ({symbol: frame} for the symbols this provider has, the
+        UpstreamUnavailable that stopped it early or None). Uses the bulk call
+        when there is one; the symbols missing from its answer (all of them if
+        it returned nothing, or rejected the batch) are then fetched one by
+        one, so a symbol dropped by a bulk call that partly failed is not
+        taken for an unknown one.
+        """
+        got = {}
+        if len(symbols) > 1:
+            fn = lambda: self.history_many(symbols, period, interval)
+            t0 = time.perf_counter()
+            try:
+                got = (self.guard.call(fn, permanent=(ValueError,)) if self.guard else fn()) or {}
+            except ValueError:
+                # one bad symbol, or an empty answer, fails the whole bulk call
+                got = {}
+            except upstream.UpstreamUnavailable as e:
+                return {}, e
+            if got:
+                PROVIDER_SECONDS.observe((self.name, "bulk"), time.perf_counter() - t0)
+        got = dict(got)
+        for symbol in symbols:
+            if symbol in got:
+                continue
+            try:
+                got[symbol] = self.fetch(symbol, period, interval)
+            except ValueError:
+                continue
+            except upstream.UpstreamUnavailable as e:
+                return got, e
+        return got, None
+
+    def available(self):
+        return self.guard is None or self.guard.breaker.state != "open"
+
+
+class YFinanceProvider(Provider):
+    name = "yfinance"
+    remote = True
+
+    def history(self, symbol, period, interval):
+        df = yf.Ticker(symbol).history(period=period, interval=interval, auto_adjust=False)
+        if df is None or df.empty:
+            raise NoData("No data for symbol: " + symbol)
+        return df
+
+    def history_many(self, symbols, period, interval):
+        data = yf.download(list(symbols), period=period, interval=interval, group_by="ticker",
+                           auto_adjust=False, threads=True, progress=False)
+        out = {}
+        if data is None or data.empty:
+            return out
+        for symbol in symbols:
+            if symbol not in data.columns.get_level_values(0):
+                continue
+            df = data[symbol].dropna(how="all")
+            if not df.empty:
+                out[symbol] = df
+        return out
+
+
+class AlphaVantageProvider(Provider):
+    """
+    Daily and intraday bars from Alpha Vantage. Only the free endpoints are
+    used, so "Adj Close" equals "Close" and intraday history is short.
+    """
+    name = "alphavantage"
+    remote = True
+    rate = ALPHAVANTAGE_RATE
+    burst = ALPHAVANTAGE_BURST
+    URL = "https://www.alphavantage.co/query"
+    INTERVALS = {"1m": "1min", "5m": "5min", "15m": "15min", "30m": "30min",
+                 "60m": "60min", "1h": "60min"}
+
+    def __init__(self, api_key):
+        super().__init__()
+        self.api_key = api_key
+        self._session = None
+
+    def history(self, symbol, period, interval):
+        params = {"symbol": symbol, "apikey": self.api_key, "datatype": "json"}
+        if interval == "1d":
+            params["function"] = "TIME_SERIES_DAILY"
+            # "compact" is the last 100 bars
+            params["outputsize"] = "compact" if _PERIOD_DAYS.get(period, 5000) <= 100 else "full"
+        elif interval in self.INTERVALS:
+            params["function"] = "TIME_SERIES_INTRADAY"
+            params["interval"] = self.INTERVALS[interval]
+            params["outputsize"] = "full"
+        else:
+            raise NoData("alphavantage has no %s bars" % interval)
+        if self._session is None:
+            self._session = requests.Session()
+        resp = self._session.get(self.URL, params=params, timeout=10)
+        if resp.status_code == 429:
+            raise upstream.Throttled("Too Many Requests")
+        resp.raise_for_status()
+        data = resp.json()
+        if "Error Message" in data:
+            raise NoData("No data for symbol: " + symbol)
+        note = data.get("Note") or data.get("Information")
+        if note:
+            # the API answers 200 with a note when the quota is used up
+            raise upstream.Throttled("rate limit: " + note)
+        series = next((v for k, v in data.items() if k.startswith("Time Series")), None)
+        if not series:
+            raise NoData("No data for symbol: " + symbol)
+        df = pd.DataFrame.from_dict(series, orient="index", dtype=float)
+        df.columns = [c.split(". ", 1)[-1] for c in df.columns]
+        df = normalize_frame(df)
+        df.index.name = "Date"
+        df["Volume"] = df["Volume"].astype("int64")
+        return trim_period(df, period)
+
+
+class FileProvider(Provider):
+    """
+    Histories read from a directory of CSV or Parquet files:
+
+        DIR/<interval>/<SYMBOL>.parquet|.csv   any interval
+        DIR/<SYMBOL>.parquet|.csv              daily bars
+
+    Each file holds the full history available for the symbol; the requested
+    period is cut from the end of it. Parsed files are kept in memory (keyed by
+    path and mtime) so repeated requests don't re-read them. Parquet needs
+    pyarrow or fastparquet.
+    """
+    name = "file"
+
+    def __init__(self, directory):
+        super().__init__()
+        self.directory = directory
+        self._frames = LRUCache(max_items=FILE_CACHE_ITEMS)
+
+    def path_for(self, symbol, interval):
+        symbol = symbol.upper()
+        dirs = [os.path.join(self.directory, interval)]
+        if interval == "1d":
+            dirs.append(self.directory)
+        for d in dirs:
+            for ext in (".parquet", ".csv"):
+                path = os.path.join(d, symbol + ext)
+                if os.path.exists(path):
+                    return path
+        return None
+
+    def load(self, path):
+        mtime = os.path.getmtime(path)
+        hit = self._frames.get(path)
+        if hit is not None and hit[0] == mtime:
+            return hit[1]
+        if path.endswith(".parquet"):
+            df = pd.read_parquet(path)
+        else:
+            df = pd.read_csv(path, index_col=0, parse_dates=True)
+        df = normalize_frame(df)
+        df.index.name = "Date"
+        self._frames.set(path, (mtime, df))
+        return df
+
+    def history(self, symbol, period, interval):
+        path = self.path_for(symbol, interval)
+        if path is None:
+            raise NoData("No %s file for symbol: %s" % (interval, symbol))
+        df = trim_period(self.load(path), period)
+        if df.empty:
+            raise NoData("No data for symbol: " + symbol)
+        return df
+
+
+class SyntheticProvider(Provider):
+    """
+    Generated prices (synthetic_price_history). Goes through a Guard only when
+    fault injection is enabled, so the upstream protection can be exercised
+    without network access.
+    """
+    name = "synthetic"
+    remote = bool(FAKE_LATENCY_MS or FAKE_ERROR_RATE or FAKE_THROTTLE_RATE)
+
+    def history(self, symbol, period, interval):
+        if FAKE_LATENCY_MS:
+            time.sleep(random.expovariate(1.0 / FAKE_LATENCY_MS) / 1000.0)
+        r = random.random()
+        if r < FAKE_THROTTLE_RATE:
+            raise upstream.Throttled("Too Many Requests (injected)")
+        if r < FAKE_THROTTLE_RATE + FAKE_ERROR_RATE:
+            raise ConnectionError("injected upstream failure")
+        return synthetic_price_history(symbol, period=period, interval=interval)
+
+
+def make_provider(spec):
+    """
+    Build one provider from a STOCKSENSE_PROVIDERS entry, or None if it can't
+    be used here.
+    """
+    spec = spec.strip()
+    if spec == "yfinance":
+        return YFinanceProvider()
+    if spec == "alphavantage":
+        key = os.getenv("ALPHAVANTAGE_KEY")
+        if not key:
+            log.warning("alphavantage provider skipped: ALPHAVANTAGE_KEY is not set")
+            return None
+        return AlphaVantageProvider(key)
+    if spec.startswith("file:"):
+        directory = spec[len("file:"):]
+        if not os.path.isdir(directory):
+            log.warning("file provider skipped: %s is not a directory", directory)
+            return None
+        return FileProvider(directory)
+    if spec in ("synthetic", "fake"):
+        return SyntheticProvider()
+    raise ValueError("unknown provider: %r" % spec)
+
+
+_chain = None
+_chain_lock = threading.Lock()
+
+
+def get_chain():
+    global _chain
+    if _chain is None:
+        with _chain_lock:
+            if _chain is None:
+                chain = [p for p in map(make_provider, PROVIDERS.split(",")) if p is not None]
+                if not chain:
+                    raise ValueError("no usable provider in STOCKSENSE_PROVIDERS=%r" % PROVIDERS)
+                _chain = chain
+    return _chain
+
+
+def set_chain(providers):
+    """
+    Replace the provider chain (benchmarks, tests, tools).
+    """
+    global _chain
+    _chain = list(providers)
+
+
+def ordered(chain):
+    if PROVIDER_ORDER != "fastest":
+        return chain
+    # unmeasured first so they get measured; open breakers last
+    return sorted(chain, key=lambda p: (not p.available(),
+                                        -1.0 if p.latency is None else p.latency))
+
+
+def download(symbol, period, interval):
+    """
+    History from the first provider in the chain that has it. Raises NoData if
+    none of them knows the symbol, or UpstreamUnavailable if at least one
+    provider that might have had it could not be reached.
+    """
+    unavailable = None
+    for provider in ordered(get_chain()):
+        try:
+            df = provider.fetch(symbol, period, interval)
+        except ValueError:
+            # NoData, or a provider rejecting the symbol outright
+            continue
+        except upstream.UpstreamUnavailable as e:
+            unavailable = e
+            continue
+        except Exception as e:
+            # a broken local source (unreadable file, ...) shouldn't hide the others
+            log.warning("%s provider failed for %s: %s", provider.name, symbol, e)
+            unavailable = upstream.UpstreamUnavailable("%s failed: %s" % (provider.name, e), retry_after=1)
+            continue
+        return normalize_frame(df.copy())
+    if unavailable is not None:
+        raise unavailable
+    raise NoData("No data for symbol: " + symbol)
+
+
+def download_many(symbols, period, interval):
+    """
+    download() for a list of symbols, sharing bulk calls where a provider has
+    them. Returns ({symbol: frame}, {symbol: exception}); each failed symbol
+    gets NoData or the UpstreamUnavailable that kept a provider from answering.
+    """
+    frames, errors = {}, {}
+    remaining = list(symbols)
+    for provider in ordered(get_chain()):
+        if not remaining:
+            break
+        try:
+            got, unavailable = provider.fetch_many(remaining, period, interval)
+        except Exception as e:
+            log.warning("%s provider failed for a batch: %s", provider.name, e)
+            got, unavailable = {}, upstream.UpstreamUnavailable("%s failed: %s" % (provider.name, e),
+                                                                retry_after=1)
+        for symbol, df in got.items():
+            frames[symbol] = normalize_frame(df.copy())
+            errors.pop(symbol, None)
+        remaining = [s for s in remaining if s not in got]
+        if unavailable is not None:
+            for symbol in remaining:
+                errors[symbol] = unavailable
+    for symbol in remaining:
+        errors.setdefault(symbol, NoData("No data for symbol: " + symbol))
+    return frames, errors
+
+
+def export(directory, symbols, period="5y", interval="1d", fmt="csv"):
+    """
+    Write each symbol's history from the chain to DIR/<interval>/<SYMBOL>.<fmt>.
+    """
+    out_dir = os.path.join(directory, interval)
+    os.makedirs(out_dir, exist_ok=True)
+    written = 0
+    for symbol in symbols:
+        try:
+            df = download(symbol, period, interval)
+        except (NoData, upstream.UpstreamUnavailable) as e:
+            print("%-8s skipped: %s" % (symbol, e))
+            continue
+        path = os.path.join(out_dir, symbol.upper() + "." + fmt)
+        tmp = path + ".tmp"
+        if fmt == "parquet":
+            df[COLUMNS].to_parquet(tmp)
+        else:
+            df[COLUMNS].to_csv(tmp, float_format="%.6f")
+        os.replace(tmp, path)
+        written += 1
+    return written
+
+
+if __name__ == "__main__":
+    import argparse
+    from util_data import load_tickers_csv
+
+    ap = argparse.ArgumentParser(description="Download histories for offline use (file provider)")
+    ap.add_argument("command", choices=["export"])
+    ap.add_argument("directory")
+    ap.add_argument("symbols", nargs="*", help="default: every symbol in tickers.csv")
+    ap.add_argument("--period", default="5y")
+    ap.add_argument("--interval", default="1d")
+    ap.add_argument("--format", default="csv", choices=["csv", "parquet"])
+    args = ap.parse_args()
+    symbols = args.symbols or [s for s, _ in load_tickers_csv()]
+    t0 = time.perf_counter()
+    n = export(args.directory, symbols, period=args.period, interval=args.interval, fmt=args.format)
+    print("wrote %d of %d symbols to %s in %.1fs" % (n, len(symbols), args.directory,
+                                                       time.perf_counter() - t0))
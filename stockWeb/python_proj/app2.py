@@ -1,16 +1,29 @@
-from flask import Flask, render_template, request, redirect, url_for, session
-from pymongo import MongoClient
-from flask_bcrypt import Bcrypt
+from flask import Flask, render_template, request, redirect, url_for, session, jsonify
+from pymongo.errors import DuplicateKeyError
+from mongo import get_db
+import passwords
+import profiles
+import sessions
+import watchlist
 
 app = Flask(__name__)
 app.secret_key = "yoursecret123"
 
-bcrypt = Bcrypt(app)
+# bcrypt runs on a bounded pool (see passwords.py)
+passwords.init_app(app)
+# optional server-side session store (see sessions.py)
+sessions.init_app(app)
 
-# MongoDB connection
-client = MongoClient("mongodb://127.0.0.1:27017/")
-db = client["StockSenseDb"]
-users = db["users"]
+# connect and create the users/watchlists indexes at startup
+get_db()
+
+def current_profile():
+    """
+    Cached profile of the signed-in user (see profiles.py), or None.
+    """
+    if "user_id" not in session:
+        return None
+    return profiles.get_profile(get_db(), session["user_id"])
 
 # --------------------------
 # ROUTES
@@ -25,14 +38,20 @@ def signup():
     if request.method == "POST":
         name = request.form["name"]
         email = request.form["email"]
-        password = bcrypt.generate_password_hash(request.form["password"]).decode("utf-8")
+        try:
+            password = passwords.hash_password(request.form["password"])
+        except passwords.HashPoolBusy:
+            return "Server busy, please try again", 503
 
         # Insert user
-        result = users.insert_one({
-            "name": name,
-            "email": email,
-            "password": password
-        })
+        try:
+            result = get_db()["users"].insert_one({
+                "name": name,
+                "email": email,
+                "password": password
+            })
+        except DuplicateKeyError:
+            return "Email already registered", 409
 
         # AUTO LOGIN (store session)
         session["user_id"] = str(result.inserted_id)
@@ -49,12 +68,22 @@ def signin():
         email = request.form["email"]
         password = request.form["password"]
 
-        user = users.find_one({"email": email})
+        user = get_db()["users"].find_one({"email": email}, {"password": 1, "email": 1, "name": 1})
 
-        if user and bcrypt.check_password_hash(user["password"], password):
+        try:
+            ok = user is not None and passwords.check_password(user["password"], password)
+        except passwords.HashPoolBusy:
+            return "Server busy, please try again", 503
+
+        if ok:
             session["user_id"] = str(user["_id"])
             session["email"] = user["email"]
             session["name"] = user.get("name", "")
+            # reload the profile once at sign-in; later requests use the cache
+            profiles.invalidate(session["user_id"])
+            profile = current_profile()
+            # warm the cache for the user's watchlist while the dashboard loads
+            watchlist.start_prewarm(session["user_id"], profile["watchlist"] if profile else [])
             return redirect(url_for("dashboard"))
         else:
             return "Invalid credentials"
@@ -63,14 +92,81 @@ def signin():
 
 @app.route("/dashboard")
 def dashboard():
-    if "user_id" not in session:
+    profile = current_profile()
+    if profile is None:
         return redirect(url_for("signin"))
     return f"""
-        <h1>Welcome {session['name']}</h1>
+        <h1>Welcome {profile['name']}</h1>
         <h2>Dashboard Coming Soon...</h2>
         <a href='/logout'>Logout</a>
     """
 
+# --------------------------
+# WATCHLIST API
+# --------------------------
+
+@app.route("/api/profile")
+def api_profile():
+    profile = current_profile()
+    if profile is None:
+        return jsonify({"error": "not signed in"}), 401
+    return jsonify(profile)
+
+@app.route("/api/profile/preferences", methods=["PUT"])
+def api_profile_preferences():
+    if current_profile() is None:
+        return jsonify({"error": "not signed in"}), 401
+    try:
+        profile = profiles.update_preferences(get_db(), session["user_id"], request.get_json() or {})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(profile)
+
+@app.route("/api/watchlist", methods=["GET", "PUT"])
+def api_watchlist():
+    profile = current_profile()
+    if profile is None:
+        return jsonify({"error": "not signed in"}), 401
+    if request.method == "PUT":
+        data = request.get_json() or {}
+        try:
+            symbols = watchlist.set_watchlist(get_db(), profile["user_id"], profile["email"], data.get("symbols", []))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        profiles.invalidate(profile["user_id"])
+        watchlist.start_prewarm(profile["user_id"], symbols)
+        return jsonify({"symbols": symbols})
+    return jsonify({"symbols": profile["watchlist"]})
+
+@app.route("/api/watchlist/<symbol>", methods=["POST", "DELETE"])
+def api_watchlist_symbol(symbol):
+    profile = current_profile()
+    if profile is None:
+        return jsonify({"error": "not signed in"}), 401
+    try:
+        if request.method == "POST":
+            symbols = watchlist.add_symbol(get_db(), profile["user_id"], profile["email"], symbol)
+            watchlist.start_prewarm(profile["user_id"], [watchlist.normalize_symbol(symbol)])
+        else:
+            symbols = watchlist.remove_symbol(get_db(), profile["user_id"], symbol)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    profiles.invalidate(profile["user_id"])
+    return jsonify({"symbols": symbols})
+
+@app.route("/api/dashboard")
+def api_dashboard():
+    """
+    Watchlist rows served from the cache filled by the sign-in pre-warm.
+    """
+    profile = current_profile()
+    if profile is None:
+        return jsonify({"error": "not signed in"}), 401
+    return jsonify({
+        "watchlist": watchlist.dashboard_rows(profile["watchlist"]),
+        "prewarm": watchlist.prewarm_status(profile["user_id"]),
+    })
+
 @app.route("/logout")
 def logout():
     session.clear()
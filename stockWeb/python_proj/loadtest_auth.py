@@ -0,0 +1,114 @@
+# loadtest_auth.py
+"""
+Sign-in throughput under concurrent logins.
+
+    python loadtest_auth.py --in-process --users 50 --logins 400 --concurrency 16
+    python loadtest_auth.py --url http://127.0.0.1:5000 --logins 400 --concurrency 16
+
+--in-process runs app2 through Flask's test client against mongomock (set
+STOCKSENSE_MONGO_URI yourself to use a real database). Against a server the
+accounts are created through /signup first; re-running reuses them.
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import threading
+import urllib.parse
+import urllib.request
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+def http_sender(base_url, timeout):
+    opener = urllib.request.build_opener(_NoRedirect)
+    def send(path, form):
+        data = urllib.parse.urlencode(form).encode("utf-8")
+        req = urllib.request.Request(base_url.rstrip("/") + path, data=data, method="POST")
+        try:
+            with opener.open(req, timeout=timeout) as resp:
+                resp.read()
+                return resp.status
+        except urllib.error.HTTPError as e:
+            return e.code
+    return send
+
+
+def inprocess_sender():
+    os.environ.setdefault("STOCKSENSE_MONGO_URI", "mongomock://")
+    from app2 import app
+    local = threading.local()
+    def send(path, form):
+        if not hasattr(local, "client"):
+            local.client = app.test_client()
+        return local.client.post(path, data=form).status_code
+    return send
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100.0 * (len(values) - 1))))]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test app2 sign-in")
+    parser.add_argument("--url", default="http://127.0.0.1:5000")
+    parser.add_argument("--in-process", action="store_true")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--bad-ratio", type=float, default=0.1, help="share of logins with a wrong password")
+    parser.add_argument("--timeout", type=float, default=60)
+    args = parser.parse_args(argv)
+
+    send = inprocess_sender() if args.in_process else http_sender(args.url, args.timeout)
+    accounts = [("loadtest%d@example.com" % i, "pw-%d" % i) for i in range(args.users)]
+    for email, pw in accounts:
+        # 302 = created, 409 = already exists from an earlier run
+        status = send("/signup", {"name": "Load Test", "email": email, "password": pw})
+        if status not in (302, 409):
+            print("signup failed for %s: HTTP %s" % (email, status))
+            return 1
+
+    rnd = random.Random(0)
+    plan = []
+    for _ in range(args.logins):
+        email, pw = rnd.choice(accounts)
+        good = rnd.random() >= args.bad_ratio
+        plan.append((email, pw if good else pw + "-wrong", good))
+    results = [None] * len(plan)
+
+    def login(i):
+        email, pw, good = plan[i]
+        t0 = time.perf_counter()
+        status = send("/signin", {"email": email, "password": pw})
+        # success redirects to the dashboard, a wrong password renders 200
+        expected = 302 if good else 200
+        results[i] = (status == expected, status, time.perf_counter() - t0)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(login, range(len(plan))))
+    elapsed = time.perf_counter() - started
+
+    lat = [r[2] * 1000.0 for r in results]
+    wrong = [r for r in results if not r[0]]
+    busy = sum(1 for r in results if r[1] == 503)
+    print("%d sign-ins, concurrency %d, in %.2fs: %.1f logins/s" % (
+        len(plan), args.concurrency, elapsed, len(plan) / elapsed if elapsed else 0))
+    print("latency ms  p50 %.1f  p95 %.1f  p99 %.1f  max %.1f" % (
+        percentile(lat, 50), percentile(lat, 95), percentile(lat, 99), max(lat)))
+    print("unexpected responses: %d (503 busy: %d)" % (len(wrong), busy))
+    return 1 if wrong else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,59 @@
+# mongo.py
+"""
+One MongoClient per process, shared by every request thread.
+
+MongoClient keeps its own connection pool and is thread-safe, but it must not
+be carried across fork(), so it is created lazily in each worker (and
+re-created if the pid changes). Indexes are ensured on first use.
+
+    STOCKSENSE_MONGO_URI        connection string; mongomock:// uses an
+                                in-memory stand-in (needs mongomock)
+    STOCKSENSE_MONGO_POOL_SIZE  max connections per worker process
+"""
+import os
+import logging
+import threading
+
+from pymongo import MongoClient, ASCENDING
+from pymongo.errors import OperationFailure
+
+import watchlist
+
+log = logging.getLogger(__name__)
+
+MONGO_URI = os.getenv("STOCKSENSE_MONGO_URI", "mongodb://127.0.0.1:27017/")
+MONGO_DB = os.getenv("STOCKSENSE_MONGO_DB", "StockSenseDb")
+POOL_SIZE = int(os.getenv("STOCKSENSE_MONGO_POOL_SIZE", 50))
+
+_client = None
+_client_pid = None
+_lock = threading.Lock()
+
+
+def ensure_indexes(db):
+    try:
+        db["users"].create_index([("email", ASCENDING)], unique=True, name="email_unique")
+    except OperationFailure as e:
+        # existing duplicate emails block the unique index; keep lookups indexed
+        log.warning("could not create unique email index (%s); using a plain index", e)
+        db["users"].create_index([("email", ASCENDING)], name="email")
+    watchlist.ensure_indexes(db)
+
+
+def get_client():
+    global _client, _client_pid
+    if _client is None or _client_pid != os.getpid():
+        with _lock:
+            if _client is None or _client_pid != os.getpid():
+                if MONGO_URI.startswith("mongomock://"):
+                    import mongomock
+                    client = mongomock.MongoClient()
+                else:
+                    client = MongoClient(MONGO_URI, maxPoolSize=POOL_SIZE, connect=False)
+                ensure_indexes(client[MONGO_DB])
+                _client, _client_pid = client, os.getpid()
+    return _client
+
+
+def get_db():
+    return get_client()[MONGO_DB]
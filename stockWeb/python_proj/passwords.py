@@ -0,0 +1,81 @@
+# passwords.py
+"""
+bcrypt hashing off the request thread.
+
+bcrypt releases the GIL while it works, so running it on a small thread pool
+lets several logins hash in parallel without tying up a request thread per
+hash beyond the wait. The pool is bounded: once STOCKSENSE_HASH_QUEUE hashes
+are in flight, new ones raise HashPoolBusy instead of piling up behind a
+login burst; so does a hash still queued or running after
+STOCKSENSE_HASH_TIMEOUT seconds.
+
+STOCKSENSE_BCRYPT_ROUNDS sets the cost (bcrypt log rounds, default 12).
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+from flask_bcrypt import Bcrypt
+
+BCRYPT_ROUNDS = int(os.getenv("STOCKSENSE_BCRYPT_ROUNDS", 12))
+HASH_WORKERS = int(os.getenv("STOCKSENSE_HASH_WORKERS", os.cpu_count() or 2))
+HASH_QUEUE = int(os.getenv("STOCKSENSE_HASH_QUEUE", HASH_WORKERS * 8))
+HASH_TIMEOUT = float(os.getenv("STOCKSENSE_HASH_TIMEOUT", 10))
+
+
+class HashPoolBusy(Exception):
+    pass
+
+
+bcrypt = Bcrypt()
+_slots = threading.BoundedSemaphore(HASH_QUEUE)
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def init_app(app):
+    app.config.setdefault("BCRYPT_LOG_ROUNDS", BCRYPT_ROUNDS)
+    bcrypt.init_app(app)
+
+
+def _get_pool():
+    # threads don't survive fork, so each worker process builds its own pool
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                _pool = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="bcrypt")
+                _pool_pid = os.getpid()
+    return _pool
+
+
+def _run(fn, *args):
+    if not _slots.acquire(blocking=False):
+        raise HashPoolBusy("too many password checks in progress")
+    try:
+        fut = _get_pool().submit(fn, *args)
+    except Exception:
+        _slots.release()
+        raise
+    fut.add_done_callback(lambda f: _slots.release())
+    try:
+        return fut.result(timeout=HASH_TIMEOUT)
+    except FutureTimeout:
+        # a queued hash isn't worth running any more; a running one keeps its slot until done
+        fut.cancel()
+        raise HashPoolBusy("password check timed out")
+
+
+def hash_password(password):
+    """
+    bcrypt hash of `password` as a str, computed on the hashing pool.
+    """
+    return _run(bcrypt.generate_password_hash, password).decode("utf-8")
+
+
+def check_password(pw_hash, password):
+    """
+    True if `password` matches `pw_hash`, checked on the hashing pool.
+    """
+    return _run(bcrypt.check_password_hash, pw_hash, password)
@@ -0,0 +1,108 @@
+# profiles.py
+"""
+Cached user profiles, so authenticated requests don't each go to MongoDB.
+
+A profile is the user document without the password hash, plus its
+preferences and watchlist:
+
+    {"user_id", "email", "name", "preferences": {...}, "watchlist": [...]}
+
+Lookups go through a per-process LRU (STOCKSENSE_PROFILE_LOCAL_TTL seconds),
+then the optional shared backend given by STOCKSENSE_PROFILE_CACHE (any
+cache_store URL, e.g. redis://...), then MongoDB. Anything that changes the
+user, preferences or watchlist must call invalidate(); other workers' local
+copies expire after the local TTL.
+"""
+import os
+import sys
+
+from bson import ObjectId
+from bson.errors import InvalidId
+
+# cache_store lives one directory up, in stockWeb/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cache_store import LRUCache, make_cache
+import watchlist
+
+PROFILE_TTL = int(os.getenv("STOCKSENSE_PROFILE_TTL", 600))
+LOCAL_TTL = int(os.getenv("STOCKSENSE_PROFILE_LOCAL_TTL", 30))
+LOCAL_MAX = int(os.getenv("STOCKSENSE_PROFILE_LOCAL_MAX", 10000))
+SHARED_URL = os.getenv("STOCKSENSE_PROFILE_CACHE", "")
+
+_local = LRUCache(max_items=LOCAL_MAX, ttl=LOCAL_TTL)
+_shared = make_cache(SHARED_URL) if SHARED_URL else None
+
+# preference keys a user may set, with their defaults
+DEFAULT_PREFERENCES = {
+    "theme": "dark",
+    "default_period": "1mo",
+    "default_interval": "1d",
+}
+
+
+def _key(user_id):
+    return "profile:%s" % user_id
+
+
+def load_profile(db, user_id):
+    """
+    Build a profile from MongoDB, or None if the user doesn't exist.
+    """
+    try:
+        oid = ObjectId(user_id)
+    except (InvalidId, TypeError):
+        return None
+    user = db["users"].find_one({"_id": oid}, {"password": 0})
+    if user is None:
+        return None
+    prefs = dict(DEFAULT_PREFERENCES)
+    prefs.update(user.get("preferences") or {})
+    return {
+        "user_id": str(user["_id"]),
+        "email": user.get("email"),
+        "name": user.get("name", ""),
+        "preferences": prefs,
+        "watchlist": watchlist.get_watchlist(db, str(user["_id"])),
+    }
+
+
+def get_profile(db, user_id):
+    """
+    Cached profile for `user_id`; hits MongoDB only on a miss in both tiers.
+    """
+    key = _key(user_id)
+    profile = _local.get(key)
+    if profile is not None:
+        return profile
+    if _shared is not None:
+        profile = _shared.get(key)
+    if profile is None:
+        profile = load_profile(db, user_id)
+        if profile is None:
+            return None
+        if _shared is not None:
+            _shared.set(key, profile, ttl=PROFILE_TTL)
+    _local.set(key, profile)
+    return profile
+
+
+def invalidate(user_id):
+    key = _key(user_id)
+    _local.delete(key)
+    if _shared is not None:
+        _shared.delete(key)
+
+
+def update_preferences(db, user_id, changes):
+    """
+    Set known preference keys, then drop the cached profile.
+    """
+    unknown = set(changes) - set(DEFAULT_PREFERENCES)
+    if unknown:
+        raise ValueError("unknown preferences: %s" % ", ".join(sorted(unknown)))
+    if changes:
+        db["users"].update_one({"_id": ObjectId(user_id)},
+                               {"$set": {"preferences.%s" % k: v for k, v in changes.items()}})
+    invalidate(user_id)
+    return get_profile(db, user_id)
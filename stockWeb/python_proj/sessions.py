@@ -0,0 +1,77 @@
+# sessions.py
+"""
+Server-side Flask sessions.
+
+By default app2 keeps the session in Flask's signed cookie. Setting
+STOCKSENSE_SESSION_STORE to a cache_store URL (lru, file:/dir, redis://...)
+stores the session data there instead and leaves only a random session id in
+the cookie. Use a shared backend when running more than one worker.
+"""
+import os
+import sys
+import secrets
+
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cache_store import make_cache
+
+SESSION_STORE = os.getenv("STOCKSENSE_SESSION_STORE", "")
+SESSION_TTL = int(os.getenv("STOCKSENSE_SESSION_TTL", 7 * 24 * 3600))
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+
+
+class CacheSessionInterface(SessionInterface):
+    """
+    Session data kept in a cache_store backend under "session:<sid>".
+    """
+    def __init__(self, store, ttl=SESSION_TTL):
+        self.store = store
+        self.ttl = ttl
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            data = self.store.get("session:" + sid)
+            if data is not None:
+                return ServerSession(data, sid=sid)
+        return ServerSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if not session:
+            if session.modified:
+                self.store.delete("session:" + session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+        if session.modified:
+            # new id whenever the data changes (sign-in, sign-out) so an old
+            # cookie cannot be replayed
+            if not session.new:
+                self.store.delete("session:" + session.sid)
+                session.sid = secrets.token_urlsafe(32)
+            self.store.set("session:" + session.sid, dict(session), ttl=self.ttl)
+        elif not self.should_set_cookie(app, session):
+            return
+        response.set_cookie(name, session.sid, expires=self.get_expiration_time(app, session),
+                            httponly=self.get_cookie_httponly(app), domain=domain, path=path,
+                            secure=self.get_cookie_secure(app), samesite=self.get_cookie_samesite(app))
+
+
+def init_app(app):
+    if SESSION_STORE:
+        app.session_interface = CacheSessionInterface(make_cache(SESSION_STORE))
+    return app
@@ -0,0 +1,190 @@
+# watchlist.py
+"""
+Per-user watchlists, stored in a `watchlists` collection next to `users`:
+
+    {"user_id": "<users._id as str>", "email": "...", "symbols": ["AAPL", ...],
+     "updated_at": datetime}
+
+and the background pre-warm that fills the market data cache for a
+watchlist when its owner signs in.
+"""
+import os
+import sys
+import logging
+import threading
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+
+from pymongo import ASCENDING, ReturnDocument
+
+# the data/model modules live one directory up, in stockWeb/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cache_store import LRUCache
+
+log = logging.getLogger(__name__)
+
+MAX_SYMBOLS = int(os.getenv("STOCKSENSE_WATCHLIST_MAX", 50))
+PREWARM_WORKERS = int(os.getenv("STOCKSENSE_PREWARM_WORKERS", 4))
+# pre-warm status is kept for this many users, each for this long after the last pre-warm
+PREWARM_USERS = int(os.getenv("STOCKSENSE_PREWARM_USERS", 10000))
+PREWARM_STATE_TTL = int(os.getenv("STOCKSENSE_PREWARM_STATE_TTL", 3600))
+# what the dashboard shows for each watchlist symbol
+HISTORY_PERIOD, HISTORY_INTERVAL = "1mo", "1d"
+PREDICT_PERIOD, PREDICT_INTERVAL = "2y", "1d"
+
+
+def ensure_indexes(db):
+    db["watchlists"].create_index([("user_id", ASCENDING)], unique=True, name="user_id_unique")
+    db["watchlists"].create_index([("email", ASCENDING)], name="email")
+
+
+def normalize_symbol(symbol):
+    sym = (symbol or "").strip().upper()
+    if not sym or len(sym) > 15 or not all(c.isalnum() or c in ".-^=" for c in sym):
+        raise ValueError("invalid symbol: %r" % symbol)
+    return sym
+
+
+def get_watchlist(db, user_id):
+    doc = db["watchlists"].find_one({"user_id": user_id}, {"symbols": 1})
+    return doc["symbols"] if doc else []
+
+
+def set_watchlist(db, user_id, email, symbols):
+    """
+    Replace the user's watchlist. Symbols are normalized and de-duplicated in order.
+    """
+    clean = []
+    for s in symbols:
+        s = normalize_symbol(s)
+        if s not in clean:
+            clean.append(s)
+    if len(clean) > MAX_SYMBOLS:
+        raise ValueError("watchlist is limited to %d symbols" % MAX_SYMBOLS)
+    db["watchlists"].update_one(
+        {"user_id": user_id},
+        {"$set": {"symbols": clean, "email": email, "updated_at": datetime.now(timezone.utc)}},
+        upsert=True)
+    _forget(user_id, clean)
+    return clean
+
+
+def add_symbol(db, user_id, email, symbol):
+    sym = normalize_symbol(symbol)
+    current = get_watchlist(db, user_id)
+    if sym not in current and len(current) >= MAX_SYMBOLS:
+        raise ValueError("watchlist is limited to %d symbols" % MAX_SYMBOLS)
+    doc = db["watchlists"].find_one_and_update(
+        {"user_id": user_id},
+        {"$addToSet": {"symbols": sym},
+         "$set": {"email": email, "updated_at": datetime.now(timezone.utc)}},
+        upsert=True, return_document=ReturnDocument.AFTER)
+    return doc["symbols"]
+
+
+def remove_symbol(db, user_id, symbol):
+    sym = normalize_symbol(symbol)
+    doc = db["watchlists"].find_one_and_update(
+        {"user_id": user_id},
+        {"$pull": {"symbols": sym}, "$set": {"updated_at": datetime.now(timezone.utc)}},
+        return_document=ReturnDocument.AFTER)
+    symbols = doc["symbols"] if doc else []
+    _forget(user_id, symbols)
+    return symbols
+
+
+# user_id -> {symbol: "running" | "ok" | error text}; least recently warmed
+# users are dropped past PREWARM_USERS, and any after PREWARM_STATE_TTL
+_prewarm_state = LRUCache(max_items=PREWARM_USERS, ttl=PREWARM_STATE_TTL)
+_prewarm_lock = threading.Lock()
+_pool = None
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        _pool = ThreadPoolExecutor(max_workers=PREWARM_WORKERS, thread_name_prefix="prewarm")
+    return _pool
+
+
+def _warm_symbol(symbol):
+    import predict_service
+    predict_service.get_indicators(symbol, period=HISTORY_PERIOD, interval=HISTORY_INTERVAL)
+    out = predict_service.predict_symbol(symbol, period=PREDICT_PERIOD, interval=PREDICT_INTERVAL)
+    return out.get("error") or "ok"
+
+
+def _record(user_id, symbol, fut):
+    try:
+        result = fut.result()
+    except Exception as e:
+        log.warning("pre-warm of %s failed: %s", symbol, e)
+        result = "failed: %s" % e
+    with _prewarm_lock:
+        state = _prewarm_state.get(user_id)
+        # not recorded if the symbol was removed (or the state expired) meanwhile
+        if state is not None and symbol in state:
+            state[symbol] = result
+
+
+def _forget(user_id, keep):
+    """
+    Drop the pre-warm status of symbols no longer on the user's watchlist.
+    """
+    with _prewarm_lock:
+        state = _prewarm_state.get(user_id)
+        if state is not None:
+            for sym in [s for s in state if s not in keep]:
+                del state[sym]
+
+
+def start_prewarm(user_id, symbols):
+    """
+    Fetch history, indicators and predictions for `symbols` on the pre-warm
+    pool and return immediately. Symbols already being warmed for the user are
+    not submitted twice. Returns the list of symbols submitted.
+    """
+    submitted = []
+    with _prewarm_lock:
+        state = _prewarm_state.get(user_id) or {}
+        # (re)stored so the TTL counts from the latest pre-warm
+        _prewarm_state.set(user_id, state)
+        for sym in symbols:
+            if state.get(sym) == "running":
+                continue
+            state[sym] = "running"
+            submitted.append(sym)
+    for sym in submitted:
+        fut = _get_pool().submit(_warm_symbol, sym)
+        fut.add_done_callback(lambda f, sym=sym: _record(user_id, sym, f))
+    return submitted
+
+
+def prewarm_status(user_id):
+    with _prewarm_lock:
+        state = dict(_prewarm_state.get(user_id) or {})
+    if not state:
+        status = "idle"
+    elif "running" in state.values():
+        status = "running"
+    else:
+        status = "done"
+    return {"status": status, "symbols": state}
+
+
+def dashboard_rows(symbols):
+    """
+    Per-symbol dashboard data read from the cache only; symbols that are not
+    warm yet are reported as pending rather than fetched on the request thread.
+    """
+    import predict_service
+    rows = []
+    for sym in symbols:
+        pred = predict_service.cached_prediction(sym, PREDICT_PERIOD, PREDICT_INTERVAL)
+        warm = predict_service.indicators_ready(sym, HISTORY_PERIOD, HISTORY_INTERVAL)
+        row = {"symbol": sym, "ready": pred is not None and warm}
+        if pred is not None:
+            row.update({k: pred.get(k) for k in ("last_close", "predicted_close", "predicted_pct_change", "confidence")})
+        rows.append(row)
+    return rows
@@ -0,0 +1,78 @@
+# sentiment.py
+"""
+News headlines (NewsAPI.org) and VADER sentiment scores, shared by the
+/api/extras and /api/sentiment routes and the snapshot build job.
+"""
+from startup import lazy_module, lazy_object
+
+requests = lazy_module("requests")
+vader = lazy_module("vaderSentiment.vaderSentiment")
+
+NEWS_PAGE_SIZE = 12
+
+
+def _make_analyzer():
+    # loading the VADER lexicon takes a noticeable part of startup
+    return vader.SentimentIntensityAnalyzer()
+
+get_analyzer = lazy_object(_make_analyzer)
+
+
+def score_list(items):
+    """
+    Mean VADER scores over a list of texts.
+    """
+    analyzer = get_analyzer()
+    scores = [analyzer.polarity_scores(str(t)) for t in items]
+    if not scores:
+        return {"count":0,"avg_compound":0,"pos":0,"neg":0,"neu":0}
+    compounds = [s['compound'] for s in scores]
+    return {
+        "count": len(scores),
+        "avg_compound": float(sum(compounds)/len(compounds)),
+        "pos": float(sum(s['pos'] for s in scores)/len(scores)),
+        "neg": float(sum(s['neg'] for s in scores)/len(scores)),
+        "neu": float(sum(s['neu'] for s in scores)/len(scores))
+    }
+
+
+def label_for(compound):
+    if compound >= 0.05:
+        return "positive"
+    if compound <= -0.05:
+        return "negative"
+    return "neutral"
+
+
+def fetch_news(query, api_key):
+    """
+    Latest articles for a query. Returns (articles, error), error being None
+    or a message (no key, HTTP/API error).
+    """
+    if not api_key:
+        return [], "NEWSAPI_KEY not set in .env"
+    articles = []
+    try:
+        params = {
+            "q": query,
+            "pageSize": NEWS_PAGE_SIZE,
+            "sortBy": "publishedAt",
+            "language": "en",
+            "apiKey": api_key
+        }
+        resp = requests.get("https://newsapi.org/v2/everything", params=params, timeout=12)
+        data = resp.json()
+        if resp.status_code == 200 and data.get("articles"):
+            for a in data.get("articles", [])[:NEWS_PAGE_SIZE]:
+                articles.append({
+                    "title": a.get("title"),
+                    "source": a.get("source", {}).get("name"),
+                    "url": a.get("url"),
+                    "publishedAt": a.get("publishedAt"),
+                    "description": a.get("description")
+                })
+        else:
+            return [], data.get("message") or data.get("status") or f"HTTP {resp.status_code}"
+    except Exception as e:
+        return [], str(e)
+    return articles, None
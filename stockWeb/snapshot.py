@@ -0,0 +1,376 @@
+# snapshot.py
+"""
+Precomputed end-of-day snapshot of the dashboard view for every symbol in
+tickers.csv: last close, indicators, predicted next close and headline
+sentiment.
+
+    python snapshot.py build                      # after the close, e.g. from cron
+    python snapshot.py build --chunk 50 --jobs 2 --no-news
+    python snapshot.py show AAPL MSFT
+
+The build fetches histories with shared bulk calls and runs compute_indicators
+and the forest fits (predict_service.predict_batch, on its process pool) chunk
+by chunk, several chunks at a time. It writes one file:
+
+    "SSSN" | u32 version | u32 header length | JSON header | float64 rows
+
+The header holds the build time, period/interval, the field names and the
+symbols in row order; each row is len(FIELDS) little-endian doubles (NaN for
+missing values), about 170 bytes per symbol. The file is written next to its
+destination and renamed over it, so readers only ever see a complete file.
+
+The app memory-maps the file at startup (STOCKSENSE_SNAPSHOT, default
+eod_snapshot.bin next to this file) and serves /api/snapshot from it by
+unpacking single rows out of the mapping. Every STOCKSENSE_SNAPSHOT_CHECK
+seconds it stats the path and maps the new file after a rebuild; requests
+still holding the old mapping finish with it. /api/predict answers from the
+snapshot for its period/interval while the snapshot is younger than
+STOCKSENSE_SNAPSHOT_MAX_AGE, no fresher prediction is cached and the symbol
+hasn't been retuned (tuning.py) since the build.
+"""
+import os
+import sys
+import json
+import math
+import mmap
+import time
+import array
+import struct
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from startup import lazy_module
+import model_registry
+
+pd = lazy_module("pandas")
+
+SNAPSHOT_PATH = os.getenv("STOCKSENSE_SNAPSHOT",
+                          os.path.join(os.path.dirname(os.path.abspath(__file__)), "eod_snapshot.bin"))
+SNAPSHOT_CHECK = float(os.getenv("STOCKSENSE_SNAPSHOT_CHECK", 30))
+SNAPSHOT_MAX_AGE = float(os.getenv("STOCKSENSE_SNAPSHOT_MAX_AGE", 26 * 3600))
+SNAPSHOT_CHUNK = int(os.getenv("STOCKSENSE_SNAPSHOT_CHUNK", 50))
+SNAPSHOT_JOBS = int(os.getenv("STOCKSENSE_SNAPSHOT_JOBS", 2))
+
+MAGIC = b"SSSN"
+FORMAT_VERSION = 1
+INDICATORS = ["sma7", "sma30", "ema20", "rsi", "macd", "macd_signal", "bb_high", "bb_low", "volatility"]
+PREDICTION = ["predicted_close", "predicted_pct_change", "confidence", "r2"]
+FIELDS = (["date", "last_close", "prev_close", "change_pct", "volume"] + INDICATORS + PREDICTION
+          + ["sentiment", "headlines", "stale"])
+_PREFIX = struct.Struct("<4sII")
+
+_current = None
+_checked = 0.0
+_lock = threading.Lock()
+
+
+def _num(value):
+    if value is None:
+        return None
+    value = float(value)
+    return None if math.isnan(value) else value
+
+
+class Snapshot:
+    """
+    A read-only mapping of one snapshot file.
+    """
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            st = os.fstat(f.fileno())
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        # the file this mapping is of; a rebuild renames a new one over the path
+        self.identity = (st.st_ino, st.st_size, st.st_mtime_ns)
+        magic, version, hlen = _PREFIX.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError("not a snapshot file: " + path)
+        if version != FORMAT_VERSION:
+            raise ValueError("unsupported snapshot version %s" % version)
+        header = json.loads(self._mm[_PREFIX.size:_PREFIX.size + hlen])
+        self.path = path
+        self.built_at = header["built_at"]
+        self.period = header["period"]
+        self.interval = header["interval"]
+        self.fields = header["fields"]
+        self.symbols = header["symbols"]
+        self.errors = header.get("errors", {})
+        self._index = {s: i for i, s in enumerate(self.symbols)}
+        self._row = struct.Struct("<%dd" % len(self.fields))
+        self._base = _PREFIX.size + hlen
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def __contains__(self, symbol):
+        return symbol.upper() in self._index
+
+    @property
+    def age(self):
+        return time.time() - self.built_at
+
+    def row(self, symbol):
+        """
+        {field: value} for a symbol (NaN as None), or None if not in the snapshot.
+        """
+        i = self._index.get(symbol.upper())
+        if i is None:
+            return None
+        values = self._row.unpack_from(self._mm, self._base + i * self._row.size)
+        return {f: _num(v) for f, v in zip(self.fields, values)}
+
+    def get(self, symbol):
+        """
+        The /api/snapshot entry for a symbol, or None.
+        """
+        r = self.row(symbol)
+        if r is None:
+            return None
+        out = {
+            "symbol": symbol.upper(),
+            "date": datetime.datetime.fromtimestamp(r["date"], datetime.timezone.utc)
+                                     .strftime('%Y-%m-%dT%H:%M:%S') if r["date"] is not None else None,
+            "last_close": r["last_close"],
+            "prev_close": r["prev_close"],
+            "change_pct": r["change_pct"],
+            "volume": r["volume"],
+            "indicators": {k: r[k] for k in INDICATORS},
+            "prediction": None,
+            "sentiment": None,
+        }
+        if r["predicted_close"] is not None:
+            out["prediction"] = {k: r[k] for k in PREDICTION}
+        if r["headlines"] is not None:
+            from sentiment import label_for
+            out["sentiment"] = {"compound": r["sentiment"], "headlines": int(r["headlines"]),
+                                "label": label_for(r["sentiment"] or 0.0)}
+        if r["stale"]:
+            out["stale"] = True
+        return out
+
+    def prediction(self, symbol, period, interval):
+        """
+        The /api/predict payload for a symbol if this snapshot can answer it:
+        same period/interval, not older than SNAPSHOT_MAX_AGE, and a
+        prediction made from fresh data with the symbol's current model
+        configuration. Else None.
+        """
+        if period != self.period or interval != self.interval or self.age > SNAPSHOT_MAX_AGE:
+            return None
+        r = self.row(symbol)
+        if r is None or r["predicted_close"] is None or r["stale"]:
+            return None
+        cfg = model_registry.get_config(symbol, interval)
+        if cfg is not None and cfg["tuned_at"] > self.built_at:
+            return None
+        return {"symbol": symbol, "last_close": r["last_close"],
+                "predicted_close": r["predicted_close"],
+                "predicted_pct_change": r["predicted_pct_change"],
+                "confidence": r["confidence"], "r2": r["r2"]}
+
+    def close(self):
+        self._mm.close()
+
+
+def _identity(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+def get_snapshot():
+    """
+    The current Snapshot, or None if no snapshot has been built. Picks up a
+    rebuilt file at most every SNAPSHOT_CHECK seconds.
+    """
+    global _current, _checked
+    now = time.monotonic()
+    if _checked and now - _checked < SNAPSHOT_CHECK:
+        return _current
+    with _lock:
+        if _checked and now - _checked < SNAPSHOT_CHECK:
+            return _current
+        ident = _identity(SNAPSHOT_PATH)
+        if ident is None:
+            _current = None
+        elif _current is None or _current.identity != ident:
+            try:
+                _current = Snapshot(SNAPSHOT_PATH)
+            except (OSError, ValueError, struct.error):
+                # keep serving the previous one rather than a broken file
+                pass
+        _checked = time.monotonic()
+    return _current
+
+
+def write_snapshot(path, rows, period, interval, errors=None):
+    """
+    Write {symbol: {field: value}} as a snapshot file and rename it over `path`.
+    """
+    symbols = [s.upper() for s in rows]
+    header = json.dumps({"built_at": time.time(), "period": period, "interval": interval,
+                         "fields": FIELDS, "symbols": symbols, "errors": errors or {}}).encode("utf-8")
+    # rows start 8-byte aligned
+    header += b" " * (-(_PREFIX.size + len(header)) % 8)
+    body = array.array("d")
+    for values in rows.values():
+        body.extend(float("nan") if values.get(f) is None else float(values[f]) for f in FIELDS)
+    if sys.byteorder != "little":
+        body.byteswap()
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    tmp = "%s.tmp.%d" % (path, os.getpid())
+    try:
+        with open(tmp, "wb") as f:
+            f.write(_PREFIX.pack(MAGIC, FORMAT_VERSION, len(header)))
+            f.write(header)
+            f.write(body.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return len(symbols)
+
+
+def _headline_sentiment(symbol, api_key):
+    """
+    (mean compound, headline count) over the symbol's news, as /api/extras
+    would show it, or (None, None) when no news could be fetched.
+    """
+    from cache_store import get_cache
+    from http_cache import NEWS_MAX_AGE
+    from sentiment import fetch_news, score_list
+    key = "news:" + symbol.lower()
+    results = get_cache().get(key)
+    if results is None:
+        articles, error = fetch_news(symbol, api_key)
+        if error:
+            return None, None
+        results = {"news": articles}
+        get_cache().set(key, results, ttl=NEWS_MAX_AGE)
+    score = score_list([a["title"] for a in results["news"] if a.get("title")])
+    return score["avg_compound"], score["count"]
+
+
+def _snapshot_row(df_ind, prediction, sentiment):
+    close = df_ind['Close']
+    ts = pd.Timestamp(df_ind['date'].iloc[-1])
+    if ts.tzinfo is not None:
+        # keep the exchange's wall-clock date, as /api/history shows it
+        ts = ts.tz_localize(None)
+    row = {
+        "date": ts.value / 1e9,
+        "last_close": close.iloc[-1],
+        "prev_close": close.iloc[-2] if len(close) > 1 else None,
+        "volume": df_ind['Volume'].iloc[-1] if 'Volume' in df_ind.columns else None,
+        "sentiment": sentiment[0],
+        "headlines": sentiment[1],
+        "stale": 1.0 if df_ind.attrs.get("stale") else 0.0,
+    }
+    if row["prev_close"]:
+        row["change_pct"] = (row["last_close"] - row["prev_close"]) / row["prev_close"] * 100.0
+    for col in INDICATORS:
+        if col in df_ind.columns:
+            row[col] = df_ind[col].iloc[-1]
+    if prediction and "error" not in prediction:
+        row.update({k: prediction.get(k) for k in PREDICTION})
+    return row
+
+
+def _build_chunk(symbols, period, interval, news_key):
+    from predict_service import get_indicators, predict_batch, _model_frame
+    import util_data
+    util_data.prefetch_histories(symbols, period, interval)
+    predictions = {out["symbol"]: out for out in predict_batch(symbols, period=period, interval=interval)}
+    rows, errors = {}, {}
+    for symbol in symbols:
+        try:
+            df_ind = _model_frame(get_indicators(symbol, period=period, interval=interval))
+            sentiment = _headline_sentiment(symbol, news_key) if news_key else (None, None)
+            rows[symbol] = _snapshot_row(df_ind, predictions.get(symbol), sentiment)
+        except Exception as e:
+            errors[symbol] = str(e)
+            continue
+        if "error" in predictions.get(symbol, {}):
+            errors[symbol] = predictions[symbol]["error"]
+    return rows, errors
+
+
+def build(symbols, path=None, period="2y", interval="1d", chunk=SNAPSHOT_CHUNK, jobs=SNAPSHOT_JOBS,
+          news_key=None, progress=None):
+    """
+    Build and write the snapshot for `symbols`. Symbols without data are left
+    out (their errors are recorded in the header). Returns (rows written,
+    errors); raises RuntimeError, leaving the old file, if nothing was built.
+    """
+    chunks = [symbols[i:i + chunk] for i in range(0, len(symbols), max(1, chunk))]
+    rows, errors, done = {}, {}, 0
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        futures = {pool.submit(_build_chunk, c, period, interval, news_key): len(c) for c in chunks}
+        for fut in as_completed(futures):
+            r, e = fut.result()
+            rows.update(r)
+            errors.update(e)
+            done += futures[fut]
+            if progress:
+                progress(done, len(symbols))
+    if not rows:
+        # e.g. every provider down: keep the previous snapshot
+        raise RuntimeError("no symbol could be built; snapshot not written")
+    # keep the tickers.csv order
+    rows = {s: rows[s] for s in symbols if s in rows}
+    written = write_snapshot(path or SNAPSHOT_PATH, rows, period, interval, errors)
+    return written, errors
+
+
+def main(argv=None):
+    import argparse
+    import warnings
+    from dotenv import load_dotenv
+    from util_data import load_tickers_csv
+
+    warnings.filterwarnings("ignore")
+    load_dotenv()
+    ap = argparse.ArgumentParser(description="Build or inspect the end-of-day snapshot")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    b = sub.add_parser("build", help="build the snapshot for every symbol in tickers.csv")
+    b.add_argument("--out", default=SNAPSHOT_PATH)
+    b.add_argument("--tickers", default="tickers.csv")
+    b.add_argument("--period", default="2y")
+    b.add_argument("--interval", default="1d")
+    b.add_argument("--chunk", type=int, default=SNAPSHOT_CHUNK)
+    b.add_argument("--jobs", type=int, default=SNAPSHOT_JOBS, help="chunks processed at once")
+    b.add_argument("--no-news", action="store_true", help="skip headline sentiment")
+    s = sub.add_parser("show", help="print snapshot entries")
+    s.add_argument("symbols", nargs="*")
+    s.add_argument("--path", default=SNAPSHOT_PATH)
+    args = ap.parse_args(argv)
+
+    if args.cmd == "show":
+        snap = Snapshot(args.path)
+        print("built %s, %d symbols, %s/%s, %d errors" % (
+            time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(snap.built_at)), len(snap),
+            snap.period, snap.interval, len(snap.errors)))
+        for sym in args.symbols or snap.symbols[:10]:
+            print(json.dumps(snap.get(sym)))
+        return 0
+
+    symbols = [sym for sym, _ in load_tickers_csv(args.tickers)]
+    news_key = None if args.no_news else os.getenv("NEWSAPI_KEY")
+    t0 = time.time()
+    def progress(done, total):
+        print("  %d/%d symbols  %.1fs" % (done, total, time.time() - t0), flush=True)
+    written, errors = build(symbols, path=args.out, period=args.period, interval=args.interval,
+                            chunk=args.chunk, jobs=args.jobs, news_key=news_key, progress=progress)
+    for sym, msg in sorted(errors.items()):
+        print("%-8s %s" % (sym, msg))
+    print("wrote %d symbols to %s in %.1fs (%d errors)" % (written, args.out, time.time() - t0, len(errors)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,198 @@
+# startup.py
+"""
+Lazy loading of the heavy dependencies and a report of what they cost.
+
+The app modules reference pandas, numpy, sklearn, ta, yfinance and requests
+through lazy_module() proxies, so importing app.py only loads Flask. The real
+import happens on first attribute access, or earlier depending on
+STOCKSENSE_PRELOAD:
+
+    lazy        load each module the first time a route touches it (default)
+    background  start loading everything in a daemon thread right away, so
+                the server can accept requests while the imports run
+    eager       load everything before returning from the app import
+                (wsgi.py uses this so gunicorn workers inherit the modules)
+
+Run `python startup.py` for a per-module import cost table.
+"""
+import os
+import sys
+import time
+import types
+import logging
+import importlib
+import threading
+import subprocess
+
+log = logging.getLogger(__name__)
+
+PRELOAD_MODE = os.getenv("STOCKSENSE_PRELOAD", "lazy")
+
+# loaded by preload(), in this order
+HEAVY_MODULES = [
+    "numpy",
+    "pandas",
+    "requests",
+    "ta.trend",
+    "ta.volatility",
+    "ta.momentum",
+    "sklearn.ensemble",
+    "sklearn.model_selection",
+    "sklearn.metrics",
+    "yfinance",
+    "vaderSentiment.vaderSentiment",
+]
+
+# module name -> seconds spent importing it in this process
+IMPORT_TIMES = {}
+_preload_state = {"mode": PRELOAD_MODE, "status": "idle", "started": None, "finished": None, "error": None}
+_factories = []
+
+
+def timed_import(name):
+    """
+    Import a module, recording how long it took if it was not already loaded.
+    """
+    # always go through import_module: a module can be in sys.modules while
+    # another thread is still executing it, and the import lock waits for that
+    loaded = name in sys.modules
+    t0 = time.perf_counter()
+    mod = importlib.import_module(name)
+    if not loaded:
+        IMPORT_TIMES.setdefault(name, time.perf_counter() - t0)
+    return mod
+
+
+class LazyModule(types.ModuleType):
+    """
+    Module placeholder that imports the real module on first attribute access.
+    """
+    def __init__(self, name):
+        super().__init__(name)
+        self.__dict__["_lazy_target"] = name
+
+    def __getattr__(self, attr):
+        mod = timed_import(self.__dict__["_lazy_target"])
+        value = getattr(mod, attr)
+        # cache on the proxy so later lookups skip __getattr__
+        self.__dict__[attr] = value
+        return value
+
+    def __repr__(self):
+        return "<lazy module %r>" % self.__dict__["_lazy_target"]
+
+
+def lazy_module(name):
+    if PRELOAD_MODE == "eager":
+        return timed_import(name)
+    return LazyModule(name)
+
+
+def lazy_object(factory):
+    """
+    Wrap a zero-argument factory so it runs once, on first call of the returned
+    getter (or during preload()).
+    """
+    lock = threading.Lock()
+    box = []
+
+    def get():
+        if not box:
+            with lock:
+                if not box:
+                    t0 = time.perf_counter()
+                    box.append(factory())
+                    IMPORT_TIMES.setdefault(factory.__name__, time.perf_counter() - t0)
+        return box[0]
+
+    _factories.append(get)
+    return get
+
+
+def preload():
+    """
+    Import every heavy module and build every lazy_object now.
+    """
+    _preload_state["status"] = "running"
+    _preload_state["started"] = time.time()
+    try:
+        for name in HEAVY_MODULES:
+            timed_import(name)
+        for get in list(_factories):
+            get()
+        _preload_state["status"] = "done"
+    except Exception as e:
+        _preload_state["status"] = "failed"
+        _preload_state["error"] = str(e)
+        log.exception("preload failed")
+    _preload_state["finished"] = time.time()
+    log.info("preload %s in %.2fs", _preload_state["status"],
+             _preload_state["finished"] - _preload_state["started"])
+
+
+def start_preload(mode=None):
+    """
+    Apply the configured STOCKSENSE_PRELOAD mode. Call once the lazy objects
+    have been registered (i.e. at the end of app.py's imports).
+    """
+    mode = mode or PRELOAD_MODE
+    _preload_state["mode"] = mode
+    if mode == "eager":
+        preload()
+    elif mode == "background":
+        t = threading.Thread(target=preload, name="stocksense-preload", daemon=True)
+        t.start()
+    elif mode != "lazy":
+        raise ValueError("Unknown STOCKSENSE_PRELOAD mode: " + mode)
+
+
+def startup_report():
+    """
+    Preload state plus the import time of each module loaded so far.
+    """
+    return {
+        "mode": _preload_state["mode"],
+        "status": _preload_state["status"],
+        "error": _preload_state["error"],
+        "preload_seconds": (_preload_state["finished"] - _preload_state["started"])
+        if _preload_state["finished"] else None,
+        "import_ms": {k: round(v * 1000.0, 1) for k, v in IMPORT_TIMES.items()},
+    }
+
+
+def import_cost(target="app"):
+    """
+    Import `target` in a fresh interpreter with -X importtime and return
+    [(package, self_us, n_modules)] for each top-level package, where self_us
+    is the import time of all of the package's own modules (dependencies are
+    counted under their own package), largest first.
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, STOCKSENSE_PRELOAD="eager")
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", "import " + target],
+                          cwd=here, env=env, capture_output=True, text=True)
+    totals = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        parts = line[len("import time:"):].split("|")
+        try:
+            self_us = int(parts[0])
+        except ValueError:
+            continue
+        top = parts[2].strip().split(".")[0]
+        s, n = totals.get(top, (0, 0))
+        totals[top] = (s + self_us, n + 1)
+    rows = [(k, s, n) for k, (s, n) in totals.items()]
+    rows.sort(key=lambda r: r[1], reverse=True)
+    return rows
+
+
+if __name__ == "__main__":
+    target = sys.argv[1] if len(sys.argv) > 1 else "app"
+    rows = import_cost(target)
+    total = sum(r[1] for r in rows)
+    print("%-32s %12s %9s" % ("package", "import ms", "modules"))
+    for name, self_us, n_modules in rows[:30]:
+        print("%-32s %12.1f %9d" % (name, self_us / 1000.0, n_modules))
+    print("total import time for %s: %.1f ms" % (target, total / 1000.0))
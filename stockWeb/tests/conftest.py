@@ -0,0 +1,6 @@
+# tests/conftest.py
+# the app's modules import each other as top-level modules (python app.py runs from stockWeb/)
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
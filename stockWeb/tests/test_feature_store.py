@@ -0,0 +1,64 @@
+# tests/test_feature_store.py
+import numpy as np
+
+import feature_store
+import model_predict
+import providers
+import util_data
+
+
+def _history(full, start, stop):
+    return util_data.compute_indicators(full.iloc[start:stop])
+
+
+def _assert_matches_prepare_features(X, y, ind, n_lags=10):
+    X2, y2, _ = model_predict.prepare_features(ind, n_lags=n_lags)
+    np.testing.assert_allclose(np.asarray(X), X2.to_numpy(), rtol=1e-12, atol=1e-12)
+    np.testing.assert_allclose(np.asarray(y), np.asarray(y2), rtol=1e-12, atol=1e-12)
+
+
+def test_rolling_period_appends_instead_of_rebuilding(tmp_path):
+    store = feature_store.FeatureStore(str(tmp_path))
+    full = providers.synthetic_price_history("AAPL", period="2y")
+    n = len(full)
+
+    day0 = _history(full, n - 260, n - 8)
+    store.design_matrix("AAPL", day0)
+    entry = store.read("AAPL")
+    assert entry.rows == len(day0) - 1  # the last bar may still be forming
+
+    # next day: the one-year window drops its first bar and gains a new one
+    day1 = _history(full, n - 259, n - 7)
+    X, y, _ = store.design_matrix("AAPL", day1)
+    after = store.read("AAPL")
+    assert after.meta["gen"] == entry.meta["gen"]
+    assert after.rows == entry.rows + 1
+    assert after.dates[0] == entry.dates[0]
+    _assert_matches_prepare_features(X, y, day1)
+
+
+def test_shorter_period_is_sliced_from_a_longer_entry(tmp_path):
+    store = feature_store.FeatureStore(str(tmp_path))
+    full = providers.synthetic_price_history("AAPL", period="5y")
+    n = len(full)
+
+    store.design_matrix("AAPL", _history(full, 0, n))
+    gen = store.read("AAPL").meta["gen"]
+    for start in (n - 252, n - 504, n - 900):
+        ind = _history(full, start, n)
+        X, y, _ = store.design_matrix("AAPL", ind)
+        _assert_matches_prepare_features(X, y, ind)
+    assert store.read("AAPL").meta["gen"] == gen
+
+
+def test_forming_bar_does_not_rebuild(tmp_path):
+    store = feature_store.FeatureStore(str(tmp_path))
+    full = providers.synthetic_price_history("AAPL", period="1y")
+
+    ind = _history(full, 0, len(full))
+    store.design_matrix("AAPL", ind)
+    gen = store.read("AAPL").meta["gen"]
+    ind.loc[ind.index[-1], "Close"] *= 1.01
+    X, y, _ = store.design_matrix("AAPL", ind)
+    assert store.read("AAPL").meta["gen"] == gen
+    _assert_matches_prepare_features(X, y, ind)
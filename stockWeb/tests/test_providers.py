@@ -0,0 +1,32 @@
+# tests/test_providers.py
+import providers
+
+
+class BulkRejected(providers.SyntheticProvider):
+    """
+    A remote provider whose bulk call fails as a whole, as yf.download does
+    over one bad symbol or an empty (throttled) answer.
+    """
+    name = "bulk-rejected"
+    remote = True
+
+    def __init__(self):
+        super().__init__()
+        self.single = []
+
+    def history_many(self, symbols, period, interval):
+        raise providers.NoData("No data for symbols: " + ", ".join(symbols))
+
+    def history(self, symbol, period, interval):
+        self.single.append(symbol)
+        return providers.synthetic_price_history(symbol, period=period, interval=interval)
+
+
+def test_fetch_many_falls_back_to_single_fetches_when_the_bulk_call_raises():
+    provider = BulkRejected()
+    got, error = provider.fetch_many(["AAPL", "MSFT", "NVDA"], "1y", "1d")
+    assert error is None
+    assert sorted(got) == ["AAPL", "MSFT", "NVDA"]
+    assert sorted(provider.single) == ["AAPL", "MSFT", "NVDA"]
+    assert provider.guard.breaker.state == "closed"
+    assert all(len(df) for df in got.values())
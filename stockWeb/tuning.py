@@ -0,0 +1,244 @@
+# tuning.py
+"""
+Time-budgeted hyperparameter search for the per-symbol forest.
+
+    python tuning.py AAPL MSFT --budget 60            # seconds per symbol
+    python tuning.py --all --budget 20 --period 2y    # every symbol in tickers.csv
+
+Candidates (forest size, depth, leaf size and n_lags) are compared by
+successive halving over time-series CV folds: every candidate is scored on the
+first folds (the shortest, cheapest training windows), the best 1/ETA go on to
+be scored on the next, longer ones as well, and so on until one is left or the
+budget runs out, so most of the time goes to the promising candidates on the
+most recent data. The folds are spread over the rungs so that the last one
+(the final 1/ETA) is scored on all of them, the newest included. The winner
+is stored in model_registry, and predict_service uses it for later
+predictions of that symbol.
+
+Work is shared between candidates: one design matrix per n_lags (from the
+feature store when enabled), one set of fold splits per matrix length, and
+fold scores cached in the cache_store backend under the data's last bar, so
+re-running with a larger budget only fits what is new. Candidates run on a
+thread pool; forest fitting releases the GIL, and the threads share the
+matrices without copying them. Fits still running when the budget runs out
+are waited for (their scores are cached like the others), so a symbol can
+overrun its budget by one fit but never overlaps the next one.
+"""
+import os
+import time
+import json
+import random
+import itertools
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from startup import lazy_module
+from cache_store import get_cache
+import model_predict
+import model_registry
+from feature_store import FEATURE_VERSION
+
+np = lazy_module("numpy")
+sk_model_selection = lazy_module("sklearn.model_selection")
+sk_metrics = lazy_module("sklearn.metrics")
+
+TUNE_WORKERS = int(os.getenv("STOCKSENSE_TUNE_WORKERS", os.cpu_count() or 2))
+TUNE_FOLDS = int(os.getenv("STOCKSENSE_TUNE_FOLDS", 4))
+TUNE_CANDIDATES = int(os.getenv("STOCKSENSE_TUNE_CANDIDATES", 27))
+ETA = 3
+# fold scores are kept this long for re-runs on the same data
+FOLD_TTL = 7 * 24 * 3600
+
+SEARCH_SPACE = {
+    "n_estimators": [50, 100, 200, 400],
+    "max_depth": [None, 6, 12, 24],
+    "min_samples_leaf": [1, 3, 10],
+    "n_lags": [5, 10, 20],
+}
+# today's fixed model, always among the candidates
+BASELINE = {"n_estimators": 200, "max_depth": None, "min_samples_leaf": 1, "n_lags": 10}
+
+
+def candidates(n=TUNE_CANDIDATES, seed=0):
+    """
+    The baseline plus a deterministic random sample of the search space.
+    """
+    keys = list(SEARCH_SPACE)
+    grid = [dict(zip(keys, values)) for values in itertools.product(*SEARCH_SPACE.values())]
+    grid = [c for c in grid if c != BASELINE]
+    random.Random(seed).shuffle(grid)
+    return [dict(BASELINE)] + grid[:max(0, n - 1)]
+
+
+def _cid(cand):
+    return json.dumps(cand, sort_keys=True)
+
+
+def rungs(n_candidates, folds, eta=ETA):
+    """
+    Number of folds scored at each rung of a halving from n_candidates down
+    to one, spread so the last rung scores all of them.
+    """
+    n, count = n_candidates, 0
+    while n > 1:
+        n = max(1, n // eta)
+        count += 1
+    count = max(1, count)
+    return [-(-folds * (r + 1) // count) for r in range(count)]
+
+
+class Search:
+    """
+    One successive halving run over a symbol's indicator frame.
+    """
+    def __init__(self, symbol, df_ind, interval="1d", folds=TUNE_FOLDS):
+        self.symbol = symbol
+        self.df = df_ind
+        self.interval = interval
+        self.folds = folds
+        self._matrices = {}
+        self._splits = {}
+        self.scores = {}   # cid -> {fold: rmse}
+        self.fits = 0
+        last = df_ind['date'].iloc[-1] if 'date' in df_ind.columns else df_ind.index[-1]
+        self._fingerprint = "%s:%s:%d:%s" % (symbol.upper(), interval, len(df_ind), last)
+
+    def matrix(self, n_lags):
+        if n_lags not in self._matrices:
+            X, y, _ = model_predict.design_matrix(self.df, n_lags=n_lags, symbol=self.symbol,
+                                                  interval=self.interval)
+            self._matrices[n_lags] = (np.asarray(X), np.asarray(y))
+        return self._matrices[n_lags]
+
+    def split(self, n_rows):
+        if n_rows not in self._splits:
+            tscv = sk_model_selection.TimeSeriesSplit(n_splits=self.folds)
+            self._splits[n_rows] = list(tscv.split(np.empty(n_rows)))
+        return self._splits[n_rows]
+
+    def _fold_key(self, cand, fold):
+        return "tunefold:%s:%s:%s:%d" % (FEATURE_VERSION, self._fingerprint, _cid(cand), fold)
+
+    def score_fold(self, cand, fold):
+        cache = get_cache()
+        key = self._fold_key(cand, fold)
+        rmse = cache.get(key)
+        if rmse is None:
+            X, y = self.matrix(cand["n_lags"])
+            train_idx, test_idx = self.split(len(X))[fold]
+            params = {k: v for k, v in cand.items() if k != "n_lags"}
+            m = model_predict.make_forest(params)
+            m.fit(X[train_idx], y[train_idx])
+            rmse = float(np.sqrt(sk_metrics.mean_squared_error(y[test_idx], m.predict(X[test_idx]))))
+            cache.set(key, rmse, ttl=FOLD_TTL)
+            self.fits += 1
+        return rmse
+
+    def ranking(self, pool):
+        """
+        Candidates ordered best first: most folds scored, then mean RMSE.
+        """
+        def key(cand):
+            s = self.scores.get(_cid(cand), {})
+            return (-len(s), sum(s.values()) / len(s) if s else float("inf"))
+        return sorted(pool, key=key)
+
+    def run(self, cands, budget, workers=TUNE_WORKERS):
+        deadline = time.monotonic() + budget
+        # build the matrices up front so the candidates only fit
+        for n_lags in sorted({c["n_lags"] for c in cands}):
+            self.matrix(n_lags)
+        alive = list(cands)
+        pool = ThreadPoolExecutor(max_workers=max(1, workers))
+        try:
+            for n_folds in rungs(len(alive), self.folds):
+                if len(alive) <= 1 or time.monotonic() >= deadline:
+                    break
+                jobs = {}
+                for cand in alive:
+                    # a candidate still in the race is scored on folds 0..n_folds-1
+                    for fold in range(n_folds):
+                        if fold not in self.scores.get(_cid(cand), {}):
+                            jobs[pool.submit(self.score_fold, cand, fold)] = (cand, fold)
+                pending = set(jobs)
+                while pending:
+                    left = deadline - time.monotonic()
+                    if left <= 0:
+                        break
+                    done, pending = wait(pending, timeout=left, return_when=FIRST_COMPLETED)
+                    for fut in done:
+                        cand, fold = jobs[fut]
+                        self.scores.setdefault(_cid(cand), {})[fold] = fut.result()
+                if pending:
+                    break
+                alive = self.ranking(alive)[:max(1, len(alive) // ETA)]
+        finally:
+            # drop the queued fits, but let the running ones finish rather than
+            # compete for the CPU with whatever runs next
+            pool.shutdown(wait=True, cancel_futures=True)
+        best = self.ranking(cands)[0]
+        return best, self.scores.get(_cid(best), {})
+
+
+def tune_symbol(symbol, period="2y", interval="1d", budget=60.0, n_candidates=TUNE_CANDIDATES,
+                workers=TUNE_WORKERS, save=True):
+    """
+    Search a configuration for one symbol within `budget` seconds and store
+    it in the model registry. Returns the registry entry (or just the result
+    if save is False, or if the budget ran out before anything was scored).
+    """
+    from predict_service import get_indicators, _model_frame, _key
+    t0 = time.monotonic()
+    df_ind = _model_frame(get_indicators(symbol, period=period, interval=interval))
+    search = Search(symbol, df_ind, interval=interval)
+    best, folds = search.run(candidates(n_candidates), max(0.0, budget - (time.monotonic() - t0)),
+                             workers=workers)
+    info = {
+        "rmse": sum(folds.values()) / len(folds) if folds else None,
+        "folds_scored": len(folds),
+        "candidates": n_candidates,
+        "fits": search.fits,
+        "seconds": round(time.monotonic() - t0, 2),
+        "period": period,
+    }
+    params = {k: v for k, v in best.items() if k != "n_lags"}
+    if not save or not folds:
+        return dict(info, params=params, n_lags=best["n_lags"])
+    entry = model_registry.set_config(symbol, interval, params, best["n_lags"], **info)
+    # the cached prediction was made with the old configuration
+    get_cache().delete(_key("prediction", symbol, period, interval))
+    return entry
+
+
+if __name__ == "__main__":
+    import argparse
+    import warnings
+    from util_data import load_tickers_csv
+
+    warnings.filterwarnings("ignore")
+    ap = argparse.ArgumentParser(description="Tune the forest per symbol and store the winners")
+    ap.add_argument("symbols", nargs="*")
+    ap.add_argument("--all", action="store_true", help="every symbol in tickers.csv")
+    ap.add_argument("--budget", type=float, default=60.0, help="seconds per symbol")
+    ap.add_argument("--period", default="2y")
+    ap.add_argument("--interval", default="1d")
+    ap.add_argument("--candidates", type=int, default=TUNE_CANDIDATES)
+    ap.add_argument("--workers", type=int, default=TUNE_WORKERS)
+    ap.add_argument("--dry-run", action="store_true", help="don't write the registry")
+    args = ap.parse_args()
+    symbols = [s for s, _ in load_tickers_csv()] if args.all else [s.upper() for s in args.symbols]
+    if not symbols:
+        ap.error("give symbols or --all")
+    for sym in symbols:
+        try:
+            entry = tune_symbol(sym, period=args.period, interval=args.interval, budget=args.budget,
+                                n_candidates=args.candidates, workers=args.workers,
+                                save=not args.dry_run)
+        except Exception as e:
+            print("%-8s failed: %s" % (sym, e))
+            continue
+        if not entry["folds_scored"]:
+            print("%-8s budget too small, nothing stored" % sym)
+            continue
+        print("%-8s n_lags=%-3d %s  rmse=%.4f  folds=%d fits=%d %.1fs" % (
+            sym, entry["n_lags"], json.dumps(entry["params"]), entry["rmse"] or float("nan"),
+            entry["folds_scored"], entry["fits"], entry["seconds"]))
@@ -0,0 +1,421 @@
+# upstream.py
+"""
+Protection around calls to remote market data providers (see providers.py).
+
+Each remote provider has its own Guard:
+
+- a token bucket caps the request rate to the provider
+  (STOCKSENSE_UPSTREAM_RATE requests/s with bursts of STOCKSENSE_UPSTREAM_BURST)
+  across all workers: kept in Redis (a counter per window) or in a locked
+  file next to the file cache when STOCKSENSE_CACHE is one of those,
+  otherwise each process gets 1/STOCKSENSE_WORKERS of the rate and burst
+- failed calls are retried with jittered exponential backoff
+- a circuit breaker stops calling the provider after repeated failures and
+  lets one trial call through after STOCKSENSE_BREAKER_RESET seconds
+
+stale_fallback() wraps the whole provider chain: every good result is kept as
+the "last known" copy, and when no provider is available that copy is served
+with a stale flag instead of an error. For STOCKSENSE_STALE_RETRY seconds
+after that the copy is served straight away, so the several fetches of one
+request (ETag probe, body) don't each sit through the retries again. Counters
+are exported on /metrics.
+
+Last known copies are kept apart from the main cache, so that week-long
+entries neither take its room nor push fresh ones out: by default in a
+per-process LRU of STOCKSENSE_STALE_ITEMS entries, or in the backend given by
+STOCKSENSE_STALE_CACHE (a cache_store URL, e.g. file:/var/cache/stocksense-
+lastgood to share them between workers).
+"""
+import os
+import time
+import random
+import logging
+import threading
+
+from cache_store import get_cache, make_cache, LRUCache, FileCache, RedisCache
+from metrics import Counter, Histogram, register
+
+try:
+    import fcntl
+except ImportError:  # not on Windows: the per-process share of the rate applies
+    fcntl = None
+
+log = logging.getLogger(__name__)
+
+RATE = float(os.getenv("STOCKSENSE_UPSTREAM_RATE", 5))
+BURST = int(os.getenv("STOCKSENSE_UPSTREAM_BURST", 10))
+# server processes sharing the rate when the limiter can't be shared (gunicorn.conf.py sets it)
+WORKERS = max(1, int(os.getenv("STOCKSENSE_WORKERS", 1)))
+MAX_WAIT = float(os.getenv("STOCKSENSE_UPSTREAM_MAX_WAIT", 5))
+RETRIES = int(os.getenv("STOCKSENSE_UPSTREAM_RETRIES", 3))
+BACKOFF_BASE = float(os.getenv("STOCKSENSE_UPSTREAM_BACKOFF", 0.5))
+BACKOFF_CAP = float(os.getenv("STOCKSENSE_UPSTREAM_BACKOFF_CAP", 8))
+BREAKER_FAILURES = int(os.getenv("STOCKSENSE_BREAKER_FAILURES", 5))
+BREAKER_RESET = float(os.getenv("STOCKSENSE_BREAKER_RESET", 30))
+# how long the last known copy is kept for stale fallback
+STALE_TTL = int(os.getenv("STOCKSENSE_STALE_TTL", 7 * 24 * 3600))
+# after a fallback, serve the last known copy without retrying for this long
+STALE_RETRY = int(os.getenv("STOCKSENSE_STALE_RETRY", 15))
+# where last known copies are kept: "" for a per-process LRU of STALE_ITEMS
+STALE_CACHE = os.getenv("STOCKSENSE_STALE_CACHE", "")
+STALE_ITEMS = int(os.getenv("STOCKSENSE_STALE_ITEMS", 256))
+
+UPSTREAM_CALLS = register(Counter("stocksense_upstream_calls_total",
+                                  "Provider calls by outcome", ("provider", "outcome")))
+UPSTREAM_RETRIES = register(Counter("stocksense_upstream_retries_total",
+                                    "Provider calls retried after a failure", ("provider", "reason")))
+BREAKER_EVENTS = register(Counter("stocksense_breaker_transitions_total",
+                                  "Circuit breaker state changes", ("provider", "state")))
+STALE_SERVED = register(Counter("stocksense_stale_served_total",
+                                "Requests answered from the last known copy", ("reason",)))
+LIMITER_WAIT = register(Histogram("stocksense_limiter_wait_seconds",
+                                  "Time spent waiting for a rate limiter token", ()))
+
+
+class UpstreamUnavailable(Exception):
+    """
+    No provider could be reached and there is no stored copy to fall back on.
+    """
+    def __init__(self, message, retry_after=None, reason="error"):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class Throttled(Exception):
+    pass
+
+
+def is_throttle(exc):
+    """
+    True if an exception from the provider means we are being rate limited.
+    """
+    if isinstance(exc, Throttled):
+        return True
+    name = type(exc).__name__.lower()
+    text = str(exc).lower()
+    return "ratelimit" in name or "too many requests" in text or "rate limit" in text or "429" in text
+
+
+def _refill(tokens, updated, now, rate, burst):
+    return min(burst, tokens + max(0.0, now - updated) * rate)
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, max_wait=MAX_WAIT):
+        """
+        Take a token, sleeping until one is available. Returns False if that
+        would take longer than max_wait seconds.
+        """
+        if self.rate <= 0:
+            return True
+        deadline = time.monotonic() + max_wait
+        started = time.monotonic()
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = _refill(self._tokens, self._updated, now, self.rate, self.burst)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    LIMITER_WAIT.observe((), now - started)
+                    return True
+                wait = (1 - self._tokens) / self.rate
+            if time.monotonic() + wait > deadline:
+                LIMITER_WAIT.observe((), time.monotonic() - started)
+                return False
+            time.sleep(wait)
+
+
+class FileBucket:
+    """
+    Token bucket whose state ("tokens updated") sits in a file locked with
+    flock, so every process on the host draws from the same bucket.
+    """
+    def __init__(self, path, rate, burst):
+        self.path = path
+        self.rate = rate
+        self.burst = burst
+
+    def _take(self):
+        """
+        Take a token if there is one; returns the seconds until there will
+        be one (0 when taken).
+        """
+        with open(self.path, "a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                try:
+                    tokens, updated = (float(v) for v in f.read().split())
+                except ValueError:
+                    tokens, updated = float(self.burst), time.time()
+                now = time.time()
+                tokens = _refill(tokens, updated, now, self.rate, self.burst)
+                wait = 0.0
+                if tokens >= 1:
+                    tokens -= 1
+                else:
+                    wait = (1 - tokens) / self.rate
+                f.seek(0)
+                f.truncate()
+                f.write("%r %r" % (tokens, now))
+                f.flush()
+                return wait
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def acquire(self, max_wait=MAX_WAIT):
+        started = time.monotonic()
+        while True:
+            wait = self._take()
+            if not wait:
+                LIMITER_WAIT.observe((), time.monotonic() - started)
+                return True
+            if time.monotonic() + wait > started + max_wait:
+                LIMITER_WAIT.observe((), time.monotonic() - started)
+                return False
+            time.sleep(wait)
+
+
+class RedisBucket:
+    """
+    Limiter shared through Redis: at most `burst` calls per burst/rate second
+    window (at least one second), counted with an INCR on a key per window
+    that expires after it, so hosts and workers all draw from it. A fixed
+    window rather than a bucket, which Redis can't refill without a script.
+    """
+    def __init__(self, client, name, rate, burst):
+        self.client = client
+        self.name = name
+        self.window = max(1.0, burst / rate)
+        self.limit = max(1, int(round(rate * self.window)))
+
+    def acquire(self, max_wait=MAX_WAIT):
+        started = time.monotonic()
+        while True:
+            now = time.time()
+            slot = int(now // self.window)
+            key = "ratelimit:%s:%d" % (self.name, slot)
+            pipe = self.client.pipeline()
+            pipe.incr(key)
+            pipe.expire(key, int(self.window) + 1)
+            count, _ = pipe.execute()
+            if count <= self.limit:
+                LIMITER_WAIT.observe((), time.monotonic() - started)
+                return True
+            wait = (slot + 1) * self.window - now
+            if time.monotonic() + wait > started + max_wait:
+                LIMITER_WAIT.observe((), time.monotonic() - started)
+                return False
+            time.sleep(wait)
+
+
+def make_limiter(name, rate, burst):
+    """
+    The rate limiter for one provider, shared by all workers when the cache
+    backend allows it (see the module docstring).
+    """
+    if rate > 0:
+        cache = get_cache()
+        if isinstance(cache, RedisCache):
+            return RedisBucket(cache.client, name, rate, burst)
+        if isinstance(cache, FileCache) and fcntl is not None:
+            return FileBucket(os.path.join(cache.directory, "ratelimit-%s" % name), rate, burst)
+    return TokenBucket(rate / WORKERS, max(1, -(-burst // WORKERS)))
+
+
+class CircuitBreaker:
+    """
+    closed -> open after `failures` consecutive failures; open -> half-open
+    after `reset` seconds, where a single trial call decides between closed
+    and open again.
+    """
+    def __init__(self, name="upstream", failures=BREAKER_FAILURES, reset=BREAKER_RESET):
+        self.name = name
+        self.failures = failures
+        self.reset = reset
+        self.state = "closed"
+        self._count = 0
+        self._opened_at = 0.0
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def _set(self, state):
+        if state != self.state:
+            log.warning("%s circuit breaker %s -> %s", self.name, self.state, state)
+            self.state = state
+            BREAKER_EVENTS.inc((self.name, state))
+
+    def allow(self):
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.reset:
+                self._set("half-open")
+                self._trial = False
+            if self.state == "half-open" and not self._trial:
+                self._trial = True
+                return True
+            return False
+
+    def retry_after(self):
+        with self._lock:
+            if self.state != "open":
+                return 1
+            return max(1, int(self.reset - (time.monotonic() - self._opened_at)))
+
+    def release(self):
+        """
+        End a call that says nothing about the provider's health (a permanent
+        error): a half-open trial slot is freed, the state is left as it is.
+        """
+        with self._lock:
+            self._trial = False
+
+    def record_success(self):
+        with self._lock:
+            self._count = 0
+            self._trial = False
+            self._set("closed")
+
+    def record_failure(self):
+        with self._lock:
+            self._count += 1
+            self._trial = False
+            if self.state == "half-open" or self._count >= self.failures:
+                self._opened_at = time.monotonic()
+                self._set("open")
+
+
+def backoff_delay(attempt, base=BACKOFF_BASE, cap=BACKOFF_CAP):
+    """
+    "Full jitter" backoff: uniform in [0, min(cap, base * 2**attempt)].
+    """
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class Guard:
+    """
+    Rate limiter, retries and circuit breaker for one provider.
+    """
+    def __init__(self, name, rate=RATE, burst=BURST, retries=RETRIES):
+        self.name = name
+        self.limiter = make_limiter(name, rate, burst)
+        self.breaker = CircuitBreaker(name)
+        self.retries = retries
+
+    def _call_with_retry(self, fn, permanent):
+        last = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(backoff_delay(attempt - 1))
+            if not self.limiter.acquire():
+                UPSTREAM_CALLS.inc((self.name, "limited"))
+                raise UpstreamUnavailable("%s rate limit reached" % self.name, retry_after=1,
+                                          reason="rate_limited")
+            try:
+                result = fn()
+            except permanent:
+                UPSTREAM_CALLS.inc((self.name, "rejected"))
+                raise
+            except Exception as e:
+                last = e
+                reason = "throttled" if is_throttle(e) else "error"
+                UPSTREAM_CALLS.inc((self.name, reason))
+                if attempt < self.retries:
+                    UPSTREAM_RETRIES.inc((self.name, reason))
+                continue
+            UPSTREAM_CALLS.inc((self.name, "ok"))
+            return result
+        raise last
+
+    def call(self, fn, permanent=(ValueError,)):
+        """
+        Run fn() through the limiter, retries and breaker.
+
+        Raises UpstreamUnavailable when the breaker is open, the limiter is
+        exhausted or every retry failed. Exceptions in `permanent` (e.g.
+        unknown symbol) are not retried, do not count against the breaker and
+        are re-raised unchanged; they don't close the breaker either.
+        """
+        if not self.breaker.allow():
+            raise UpstreamUnavailable("%s circuit open" % self.name,
+                                      retry_after=self.breaker.retry_after(), reason="breaker_open")
+        try:
+            result = self._call_with_retry(fn, permanent)
+        except permanent:
+            self.breaker.release()
+            raise
+        except UpstreamUnavailable:
+            raise
+        except Exception as e:
+            self.breaker.record_failure()
+            log.warning("%s call failed after retries: %s", self.name, e)
+            raise UpstreamUnavailable("%s unavailable: %s" % (self.name, e),
+                                      retry_after=self.breaker.retry_after(),
+                                      reason="throttled" if is_throttle(e) else "error") from e
+        self.breaker.record_success()
+        return result
+
+
+_last_known = None
+_last_known_lock = threading.Lock()
+
+
+def _last_known_store():
+    global _last_known
+    if _last_known is None:
+        with _last_known_lock:
+            if _last_known is None:
+                _last_known = (make_cache(STALE_CACHE) if STALE_CACHE
+                               else LRUCache(max_items=STALE_ITEMS, ttl=STALE_TTL))
+    return _last_known
+
+
+def remember(key, value):
+    """
+    Store `value` as the last known copy for `key` (done by stale_fallback()
+    for single calls; bulk fetches call this directly). Callers pass the
+    smallest form they can serve from, not the full result.
+    """
+    _last_known_store().set("lastgood:" + key, value, ttl=STALE_TTL)
+
+
+def stale_fallback(key, fn, keep=None):
+    """
+    Returns (fn(), False) and stores the result, or keep(result), as the last
+    known copy under `key`. If fn() raises UpstreamUnavailable the last known
+    copy is returned as (copy, True) instead, or the exception propagates
+    when there is none; for STALE_RETRY seconds after that the copy is
+    returned without calling fn.
+    """
+    cache = get_cache()
+    store = _last_known_store()
+    stale_key = "lastgood:" + key
+    outage_key = "outage:" + key
+    reason = cache.get(outage_key) if STALE_RETRY > 0 else None
+    if reason is not None:
+        value = store.get(stale_key)
+        if value is not None:
+            STALE_SERVED.inc((reason,))
+            return value, True
+    try:
+        result = fn()
+    except UpstreamUnavailable as e:
+        value = store.get(stale_key)
+        if value is None:
+            raise
+        STALE_SERVED.inc((e.reason,))
+        if STALE_RETRY > 0:
+            cache.set(outage_key, e.reason, ttl=STALE_RETRY)
+        return value, True
+    remember(key, result if keep is None else keep(result))
+    return result, False
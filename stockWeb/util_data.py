@@ -1,12 +1,24 @@
 # util_data.py
-import yfinance as yf
-import pandas as pd
-import numpy as np
-from ta.trend import SMAIndicator, EMAIndicator, MACD
-from ta.volatility import BollingerBands
-from ta.momentum import RSIIndicator
 import os
+import csv
+import time
 from difflib import get_close_matches
+from cache_store import get_cache, HISTORY_TTL
+from startup import lazy_module
+from metrics import timed
+import upstream
+import providers
+
+# heavy modules are imported on first use (see startup.py)
+pd = lazy_module("pandas")
+np = lazy_module("numpy")
+ta_trend = lazy_module("ta.trend")
+ta_volatility = lazy_module("ta.volatility")
+ta_momentum = lazy_module("ta.momentum")
+
+# set STOCKSENSE_COMPACT=1 to cache histories as float32 CompactHistory objects
+# (see compact_frame.py) instead of full yfinance frames
+COMPACT = os.getenv("STOCKSENSE_COMPACT", "") not in ("", "0", "false")
 
 # small default ticker list for suggestions (common names)
 DEFAULT_TICKERS = [
@@ -29,10 +41,12 @@ def load_tickers_csv(path="tickers.csv"):
     """
     if os.path.exists(path):
         try:
-            df = pd.read_csv(path, dtype=str)
-            # expect columns symbol,name
-            if "symbol" in df.columns and "name" in df.columns:
-                return list(zip(df["symbol"].str.upper().tolist(), df["name"].tolist()))
+            # plain csv module so loading the list doesn't pull in pandas
+            with open(path, newline="", encoding="utf-8") as f:
+                reader = csv.DictReader(f)
+                # expect columns symbol,name
+                if reader.fieldnames and "symbol" in reader.fieldnames and "name" in reader.fieldnames:
+                    return [(row["symbol"].upper(), row["name"]) for row in reader]
         except Exception:
             pass
     return DEFAULT_TICKERS
@@ -80,21 +94,122 @@ def suggest_tickers(query, max_suggestions=20):
                 if len(out) >= max_suggestions: break
     return out
 
+def _last_good(df):
+    # all a stale answer needs is the prices: keep them as float32 columns
+    from compact_frame import CompactHistory
+    return CompactHistory.from_frame(df)
+
+def _download_history(symbol, period, interval):
+    """
+    History from the provider chain (see providers.py). If no provider can be
+    reached the last good copy (Open/High/Low/Close/Volume, float32) is
+    returned with df.attrs["stale"] set.
+    """
+    key = "history:%s:%s:%s" % (symbol.upper(), period, interval)
+    df, stale = upstream.stale_fallback(key, lambda: providers.download(symbol, period, interval),
+                                        keep=_last_good)
+    if stale:
+        df = df.ohlcv_frame()
+        df.attrs["stale"] = True
+    else:
+        df.attrs["fetched_at"] = time.time()
+    return df
+
+def _cached_history(symbol, period, interval):
+    # the cached frame itself; callers must not modify it
+    cache = get_cache()
+    key = "history:%s:%s:%s" % (symbol.upper(), period, interval)
+    df = cache.get(key)
+    if df is None:
+        df = _download_history(symbol, period, interval)
+        # stale copies are not cached so the next request tries the provider again
+        if not df.attrs.get("stale"):
+            cache.set(key, df, ttl=HISTORY_TTL.get(interval, 3600))
+    return df
+
+@timed("fetch_price_history")
 def fetch_price_history(symbol, period="1y", interval="1d"):
     """
-    Fetch historical OHLCV for a ticker using yfinance.
+    Fetch historical OHLCV for a ticker from the configured providers.
     period examples: "1y","6mo","5y" ; interval examples: "1d","1h"
     Returns a dataframe with Date index and Open,High,Low,Close,Adj Close,Volume
+    Results are kept in the shared cache (see cache_store.py) for a TTL based on interval.
+    In compact mode only Open,High,Low,Close,Volume are returned, as float32.
     """
-    ticker = yf.Ticker(symbol)
-    df = ticker.history(period=period, interval=interval, auto_adjust=False)
-    if df is None or df.empty:
-        raise ValueError("No data for symbol: " + symbol)
-    # ensure index is datetime
-    df = df.copy()
-    df.index = pd.to_datetime(df.index)
-    return df
+    if COMPACT:
+        return _compact_history(symbol, period, interval).ohlcv_frame()
+    return _cached_history(symbol, period, interval).copy()
+
+@timed("etag_probe")
+def latest_bar(symbol, period="1y", interval="1d"):
+    """
+    (epoch seconds, close, stale, fresh_for) of the most recent bar, read
+    from the cached history without copying it; fresh_for is how many more
+    seconds the cached copy will be served before it is fetched again. Used
+    to build ETags and Cache-Control.
+    """
+    if COMPACT:
+        hist = _compact_history(symbol, period, interval)
+        ts, close, stale = int(hist.ts[-1]), float(hist.close[-1]), hist.stale
+        # unset on copies cached before fetched_at existed
+        fetched_at = getattr(hist, "fetched_at", 0.0)
+    else:
+        df = _cached_history(symbol, period, interval)
+        ts, close = int(pd.Timestamp(df.index[-1]).timestamp()), float(df['Close'].iloc[-1])
+        stale, fetched_at = bool(df.attrs.get("stale")), df.attrs.get("fetched_at", 0.0)
+    fresh_for = max(0.0, fetched_at + HISTORY_TTL.get(interval, 3600) - time.time())
+    return ts, close, stale, fresh_for
+
+@timed("fetch_compact_history")
+def fetch_compact_history(symbol, period="1y", interval="1d"):
+    """
+    Like fetch_price_history but returns a CompactHistory with its indicator
+    block already filled. The cached object is shared: treat it as read-only.
+    """
+    return _compact_history(symbol, period, interval)
+
+def _compact_history(symbol, period, interval):
+    from compact_frame import CompactHistory, compute_indicators_compact
+    cache = get_cache()
+    key = "compact:%s:%s:%s" % (symbol.upper(), period, interval)
+    hist = cache.get(key)
+    if hist is None:
+        hist = CompactHistory.from_frame(_download_history(symbol, period, interval))
+        compute_indicators_compact(hist)
+        if not hist.stale:
+            cache.set(key, hist, ttl=HISTORY_TTL.get(interval, 3600))
+    return hist
+
+@timed("prefetch_histories")
+def prefetch_histories(symbols, period="1y", interval="1d"):
+    """
+    Fill the history cache for many symbols with shared provider calls (see
+    providers.download_many), so the per-symbol fetches that follow are cache
+    hits. Returns {symbol: exception} for the symbols no provider returned;
+    those left unavailable can still be served stale by the per-symbol path.
+    """
+    cache = get_cache()
+    kind = "compact" if COMPACT else "history"
+    missing = [s for s in symbols
+               if cache.get("%s:%s:%s:%s" % (kind, s.upper(), period, interval)) is None]
+    if not missing:
+        return {}
+    frames, errors = providers.download_many(missing, period, interval)
+    ttl = HISTORY_TTL.get(interval, 3600)
+    for symbol, df in frames.items():
+        key = "history:%s:%s:%s" % (symbol.upper(), period, interval)
+        df.attrs["fetched_at"] = time.time()
+        upstream.remember(key, _last_good(df))
+        if COMPACT:
+            from compact_frame import CompactHistory, compute_indicators_compact
+            hist = CompactHistory.from_frame(df)
+            compute_indicators_compact(hist)
+            cache.set("compact" + key[len("history"):], hist, ttl=ttl)
+        else:
+            cache.set(key, df, ttl=ttl)
+    return errors
 
+@timed("compute_indicators")
 def compute_indicators(df):
     """
     Accepts a df with 'Close' column, returns DataFrame with columns added:
@@ -109,18 +224,18 @@ def compute_indicators(df):
     close = out['Close'].fillna(method='ffill')
 
     # SMA
-    out['sma7'] = SMAIndicator(close, window=7, fillna=True).sma_indicator()
-    out['sma30'] = SMAIndicator(close, window=30, fillna=True).sma_indicator()
+    out['sma7'] = ta_trend.SMAIndicator(close, window=7, fillna=True).sma_indicator()
+    out['sma30'] = ta_trend.SMAIndicator(close, window=30, fillna=True).sma_indicator()
     # EMA(20) as example
-    out['ema20'] = EMAIndicator(close, window=20, fillna=True).ema_indicator()
+    out['ema20'] = ta_trend.EMAIndicator(close, window=20, fillna=True).ema_indicator()
     # RSI
-    out['rsi'] = RSIIndicator(close, window=14, fillna=True).rsi()
+    out['rsi'] = ta_momentum.RSIIndicator(close, window=14, fillna=True).rsi()
     # MACD
-    macd = MACD(close, window_slow=26, window_fast=12, window_sign=9)
+    macd = ta_trend.MACD(close, window_slow=26, window_fast=12, window_sign=9)
     out['macd'] = macd.macd()
     out['macd_signal'] = macd.macd_signal()
     # Bollinger Bands
-    bb = BollingerBands(close, window=20, window_dev=2)
+    bb = ta_volatility.BollingerBands(close, window=20, window_dev=2)
     out['bb_high'] = bb.bollinger_hband()
     out['bb_low'] = bb.bollinger_lband()
     # volatility (20-day rolling std of returns annualized approx)
@@ -157,5 +272,6 @@ def compute_indicators(df):
 
     # Ensure date is datetime type
     res['date'] = pd.to_datetime(res['date'])
+    res.attrs["stale"] = bool(df.attrs.get("stale"))
 
     return res
@@ -0,0 +1,32 @@
+# wsgi.py
+"""
+Production entry point. Run with:
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+gunicorn.conf.py sets preload_app, so this module is imported once in the
+master process. Everything loaded here (pandas, sklearn, ta, yfinance, the
+VADER lexicon, the ticker list) is inherited by the forked workers and shared
+copy-on-write instead of being imported again in every worker.
+"""
+import gc
+import os
+
+# import pandas, sklearn, ... and build the VADER analyzer during the app
+# import rather than lazily in each worker (see startup.py)
+os.environ.setdefault("STOCKSENSE_PRELOAD", "eager")
+
+import util_data
+from app import app, get_analyzer
+
+# touch the heavy state so it is materialised before fork
+_ = util_data._TICKER_DB
+get_analyzer().polarity_scores("warm up")
+
+# move everything allocated so far into the permanent generation; the
+# collector in each worker then never writes to these objects' pages, which
+# keeps them shared with the master
+gc.collect()
+gc.freeze()
+
+application = app